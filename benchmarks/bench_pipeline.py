@@ -0,0 +1,388 @@
+"""
+Time the pipeline end to end on synthetic run folders and Sciebo workbooks at production scale.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py [--runs 100 1000 10000] [--workers 1]
+                                        [--output benchmarks/pipeline_baseline.json] [--compare OLD_BASELINE.json]
+
+The synthetic trees are generated once per scale into --data-dir and reused as long as the generation
+parameters don't change. Every scale times 'main.process_folders' (cold, then incremental on the warm
+manifest), 'find_corresponding_sciebo' over all runs with an empty match cache and 'postprocess_dataframe'.
+The timings are written as JSON, '--compare' reports the ratios to an older baseline and exits with 1 when
+a timing got slower than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+from datetime import date, timedelta
+
+import numpy as np
+import openpyxl
+from openpyxl.cell.cell import MergedCell
+
+REPOSITORY_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+sys.path.insert(0, os.path.join(REPOSITORY_PATH, "src"))
+
+import config
+
+TEMPLATE_PATH = os.path.join(REPOSITORY_PATH, "data", "NGS-07_Template_Sequencing.xlsx")
+
+# Instrument ID, template sheet, sequencing kit and a flowcell ID pattern per sequencer
+INSTRUMENTS = [
+    ("NB501289", "nextseq 500/550 high output kit v2.5 (75 cycles)", "AH{}BGX7"),
+    ("A01742", "novaseq 6000 sp 100 cycles", "BH{}DRX3"),
+    ("M04404", "miseq reagent kit v3 (600-cycles)", "000000000-{}"),
+]
+# Bump whenever the generated trees change, so trees generated before are generated again
+TREE_VERSION = 2
+APPLICATIONS = ["mRNAseq", "3mRNAseq", "ATACseq", "ChIPseq", "16S", "WES", "scRNAseq", "miRNAseq"]
+PHIX_BARCODE = "GGGGGGGGGG+AGATCTCGGT"
+
+###############################################################################
+#--------------------------- Synthetic Run Trees -----------------------------#
+###############################################################################
+
+def generate_tree(tree_path, parameters):
+    """
+    Generate the run folders and Sciebo workbooks of one scale, unless they exist with the same parameters.
+
+    :param tree_path: Folder of the tree, gets a 'fastq' and a 'sciebo' subfolder.
+    :param parameters: The generation parameters (see 'main').
+    """
+    parameters_path = os.path.join(tree_path, "parameters.json")
+    if os.path.exists(parameters_path):
+        with open(parameters_path, 'r') as parameters_file:
+            if json.load(parameters_file) == parameters:
+                return
+    shutil.rmtree(tree_path, ignore_errors=True)
+
+    rng = random.Random(parameters['seed'])
+    np_rng = np.random.default_rng(parameters['seed'])
+    templates = XlsxProtocolTemplate(TEMPLATE_PATH)
+    try:
+        import xlwt
+    except ImportError:
+        xlwt = None
+        print("xlwt is not installed, generating .xlsx protocols only")
+
+    start = time.perf_counter()
+    first_date = date(2019, 1, 1)
+    heavy_runs = set(rng.sample(range(parameters['runs']), min(parameters['heavy_runs'], parameters['runs'])))
+    for i in range(parameters['runs']):
+        instrument, kit, flowcell_pattern = rng.choice(INSTRUMENTS)
+        # About three runs every two days, so most dates have several Sciebo candidates
+        run_date = (first_date + timedelta(days=i * 2 // 3)).strftime('%y%m%d')
+        flowcell = flowcell_pattern.format(''.join(rng.choice("ABCDEFGHJKLMNPRSTUVWXYZ0123456789") for _ in range(5)))
+        run_name = f"{run_date}_{instrument}_{i % 10000:04d}_{flowcell}"
+        run_path = os.path.join(tree_path, "fastq", run_name)
+
+        samples = rng.randint(parameters['samples_min'], parameters['samples_max'])
+        write_multiqc(run_path, samples, rng)
+        barcodes = parameters['heavy_barcodes'] if i in heavy_runs else parameters['barcodes']
+        write_stats_json(run_path, flowcell, samples, barcodes, np_rng)
+
+        if rng.random() < parameters['missing_protocols']:
+            continue
+        application = rng.choice(APPLICATIONS)
+        protocol_path = os.path.join(tree_path, "sciebo", f"20{run_date[:2]}", f"{run_date}_Bench{i}_Lab_{application}")
+        fields = {
+            'run_name': run_name, 'flowcell': flowcell[1:], 'kit': kit, 'project': f"#{run_date[:2]}-{i:04d} Benchmark",
+            'density': f"{rng.randint(80, 300)} K/mm²", 'clusters_pf': round(rng.uniform(0.7, 0.95), 3),
+            'yield': f"{rng.uniform(1, 120):.1f}".replace('.', ','), 'q30': round(rng.uniform(0.8, 0.96), 3),
+            'phix': rng.choice([1, 1.5, 2]),
+        }
+        if xlwt is not None and rng.random() < parameters['xls_protocols']:
+            write_xls_protocol(xlwt, protocol_path + ".xls", fields)
+        else:
+            templates.write(protocol_path + ".xlsx", fields)
+        if (i + 1) % 500 == 0:
+            print(f"  generated {i + 1}/{parameters['runs']} runs ({time.perf_counter() - start:.0f}s)")
+
+    with open(parameters_path, 'w') as parameters_file:
+        json.dump(parameters, parameters_file, indent=4)
+
+def write_multiqc(run_path, samples, rng):
+    multiqc_path = os.path.join(run_path, "multiqc", "multiqc_data")
+    os.makedirs(multiqc_path)
+    lines = ["Sample\ttotal\ttotal_yield\tperfectIndex\timperfectIndex\tyieldQ30\tqscore_sum"]
+    for i in range(samples):
+        reads = rng.randint(100_000, 60_000_000)
+        lines.append(f"Sample_{i:04d}\t{reads}\t{reads * 75}\t{int(reads * 0.97)}\t{int(reads * 0.03)}\t{reads * 70}\t{reads * 2600}")
+    reads = rng.randint(100_000, 5_000_000)
+    lines.append(f"undetermined\t{reads}\t{reads * 75}\t0\t0\t{reads * 60}\t{reads * 2000}")
+    with open(os.path.join(multiqc_path, "multiqc_bcl2fastq_bysample.txt"), 'w') as multiqc_file:
+        multiqc_file.write('\n'.join(lines) + '\n')
+
+def write_stats_json(run_path, flowcell, samples, barcodes, np_rng, lanes=4):
+    """ Write a bcl2fastq Stats.json with 'barcodes' unknown barcodes spread over the lanes """
+    stats_path = os.path.join(run_path, "Stats")
+    os.makedirs(stats_path)
+    conversion_results = [
+        {"LaneNumber": lane, "TotalClustersPF": 0,
+         "DemuxResults": [{"SampleId": f"Sample_{i:04d}", "NumberReads": int(np_rng.integers(1e5, 6e7))} for i in range(samples)]}
+        for lane in range(1, lanes + 1)
+    ]
+    with open(os.path.join(stats_path, "Stats.json"), 'w') as stats_file:
+        stats_file.write(f'{{\n  "Flowcell" : "{flowcell}",\n  "RunNumber" : 1,\n  "ConversionResults" : ')
+        json.dump(conversion_results, stats_file, indent=2)
+        stats_file.write(',\n  "UnknownBarcodes" : [')
+        for lane in range(1, lanes + 1):
+            lane_barcodes = random_barcodes(barcodes // lanes, np_rng)
+            counts = np_rng.zipf(1.5, len(lane_barcodes)) * 20
+            entries = ',\n'.join(f'      "{barcode}" : {count}' for barcode, count in zip(lane_barcodes, counts.tolist()))
+            entries += f',\n      "{PHIX_BARCODE}" : {int(np_rng.integers(1000, 90000))}'
+            separator = ',' if lane > 1 else ''
+            stats_file.write(f'{separator}\n    {{\n    "Lane" : {lane},\n    "Barcodes" : {{\n{entries}\n    }}\n    }}')
+        stats_file.write('\n  ]\n}\n')
+
+def random_barcodes(count, np_rng):
+    """ Unique random dual index barcodes (8+8) """
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    sequences = bases[np_rng.integers(0, 4, size=(count, 16))].view('S16').ravel()
+    return [f"{sequence[:8]}+{sequence[8:]}" for sequence in np.unique(sequences).astype(str)]
+
+class XlsxProtocolTemplate:
+    """ The sequencing protocol template, loaded once, with the value cells of the labels the parser reads """
+    LABELS = {
+        'run_name': "Run name", 'flowcell': "Flow Cell", 'kit': "Sequencing Kit", 'project': "Project",
+        'density': "Density", 'clusters_pf': "Clusters PF", 'yield': "Yield", 'q30': "Q30", 'phix': "phix [%]",
+    }
+
+    def __init__(self, template_path):
+        self.workbook = openpyxl.load_workbook(template_path)
+        self.value_cells = {}
+        for sheet in self.workbook.worksheets:
+            cells = {}
+            for row in sheet.iter_rows():
+                for cell in row:
+                    if not isinstance(cell.value, str):
+                        continue
+                    value_cell = sheet.cell(row=cell.row, column=cell.column + 1)
+                    if isinstance(value_cell, MergedCell):
+                        continue  # e.g. 'Flow Cell Type', the value of a label is the cell right next to it
+                    for field, label in self.LABELS.items():
+                        if field not in cells and label.lower() in cell.value.lower():
+                            cells[field] = value_cell
+            self.value_cells[sheet.title] = cells
+
+    def write(self, protocol_path, fields):
+        # The run values are on every sheet of a filled protocol: the parser scans all sheets and keeps the
+        # value of the last label found, so a blank sheet would clear the values of the sequencer's sheet
+        for cells in self.value_cells.values():
+            for field, cell in cells.items():
+                cell.value = fields[field]
+        os.makedirs(os.path.dirname(protocol_path), exist_ok=True)
+        self.workbook.save(protocol_path)
+
+def write_xls_protocol(xlwt, protocol_path, fields):
+    """ Older protocols: a single .xls sheet with the kit and project inside the label cells """
+    workbook = xlwt.Workbook()
+    sheet = workbook.add_sheet("Protocol")
+    rows = [
+        (f"Sequencing Kit: {fields['kit']}", None), (f"Project: {fields['project']}", None), ("PhiX [%]:", fields['phix']),
+        ("Run name", fields['run_name']), ("Flow Cell", fields['flowcell']), ("Cycles Read 1", 76), ("Cycles Index 1", 8),
+        ("Cycles Index 2", 8), ("Cycles Read 2", 0), ("Density", fields['density']), ("Clusters PF", fields['clusters_pf']),
+        ("Yield", fields['yield']), ("% >= Q30", fields['q30']),
+    ]
+    for i, (label, value) in enumerate(rows):
+        sheet.write(i, 0, label)
+        if value is not None:
+            sheet.write(i, 1, value)
+    os.makedirs(os.path.dirname(protocol_path), exist_ok=True)
+    workbook.save(protocol_path)
+
+###############################################################################
+#--------------------------------- Timings -----------------------------------#
+###############################################################################
+
+def time_scale(tree_path, state_path, workers, repeat):
+    """
+    Time the pipeline stages on one generated tree.
+
+    The pipeline modules read their paths from 'config' at import time, so they are pointed at the
+    tree through the 'current' symlink that 'main' switches between scales.
+    """
+    import main
+    import utils.sciebo_cache as sciebo_cache
+    import parsers.sciebo_parser as sciebo_parser
+    import utils.utilities as utils
+    from utils.run_id import parse_run_ids
+
+    main.setup_logging()
+
+    def reset_state():
+        shutil.rmtree(state_path, ignore_errors=True)
+        os.makedirs(state_path)
+        sciebo_cache._cache = None
+        sciebo_cache._pending.clear()
+        sciebo_parser.reset_sciebo_index()
+
+    run_ids = parse_run_ids(os.listdir(config.FASTQ_FOLDER_PATH))
+    timings = {}
+
+    def timed(name, function):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        return result
+
+    def process_folders(incremental):
+        # Parsing, and building the DataFrame and sample table from the records, as in 'main.build_statistics'
+        records = main.process_folders(run_ids, workers=workers, incremental=incremental)
+        df = main.build_dataframe(run_ids, records)
+        return df, utils.build_sample_table({folder: records[folder] for folder in df.index if folder in records})
+
+    def cold_process_folders():
+        reset_state()
+        return process_folders(False)
+
+    df, samples = timed('process_folders', cold_process_folders)
+    timed('process_folders_incremental', lambda: process_folders(True))
+
+    def match_all():
+        # Empty match cache, the index stays loaded
+        sciebo_cache._cache = {}
+        sciebo_cache._pending.clear()
+        return [sciebo_parser.find_corresponding_sciebo(run_id.folder) for run_id in run_ids]
+
+    matches = timed('find_corresponding_sciebo', match_all)
+    sciebo_cache._pending.clear()
+    timed('postprocess_dataframe', lambda: main.postprocess_dataframe(df.copy(), samples))
+
+    counts = {
+        'runs': len(run_ids),
+        'samples': int(len(samples)),
+        'workbooks': len(sciebo_parser.get_sciebo_index()['workbooks']),
+        'matched_runs': sum(match is not None for match in matches),
+    }
+    return {'counts': counts, 'seconds': timings}
+
+def point_config_at(data_path):
+    """ Point the pipeline paths at the 'current' tree, before the pipeline modules are imported """
+    current_path = os.path.join(data_path, "current")
+    state_path = os.path.join(data_path, "state")
+    config.FASTQ_FOLDER_PATH = os.path.join(current_path, "fastq")
+    config.SCIEBO_FOLDER_PATH = os.path.join(current_path, "sciebo") + os.sep
+    config.SCIEBO_INDEX_FILE_PATH = os.path.join(state_path, "sciebo_index.json")
+    config.RUN_MANIFEST_FILE_PATH = os.path.join(state_path, "run_manifest.json")
+    config.NAME_ALIASES_FILE_PATH = os.path.join(state_path, "name_aliases.json")
+    config.QC_DRIFT_STATE_FILE_PATH = os.path.join(state_path, "qc_drift_state.json")
+    config.FASTQ_COUNTS_CACHE_FOLDER_PATH = os.path.join(state_path, "fastq_counts")
+    os.makedirs(state_path, exist_ok=True)
+
+    import utils.sciebo_cache as sciebo_cache
+    sciebo_cache.CACHE_FILE_PATH = os.path.join(state_path, "sciebo_cache.json")
+    return current_path, state_path
+
+def switch_tree(current_path, tree_path):
+    if os.path.lexists(current_path):
+        os.unlink(current_path)
+    os.symlink(tree_path, current_path)
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY_PATH, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+###############################################################################
+#------------------------------- Comparison ----------------------------------#
+###############################################################################
+
+def compare_baselines(old, new, tolerance):
+    """
+    Print the timing ratios of the scales present in both baselines.
+
+    :return: True if none of the timings got slower by more than 'tolerance'.
+    """
+    within_tolerance = True
+    print(f"\ncompared to {old.get('commit')}:")
+    for scale, result in new['results'].items():
+        old_result = old['results'].get(scale)
+        if old_result is None:
+            continue
+        for name, seconds in result['seconds'].items():
+            old_seconds = old_result['seconds'].get(name)
+            if not old_seconds:
+                continue
+            ratio = seconds / old_seconds
+            flag = ""
+            if ratio > 1 + tolerance:
+                flag = "  <-- slower"
+                within_tolerance = False
+            print(f"  {scale:>6} runs  {name:30} {old_seconds:9.3f}s -> {seconds:9.3f}s  ({ratio:5.2f}x){flag}")
+    return within_tolerance
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, nargs='+', default=[100], help="Number of run folders per scale (default: 100)")
+    parser.add_argument("--samples-min", type=int, default=10)
+    parser.add_argument("--samples-max", type=int, default=1000)
+    parser.add_argument("--barcodes", type=int, default=4000, help="Unknown barcodes per Stats.json (bcl2fastq keeps 1000 per lane)")
+    parser.add_argument("--heavy-runs", type=int, default=3, help="Runs whose Stats.json gets --heavy-barcodes unknown barcodes")
+    parser.add_argument("--heavy-barcodes", type=int, default=2_000_000)
+    parser.add_argument("--xls-protocols", type=float, default=0.2, help="Fraction of the protocols written as .xls")
+    parser.add_argument("--missing-protocols", type=float, default=0.1, help="Fraction of the runs without a protocol")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1, help="Repetitions per timing, the fastest is kept")
+    parser.add_argument("--data-dir", default=os.path.join(REPOSITORY_PATH, "benchmarks", ".data"))
+    parser.add_argument("--output", default=os.path.join(REPOSITORY_PATH, "benchmarks", "pipeline_baseline.json"))
+    parser.add_argument("--compare", help="Older baseline to compare the timings with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a timing counts as regression (default: 0.2)")
+    args = parser.parse_args()
+
+    data_path = os.path.abspath(args.data_dir)
+    output_path = os.path.abspath(args.output)
+    current_path, state_path = point_config_at(data_path)
+    # The pipeline logs to 'parser.log' in the working directory (see 'main.setup_logging')
+    os.chdir(data_path)
+
+    baseline = {
+        'commit': git_commit(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'workers': args.workers,
+        'results': {},
+    }
+    for runs in args.runs:
+        parameters = {
+            'runs': runs, 'samples_min': args.samples_min, 'samples_max': args.samples_max, 'barcodes': args.barcodes,
+            'heavy_runs': args.heavy_runs, 'heavy_barcodes': args.heavy_barcodes, 'xls_protocols': args.xls_protocols,
+            'missing_protocols': args.missing_protocols, 'seed': args.seed, 'tree_version': TREE_VERSION,
+        }
+        tree_path = os.path.join(data_path, f"runs_{runs}")
+        print(f"{runs} runs: generating {tree_path}")
+        generate_tree(tree_path, parameters)
+        switch_tree(current_path, tree_path)
+
+        result = time_scale(tree_path, state_path, args.workers, args.repeat)
+        result['parameters'] = parameters
+        baseline['results'][str(runs)] = result
+        for name, seconds in result['seconds'].items():
+            print(f"  {name:30} {seconds:9.3f}s")
+
+    with open(output_path, 'w') as output_file:
+        json.dump(baseline, output_file, indent=4)
+    print(f"baseline written to {output_path}")
+
+    if args.compare:
+        with open(args.compare, 'r') as compare_file:
+            if not compare_baselines(json.load(compare_file), baseline, args.tolerance):
+                sys.exit(1)
+
+if __name__ == '__main__':
+    main()
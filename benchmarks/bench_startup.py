@@ -0,0 +1,127 @@
+"""
+Time the startup of the CLI entry point: '--help' and an incremental run that finds nothing new.
+
+Run from the repository root:
+
+    python benchmarks/bench_startup.py [--runs 100] [--repeat 5] [--output startup.json]
+
+Every invocation is a fresh interpreter, as with cron or the watch mode. The run tree is generated with
+the pipeline benchmark (see 'bench_pipeline.py') and built once before the no-op runs are timed.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+import bench_pipeline
+
+# Modules a no-op incremental run should not need to import
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "xlrd", "Levenshtein", "rapidfuzz", "tqdm", "pyarrow"]
+
+# Points the pipeline at the benchmark tree before 'main' is imported, then runs the CLI
+CHILD_CODE = """
+import sys, json
+paths = json.loads(sys.argv[1])
+sys.path.insert(0, paths['src'])
+import config
+config.FASTQ_FOLDER_PATH = paths['fastq']
+config.SCIEBO_FOLDER_PATH = paths['sciebo']
+config.SCIEBO_INDEX_FILE_PATH = paths['sciebo_index']
+config.RUN_MANIFEST_FILE_PATH = paths['run_manifest']
+config.NAME_ALIASES_FILE_PATH = paths['name_aliases']
+config.QC_DRIFT_STATE_FILE_PATH = paths['qc_drift_state']
+config.FASTQ_COUNTS_CACHE_FOLDER_PATH = paths['fastq_counts']
+import utils.sciebo_cache as sciebo_cache
+sciebo_cache.CACHE_FILE_PATH = paths['sciebo_cache']
+import main
+sys.argv = ['main.py'] + sys.argv[2:]
+main.main()
+print(json.dumps(sorted(module for module in paths['heavy_modules'] if module in sys.modules)))
+"""
+
+def run_cli(paths, arguments, cwd):
+    """ Run the CLI in a fresh interpreter, return the wall time and the heavy modules it imported """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", CHILD_CODE, json.dumps(paths)] + arguments, cwd=cwd,
+                               capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, json.loads(completed.stdout.strip().splitlines()[-1])
+
+def time_command(command, repeat, cwd=None):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def summarize(timings):
+    return {'min': min(timings), 'median': statistics.median(timings)}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=100, help="Number of run folders of the tree (default: 100)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--data-dir", default=os.path.join(bench_pipeline.REPOSITORY_PATH, "benchmarks", ".data"))
+    parser.add_argument("--output", help="Write the timings as JSON")
+    args = parser.parse_args()
+
+    data_path = os.path.abspath(args.data_dir)
+    tree_path = os.path.join(data_path, f"runs_{args.runs}")
+    # Small Stats.json files, the no-op run must not depend on them anyway
+    parameters = {
+        'runs': args.runs, 'samples_min': 10, 'samples_max': 1000, 'barcodes': 4000, 'heavy_runs': 0,
+        'heavy_barcodes': 0, 'xls_protocols': 0.2, 'missing_protocols': 0.1, 'seed': 1,
+    }
+    print(f"generating {tree_path}")
+    bench_pipeline.generate_tree(tree_path, parameters)
+
+    work_path = os.path.join(data_path, "startup")
+    os.makedirs(os.path.join(work_path, "r_scripts"), exist_ok=True)
+    paths = {
+        'src': os.path.join(bench_pipeline.REPOSITORY_PATH, "src"),
+        'fastq': os.path.join(tree_path, "fastq"),
+        'sciebo': os.path.join(tree_path, "sciebo") + os.sep,
+        'sciebo_index': os.path.join(work_path, "sciebo_index.json"),
+        'run_manifest': os.path.join(work_path, "run_manifest.json"),
+        'name_aliases': os.path.join(work_path, "name_aliases.json"),
+        'sciebo_cache': os.path.join(work_path, "sciebo_cache.json"),
+        'qc_drift_state': os.path.join(work_path, "qc_drift_state.json"),
+        'fastq_counts': os.path.join(work_path, "fastq_counts"),
+        'heavy_modules': HEAVY_MODULES,
+    }
+    for name in ('sciebo_index', 'run_manifest', 'name_aliases', 'sciebo_cache', 'qc_drift_state'):
+        if os.path.exists(paths[name]):
+            os.unlink(paths[name])
+
+    full_build, _ = run_cli(paths, ["--incremental"], work_path)
+    noop_timings = []
+    heavy_imports = set()
+    for _ in range(args.repeat):
+        elapsed, imported = run_cli(paths, ["--incremental"], work_path)
+        noop_timings.append(elapsed)
+        heavy_imports.update(imported)
+
+    results = {
+        'runs': args.runs,
+        'python_startup': summarize(time_command([sys.executable, "-c", "pass"], args.repeat)),
+        'help': summarize(time_command([sys.executable, os.path.join(paths['src'], "main.py"), "--help"], args.repeat)),
+        'full_build': full_build,
+        'noop_incremental': summarize(noop_timings),
+        'noop_heavy_imports': sorted(heavy_imports),
+    }
+    print(f"python startup:              {results['python_startup']['median']:7.3f}s")
+    print(f"main.py --help:              {results['help']['median']:7.3f}s")
+    print(f"first incremental build:     {full_build:7.3f}s")
+    print(f"no-op incremental run:       {results['noop_incremental']['median']:7.3f}s")
+    print(f"heavy modules in no-op run:  {', '.join(results['noop_heavy_imports']) or 'none'}")
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Compare the full-mode, cell-by-cell openpyxl scan with the read-only label cell extractor.
+
+Run from the repository root:
+
+    python benchmarks/bench_workbook_reader.py [--repeat 20] [--workbook data/NGS-07_Template_Sequencing.xlsx]
+"""
+import os
+import sys
+import time
+import argparse
+
+import openpyxl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+from utils.workbook_reader import read_workbook_label_cells
+
+def legacy_cell_scan(report_path):
+    """ The previous access pattern: full workbook load and a cell(row, column) loop over every sheet """
+    workbook = openpyxl.load_workbook(filename=report_path, data_only=True)
+    labels = []
+    for excel_sheet_name in workbook.sheetnames:
+        sheet = workbook[excel_sheet_name]
+        for i in range(1, sheet.max_row):
+            for j in range(1, sheet.max_column):
+                cell_value = sheet.cell(row=i, column=j).value
+                if type(cell_value) is str:
+                    labels.append((cell_value, sheet.cell(row=i, column=j + 1).value))
+    return labels
+
+def time_it(function, report_path, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(report_path)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workbook", default="data/NGS-07_Template_Sequencing.xlsx")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # Before, the same workbook was loaded up to three times per run (date match, flowcell match, report parsing)
+    legacy = 3 * time_it(legacy_cell_scan, args.workbook, args.repeat)
+    label_cells = time_it(read_workbook_label_cells, args.workbook, args.repeat)
+
+    print(f"workbook:                     {args.workbook}")
+    print(f"legacy full load x3 per run:  {legacy * 1000:8.2f} ms")
+    print(f"read-only label cells x1:     {label_cells * 1000:8.2f} ms")
+    print(f"speedup:                      {legacy / label_cells:8.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+import argparse
+
+from utils.barcode_store import load_barcode_store, runs_with_barcode, rollup_barcodes
+from config import UNKNOWN_BARCODES_PARQUET_PATH
+
+###############################################################################
+#--------------------------- Unknown Barcode Report --------------------------#
+###############################################################################
+
+def main():
+    """
+    Query the unknown barcode counts of all runs from the barcode store written by 'main.py'.
+    """
+    args = parse_arguments()
+    store, _ = load_barcode_store(args.store)
+    if args.barcode:
+        report = runs_with_barcode(store, args.barcode, args.min_percentage)
+    else:
+        report = rollup_barcodes(store, by=args.by, top=args.top)
+    if args.output:
+        report.to_csv(args.output, index=False)
+    else:
+        print(report.to_string(index=False))
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Query the unknown barcodes of all runs without reading their Stats.json files again.")
+    parser.add_argument("--store", default=UNKNOWN_BARCODES_PARQUET_PATH,
+                        help=f"Path of the barcode store (default: {UNKNOWN_BARCODES_PARQUET_PATH})")
+    parser.add_argument("--barcode",
+                        help="List the runs where this barcode exceeded --min-percentage of the unknown barcode reads")
+    parser.add_argument("--min-percentage", type=float, default=0,
+                        help="Percentage of the unknown barcode reads the barcode has to exceed (default: 0)")
+    parser.add_argument("--by", nargs='+', default=['Instrument', 'Month'], choices=['Instrument', 'Sequencer', 'Month', 'Date'],
+                        help="Run columns of the rollup of the most common barcodes (default: Instrument Month)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of the most common barcodes per group of the rollup (default: 10)")
+    parser.add_argument("--output", help="Write the report as CSV instead of printing it")
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    main()
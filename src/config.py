@@ -1,6 +1,85 @@
+import os
+
+# The state files are resolved relative to this file (like the Sciebo cache), so they don't depend on the
+# working directory
+STATE_FOLDER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'utils')
+
 # Constants for folder paths
 FASTQ_FOLDER_PATH = "/data/fastq"
 SCIEBO_FOLDER_PATH = "data/sciebo/"
+STATISTICS_CSV_PATH = "r_scripts/sequencing_statistics.csv"
+STATISTICS_PARQUET_PATH = "r_scripts/sequencing_statistics.parquet"
+SAMPLES_PARQUET_PATH = "r_scripts/sequencing_samples.parquet"
+# Runs, samples and unknown barcodes, upserted on every build (see src/utils/sqlite_export.py)
+STATISTICS_SQLITE_PATH = "r_scripts/sequencing_statistics.sqlite"
+# All unknown barcode counts of every run, for cross-run queries (see src/utils/barcode_store.py)
+UNKNOWN_BARCODES_PARQUET_PATH = "r_scripts/unknown_barcodes.parquet"
+# QC metrics aggregated per month, sequencer and application (see src/utils/qc_rollups.py)
+QC_ROLLUPS_PARQUET_PATH = "r_scripts/qc_rollups.parquet"
+QC_ROLLUPS_CSV_PATH = "r_scripts/qc_rollups.csv"
+# Runs flagged by the QC drift detection (see src/utils/qc_drift.py), and the baselines to score new runs
+QC_ALERTS_CSV_PATH = "r_scripts/qc_alerts.csv"
+QC_DRIFT_STATE_FILE_PATH = os.path.join(STATE_FOLDER_PATH, "qc_drift_state.json")
+# Persistent index of the Sciebo protocol workbooks (run names, flowcell tokens and report fields)
+SCIEBO_INDEX_FILE_PATH = os.path.join(STATE_FOLDER_PATH, 'sciebo_index.json')
+# Shortest cell token kept as a flowcell candidate (run folder flowcell IDs are at least 9 characters)
+FLOWCELL_TOKEN_MIN_LENGTH = 8
+# Fingerprints of the inputs and the parsed record of every run folder, used for incremental rebuilds
+RUN_MANIFEST_FILE_PATH = os.path.join(STATE_FOLDER_PATH, "run_manifest.json")
+
+# Instrument ID prefixes (second part of the run folder names) and their sequencers
+INSTRUMENT_SEQUENCERS = {
+    'NB501289': 'nextseq500',
+    'M00818': 'miseq1',
+    'M04404': 'miseq2',
+    'A01742': 'novaseq',
+}
+# Concurrent I/O on the network mounts: number of I/O threads, runs read ahead of the one being parsed and
+# the maximum number of bytes read ahead
+PREFETCH_THREADS = 8
+PREFETCH_LOOKAHEAD = 8
+PREFETCH_BYTE_BUDGET = 256 * 1024 * 1024
+
+# Read counting of the FASTQ files of runs without a MultiQC report: threads decompressing the files,
+# decompressed bytes processed at once per thread and the folder caching the counts per run
+FASTQ_COUNT_THREADS = 8
+FASTQ_COUNT_CHUNK_SIZE = 4 * 1024 * 1024
+FASTQ_COUNTS_CACHE_FOLDER_PATH = os.path.join(STATE_FOLDER_PATH, "fastq_counts")
+
+# Records of the (memory-mapped) InterOp files aggregated at a time
+INTEROP_CHUNK_RECORDS = 1_000_000
+
+# Statistics columns of the QC rollups and the percentiles computed per group (0.5 is the median)
+QC_ROLLUP_METRICS = ["CV", "Q 30", "Undetermined Reads Percentage", "Ratio Total Read Count and Expected Cluster", "Phix Output Percent"]
+QC_ROLLUP_PERCENTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+
+# QC drift detection: metrics scored per sequencer and the direction of bad values (1 high, -1 low, 0 both),
+# number of previous runs of the baselines, minimal number of previous runs to score a run, weight of a
+# run in the EWMA of the z-scores, and the z-score and EWMA thresholds of the alerts
+QC_DRIFT_METRICS = {
+    "CV": 1,
+    "Q 30": -1,
+    "Undetermined Reads Percentage": 1,
+    "Phix Output Deviation": 0,
+    "Ratio Total Read Count and Expected Cluster": -1,
+}
+QC_DRIFT_WINDOW = 20
+QC_DRIFT_MIN_RUNS = 5
+QC_DRIFT_EWMA_ALPHA = 0.3
+QC_DRIFT_Z_THRESHOLD = 3.5
+QC_DRIFT_EWMA_THRESHOLD = 2.0
+
+# Timing report written with --profile
+PROFILE_JSON_PATH = "profile_report.json"
+PROFILE_CSV_PATH = "profile_report.csv"
+
+# Kit and application names resolved by fuzzy matching (editable, a wrong match can be corrected by hand)
+NAME_ALIASES_FILE_PATH = os.path.join(STATE_FOLDER_PATH, "name_aliases.json")
+# Kit and application names of the last build that could not be resolved
+UNRESOLVED_NAMES_CSV_PATH = "unresolved_names.csv"
+# Minimal rapidfuzz scores (0-100) of a fuzzy kit or application match
+KIT_MATCH_SCORE_CUTOFF = 85
+APPLICATION_MATCH_SCORE_CUTOFF = 60
 
 # Mapping dictionaries for sequencing kits and expected clusters
 SEQUENCING_KIT_TO_CLUSTERS = {
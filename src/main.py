@@ -1,32 +1,66 @@
 import os
 import logging
-import pandas as pd
-from tqdm import tqdm
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from operator import itemgetter
 
 # Import utility functions
-import utils.utilities as utils
-from parsers.fastq_parser import parse_fastq_stats_folder
-from parsers.multiqc_parser import parse_multiqc_data
-from parsers.sciebo_parser import parse_sciebo_report
+# pandas, tqdm and the parser backends are imported in the functions that need them, so '--help' and
+# incremental runs that find nothing new to parse start fast
+import utils.run_manifest as run_manifest
+import utils.sciebo_cache as sciebo_cache
+import utils.name_normalizer as name_normalizer
+from utils.run_stats import RunStats
+from utils.run_id import parse_run_ids
+from utils.run_watcher import watch_runs
+from utils.run_folder import reset_run_folder_scans, scan_run_folders
+from utils.barcode_store import reset_collected_barcodes, collect_unknown_barcodes, update_barcode_store
+from utils.prefetch import configure_prefetch, io_map, shutdown_io_executor, Prefetcher
+from utils.profiler import enable_profiling, is_profiling, reset_profile, profile_stage, profiled_map, write_profile_report
+from parsers.sciebo_parser import parse_sciebo_report, get_sciebo_index, reset_sciebo_index, find_corresponding_sciebo
 
 
 # Import constants and configurations
 from config import (
     FASTQ_FOLDER_PATH, 
+    STATISTICS_CSV_PATH, 
+    STATISTICS_PARQUET_PATH, 
+    SAMPLES_PARQUET_PATH, 
+    STATISTICS_SQLITE_PATH, 
+    UNKNOWN_BARCODES_PARQUET_PATH, 
+    QC_ROLLUPS_PARQUET_PATH, 
+    QC_ROLLUPS_CSV_PATH, 
+    QC_ALERTS_CSV_PATH, 
+    QC_DRIFT_STATE_FILE_PATH, 
+    PROFILE_JSON_PATH, 
+    PROFILE_CSV_PATH, 
+    NAME_ALIASES_FILE_PATH, 
+    UNRESOLVED_NAMES_CSV_PATH, 
+    PREFETCH_THREADS, 
+    PREFETCH_BYTE_BUDGET, 
     SEQUENCING_KIT_TO_CLUSTERS, 
     EXPECTED_READING_PER_SAMPLE_MAPPING
 )
 
+OUTPUT_PATHS = [
+    STATISTICS_CSV_PATH, STATISTICS_PARQUET_PATH, SAMPLES_PARQUET_PATH, STATISTICS_SQLITE_PATH, UNKNOWN_BARCODES_PARQUET_PATH,
+    QC_ROLLUPS_PARQUET_PATH, QC_ROLLUPS_CSV_PATH, QC_ALERTS_CSV_PATH,
+]
+
 ###############################################################################
 #------------------------------ Set Up Logging -------------------------------#
 ###############################################################################
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='parser.log',
-    filemode='w'
-)
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        filename='parser.log',
+        filemode='w'
+    )
 
 ###############################################################################
 #-------------------------------- Main Functions -----------------------------#
@@ -36,27 +70,108 @@ def main():
     """
     Main function to create and save a DataFrame containing statistics for sequencing projects.
     """
-    fastq_folders = os.listdir(FASTQ_FOLDER_PATH)
-    fastq_dates = [utils.extract_date_from_folder(folder) for folder in fastq_folders]
-    fastq_sequencers = [utils.extract_sequencer_from_folder(folder) for folder in fastq_folders]
+    args = parse_arguments()
+    setup_logging()
+    configure_prefetch(threads=args.io_threads, byte_budget=args.prefetch_mb * 1024 * 1024)
+    if args.profile:
+        # The bytes read are counted for the whole process, so the reads of the I/O threads (e.g. prefetching
+        # the next runs) would be charged to whatever stage is open. Profile with the I/O issued serially.
+        configure_prefetch(threads=1)
+        enable_profiling()
+    if args.watch:
+        # Rebuild incrementally whenever runs land, keeping the runs that are still being written as they were
+        watch_runs(partial(build_statistics, args.workers, True), args.poll_interval, args.settle_time)
+    else:
+        build_statistics(args.workers, args.incremental)
+
+def build_statistics(workers=1, incremental=False, deferred_folders=()):
+    """
+    Parse the run folders and write the statistics outputs.
+
+    :param workers: Number of worker processes used to parse the run folders.
+    :param incremental: If True, only parse the run folders whose inputs changed.
+    :param deferred_folders: Run folders whose outputs are still being written and must not be parsed yet.
+    """
+    reset_profile()
+    reset_collected_barcodes()
+    reset_run_folder_scans()
+    # Folders that are not named like run folders are skipped here
+    run_ids = parse_run_ids(os.listdir(FASTQ_FOLDER_PATH))
+    records = process_folders(run_ids, workers=workers, incremental=incremental, deferred_folders=deferred_folders)
+    if incremental and run_manifest.outputs_up_to_date(OUTPUT_PATHS, [NAME_ALIASES_FILE_PATH]):
+        # Nothing was parsed and the set of runs didn't change, the outputs of the last build are still valid
+        logger.info("Incremental mode: no new or changed runs, keeping the existing outputs")
+        if is_profiling():
+            write_profile_report(PROFILE_JSON_PATH, PROFILE_CSV_PATH)
+        return
 
-    # Initialize DataFrame with project data
-    df = initialize_dataframe(fastq_folders, fastq_dates, fastq_sequencers)
-    df = process_folders(df, fastq_folders)
+    import utils.utilities as utils
+    from utils.sqlite_export import export_statistics_sqlite
+    from utils.qc_rollups import update_rollups
+    from utils.qc_drift import detect_drift
+
+    # Build the DataFrame once from the project data and the run records
+    df = build_dataframe(run_ids, records)
+    # Keep the sample table in the (date sorted) order of the DataFrame
+    samples = utils.build_sample_table({folder: records[folder] for folder in df.index if folder in records})
 
     # Post-process and clean up DataFrame
-    df = postprocess_dataframe(df)
-    df.to_csv('r_scripts/sequencing_statistics.csv', index=True)
+    with profile_stage('postprocess'):
+        name_normalizer.reset_unresolved_names()
+        df = postprocess_dataframe(df, samples)
+        # Saved before the outputs are written, so they are newer than the alias table
+        name_normalizer.save_name_aliases()
+        name_normalizer.write_unresolved_names(UNRESOLVED_NAMES_CSV_PATH)
+    with profile_stage('qc drift'):
+        # Runs that stand out from, or drift away from, the previous runs of their sequencer
+        alerts = detect_drift(df, QC_DRIFT_STATE_FILE_PATH)
+    with profile_stage('write outputs'):
+        df.to_csv(STATISTICS_CSV_PATH, index=True)
+        df.to_parquet(STATISTICS_PARQUET_PATH, index=True)
+        # Typed per-sample table, so the read distributions don't have to be parsed back from the CSV strings
+        samples.to_parquet(SAMPLES_PARQUET_PATH, index=False)
+        alerts.to_csv(QC_ALERTS_CSV_PATH, index=False)
+        # Indexed tables, so the dashboards can query a date range or a sequencer instead of loading everything
+        export_statistics_sqlite(df, samples, utils.build_barcode_table(records), utils.build_lane_table(records), alerts, STATISTICS_SQLITE_PATH)
+    with profile_stage('barcode store'):
+        update_barcode_store(run_ids, UNKNOWN_BARCODES_PARQUET_PATH, deferred_folders)
+    with profile_stage('qc rollups'):
+        update_rollups(df, QC_ROLLUPS_PARQUET_PATH, QC_ROLLUPS_CSV_PATH)
+
+    if is_profiling():
+        write_profile_report(PROFILE_JSON_PATH, PROFILE_CSV_PATH)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Collect the statistics of the sequencing runs into a single CSV.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes used to parse the run folders (default: 1, serial)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only parse the run folders whose inputs changed since the last run")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and incrementally ingest new or changed run folders as they land")
+    parser.add_argument("--poll-interval", type=float, default=30,
+                        help="Seconds between two polls of the run folders in watch mode (default: 30)")
+    parser.add_argument("--settle-time", type=float, default=60,
+                        help="Seconds without writes after which the outputs of a run are complete (default: 60)")
+    parser.add_argument("--io-threads", type=int, default=PREFETCH_THREADS,
+                        help=f"Number of threads issuing the stat and read calls on the run and Sciebo folders (default: {PREFETCH_THREADS})")
+    parser.add_argument("--prefetch-mb", type=int, default=PREFETCH_BYTE_BUDGET // (1024 * 1024),
+                        help=f"Maximum MB of run outputs read ahead of the parsers (default: {PREFETCH_BYTE_BUDGET // (1024 * 1024)})")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record the wall time, bytes read and peak memory per stage and run folder into a timing report, "
+                             "without the I/O threads and prefetching")
+    return parser.parse_args()
 
-def initialize_dataframe(folders, dates, sequencers):
+def build_dataframe(run_ids, records):
     """
-    Initialize the DataFrame with basic information from the project folders in a more concise way.
+    Build the DataFrame column by column from the project folders and their run records.
 
-    :param folders: List of folder names representing the project names.
-    :param dates: List of dates corresponding to each folder in 'dd.mm.yyyy' format.
-    :param sequencers: List of sequencers corresponding to each folder.
-    :return: Initialized pandas DataFrame with the folders as the index.
+    :param run_ids: List of the RunIds of the run folders, the folder names are the project names.
+    :param records: Dictionary mapping folder names to their RunStats records.
+    :return: pandas DataFrame with the folders as the index.
     """
+    import pandas as pd
+
     columns = [
         "Project Name", "Protocol Name", "Date", "Sciebo Found", "Application", "Sequencer",
         "STD in Millions", "CV", "Undetermined Reads Percentage", "Most Common Undetermined Barcode",
@@ -68,17 +183,21 @@ def initialize_dataframe(folders, dates, sequencers):
         "Name", "Total Read Count in Millions", "Max Cluster", "Phix Output Count"
     ]
 
-    # Use dictionary comprehension to create the initial data dictionary
-    data = {col: [None] * len(folders) for col in columns}
-    data["Project Name"] = folders
-    data["Date"] = dates
-    data["Sequencer"] = sequencers
+    # Use dictionary comprehension to create the data dictionary, the run columns are taken from the records
+    run_records = [records.get(run_id.folder) for run_id in run_ids]
+    data = {
+        col: [getattr(record, RunStats.ATTRIBUTES[col], None) for record in run_records] if col in RunStats.ATTRIBUTES else [None] * len(run_ids)
+        for col in columns
+    }
+    data["Project Name"] = [run_id.folder for run_id in run_ids]
+    data["Date"] = [run_id.date for run_id in run_ids]
+    data["Sequencer"] = [run_id.sequencer for run_id in run_ids]
 
-    # Initialize DataFrame with the data dictionary
-    df = pd.DataFrame(data)
+    # Build the DataFrame with the data dictionary
+    df = pd.DataFrame(data, dtype=object)
 
     # Convert 'Date' column to datetime format and sort DataFrame by 'Date'
-    df['Date'] = pd.to_datetime(df['Date'], format='%d.%m.%Y')
+    df['Date'] = pd.to_datetime(df['Date'])
     df.sort_values(by='Date', inplace=True)
 
     # Set 'Project Name' as index of the DataFrame
@@ -86,50 +205,152 @@ def initialize_dataframe(folders, dates, sequencers):
 
     return df
 
-def process_folders(df, folders):
+def start_worker_pool(workers):
     """
-    Process each (fastq) folder to fill in the DataFrame with detailed statistics.
+    Start the worker processes, before the I/O threads and prefetchers of the build.
+
+    The workers are forked when the pool gets its first task, and forking while another thread holds a
+    lock (of the logging module, the allocator, ...) can deadlock the worker.
 
-    :param df: The initialized DataFrame.
-    :param folders: List of folder names to process.
-    :return: Updated DataFrame with added statistics.
+    :param workers: Number of worker processes.
+    :return: The ProcessPoolExecutor, with its workers running.
     """
-    for folder in tqdm(folders, desc="Processing folders"):
-        if not utils.is_valid_folder(folder):
-            continue
-        update_dataframe_for_folder(df, folder)
-    return df
+    # The I/O threads of the last build or watcher poll are idle, but must not be running at the fork
+    shutdown_io_executor()
+    executor = ProcessPoolExecutor(max_workers=workers)
+    # The first task starts all workers
+    executor.submit(os.getpid).result()
+    return executor
 
-def update_dataframe_for_folder(df, folder):
+def process_folders(run_ids, workers=1, incremental=False, deferred_folders=()):
     """
-    Update DataFrame rows for a given folder with detailed statistics.
+    Process each (fastq) folder into a RunStats record with detailed statistics.
 
-    :param df: The DataFrame to update.
-    :param folder: The folder name corresponding to the DataFrame row to update.
+    The demultiplexing reports of the folders are parsed with the reader of the demultiplexer that wrote
+    them (see 'parsers.demux_formats'). This parsing, as well as the scanning of new Sciebo workbooks,
+    runs in a process pool when more than one worker is requested. The Sciebo matching stays in the
+    main process since it reads and writes the shared cache.
+
+    The inputs of every folder are fingerprinted into the run manifest. In incremental mode the
+    records of the folders whose inputs did not change are reused from the manifest instead of
+    being parsed again.
+
+    :param run_ids: List of the RunIds of the run folders to process.
+    :param workers: Number of worker processes, 1 parses the folders serially.
+    :param incremental: If True, only parse the new or changed folders.
+    :param deferred_folders: Folders that must not be parsed yet, their stored records are kept if there are any.
+    :return: Dictionary mapping the valid and deferred folders to their RunStats records.
+    """
+    valid_folders = [run_id.folder for run_id in run_ids if run_id.folder not in deferred_folders]
+    manifest = run_manifest.load_run_manifest()
+    executor = start_worker_pool(workers) if workers > 1 else None
+    mapper = partial(executor.map, chunksize=4) if executor is not None else map
+
+    # Deferred folders keep their previous record and manifest entry until their outputs are complete
+    records = {
+        folder: run_manifest.stored_record(manifest[folder]) for folder in deferred_folders
+        if run_manifest.is_current_entry(manifest.get(folder))
+    }
+    try:
+        # Make sure the Sciebo index is up to date before the folders are matched against it
+        reset_sciebo_index()
+        with profile_stage('sciebo index'):
+            get_sciebo_index(mapper)
+        with profile_stage('sciebo matching'):
+            sciebo_reports = {folder: find_corresponding_sciebo(folder) for folder in valid_folders}
+            sciebo_cache.flush_cache()
+        with profile_stage('fingerprint'):
+            # Every run folder is scanned once, the scans and hashes are issued concurrently on the I/O threads
+            scans = scan_run_folders(valid_folders)
+            run_inputs = dict(zip(valid_folders, io_map(
+                lambda folder: run_manifest.fingerprint_run_inputs(
+                    run_manifest.run_inputs(folder, scans[folder], sciebo_reports[folder]),
+                    manifest.get(folder, {}).get('inputs')),
+                valid_folders)))
+        if incremental:
+            for folder in valid_folders:
+                if run_manifest.can_reuse_record(manifest.get(folder), run_inputs[folder]):
+                    records[folder] = run_manifest.stored_record(manifest[folder])
+            logger.info(f"Incremental mode: reusing {len(records)} of {len(valid_folders) + len(deferred_folders)} run records")
+
+        pending_folders = [folder for folder in valid_folders if folder not in records]
+        if pending_folders:
+            from tqdm import tqdm
+            # No monitor thread, it would outlive the build and be running when the next build (watch mode) forks its workers
+            tqdm.monitor_interval = 0
+            # Read the reports of the next runs while the current ones are parsed
+            prefetch_paths = lambda folder: [artifact.path for artifact in scans[folder].values()]
+            with Prefetcher(pending_folders, prefetch_paths) as prefetcher:
+                pending_scans = [(folder, scans[folder]) for folder in pending_folders]
+                parsed_folders = profiled_map(mapper, parse_folder, pending_scans, 'parse folder', key=itemgetter(0))
+                for folder, record in tqdm(parsed_folders, total=len(pending_folders), desc="Processing folders"):
+                    prefetcher.advance()
+                    with profile_stage('sciebo report', folder):
+                        parse_sciebo_report(record, sciebo_reports[folder])
+                    collect_unknown_barcodes(folder, record)
+                    records[folder] = record
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    updated_manifest = {folder: manifest[folder] for folder in deferred_folders if folder in manifest}
+    updated_manifest.update({
+        folder: run_manifest.manifest_entry(run_inputs[folder], records[folder]) for folder in valid_folders
+    })
+    # Unchanged manifests are not rewritten, see 'run_manifest.outputs_up_to_date'
+    if updated_manifest != manifest:
+        run_manifest.save_run_manifest(updated_manifest)
+    return records
+
+def parse_folder(folder_scan):
+    """
+    Parse the demultiplexing reports and InterOp outputs of a folder into a run record.
+
+    :param folder_scan: Tuple of the folder name to parse and its artifacts (see 'run_folder.scan_run_folder').
+    :return: Tuple of the folder name and its RunStats record.
     """
-    # Update DataFrame with parsed data from multiple sources
-    parse_multiqc_data(df, folder)
-    parse_fastq_stats_folder(df, folder)
-    parse_sciebo_report(df, folder)
+    from parsers.demux_formats import parse_sample_reads, parse_unknown_barcodes
+    from parsers.interop_parser import parse_interop_metrics
 
-def postprocess_dataframe(df):
+    folder, artifacts = folder_scan
+    record = RunStats()
+    with profile_stage('sample reads', folder):
+        parse_sample_reads(record, folder, artifacts)
+    with profile_stage('unknown barcodes', folder):
+        parse_unknown_barcodes(record, folder, artifacts)
+    with profile_stage('interop', folder):
+        parse_interop_metrics(record, folder, artifacts)
+    return folder, record
+
+def postprocess_dataframe(df, samples):
     """
     Perform post-processing on the DataFrame to finalize structure and calculations.
 
     :param df: The DataFrame to post-process.
+    :param samples: The long-format per-sample reads table of the runs.
     :return: The post-processed DataFrame.
     """
+    import pandas as pd
+    import utils.utilities as utils
+    import utils.schema as schema
+
     df["Total Read Count in Millions"] = pd.to_numeric(df["Total Read Count in Millions"], errors='coerce').round(2)
-    df['Expected Clusters'] = df['Sequencing Kit'].str.lower().map(SEQUENCING_KIT_TO_CLUSTERS)
-    utils.calculate_ratios(df)
+    # Resolve the free-text kits and the application names of the protocols, the 'Sequencing Kit' column keeps the text as typed
+    normalizers = name_normalizer.get_normalizers()
+    kits = normalizers['kit'].resolve_series(df['Sequencing Kit'])
+    # Protocols whose application could not be resolved are kept as 'unknown'
+    applications = normalizers['application'].resolve_series(df['Application'].where(df['Application'] != 'unknown'))
+    df['Application'] = applications.where(applications.notna() | df['Application'].isna(), 'unknown')
+    df['Expected Clusters'] = kits.map(SEQUENCING_KIT_TO_CLUSTERS).map(schema.parse_cluster_count, na_action='ignore')
+    utils.calculate_ratios(df, kits)
     utils.adjust_phix_percentages(df)
 
     # Calculate the number of samples meeting the reads requirement
     df['Expected Reading Per Sample'] = df['Application'].map(EXPECTED_READING_PER_SAMPLE_MAPPING)
-    df['Number of Samples Above Requirement'], df['Number of Samples Below Requirement'] = zip(*df.apply(utils.check_read_count, axis=1))
+    df['Number of Samples Above Requirement'], df['Number of Samples Below Requirement'] = utils.count_samples_by_requirement(df, samples)
 
     df.drop(["Max Cluster", "Expected Reading Per Sample", 'Phix Output Count'], axis=1, inplace=True)
-    return df
+    return schema.apply_schema(df)
 
 
 if __name__ == '__main__':
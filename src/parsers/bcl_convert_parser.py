@@ -0,0 +1,48 @@
+import csv
+import logging
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#--------------------------- BCL Convert Reports -----------------------------#
+###############################################################################
+
+# BCL Convert (NovaSeq X, and bcl2fastq's successor on the other sequencers) writes its statistics as
+# CSV files into the 'Reports' folder of the output instead of a Stats.json, which MultiQC doesn't
+# summarize as 'multiqc_bcl2fastq_bysample.txt'.
+UNDETERMINED_SAMPLE_ID = 'Undetermined'
+
+def read_demultiplex_stats(demultiplex_stats_path):
+    """
+    Read the per-sample reads of a run from its Demultiplex_Stats.csv.
+
+    :param demultiplex_stats_path: Path of the Reports/Demultiplex_Stats.csv file.
+    :return: DataFrame with the columns 'Sample' and 'total' (reads, summed over the lanes), as in the
+             MultiQC bcl2fastq per-sample table, with the 'undetermined' sample last.
+    """
+    import pandas as pd
+
+    df_by_lane = pd.read_csv(demultiplex_stats_path, dtype={'SampleID': str})
+    df_by_sample = df_by_lane.groupby('SampleID', sort=False)['# Reads'].sum().reset_index()
+    df_by_sample.columns = ['Sample', 'total']
+    undetermined = df_by_sample['Sample'] == UNDETERMINED_SAMPLE_ID
+    df_by_sample.loc[undetermined, 'Sample'] = 'undetermined'
+    if not undetermined.any():
+        return pd.concat([df_by_sample, pd.DataFrame({'Sample': ['undetermined'], 'total': [0]})], ignore_index=True)
+    # MultiQC lists the undetermined reads last
+    return pd.concat([df_by_sample[~undetermined], df_by_sample[undetermined]], ignore_index=True)
+
+def read_top_unknown_barcodes(top_unknown_barcodes_path):
+    """
+    Sum the unknown barcode counts of a run over its lanes from its Top_Unknown_Barcodes.csv.
+
+    :param top_unknown_barcodes_path: Path of the Reports/Top_Unknown_Barcodes.csv file.
+    :return: Dictionary mapping the barcodes ('index+index2' for dual indexes, as in Stats.json) to
+             their summed counts, in order of first appearance.
+    """
+    unknown_barcodes = {}
+    with open(top_unknown_barcodes_path, 'r', newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            barcode = '+'.join(row[column] for column in ('index', 'index2') if row.get(column))
+            unknown_barcodes[barcode] = unknown_barcodes.get(barcode, 0) + int(row['# Reads'])
+    return unknown_barcodes
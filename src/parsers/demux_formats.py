@@ -0,0 +1,124 @@
+import logging
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#------------------------- Demultiplexer Formats -----------------------------#
+###############################################################################
+
+# A demultiplexer output layout: the run folder artifacts (see 'run_folder.RUN_ARTIFACTS') holding the
+# per-sample reads and the unknown barcodes, and the readers turning them into a per-sample table
+# ('Sample', 'total', as in the MultiQC bcl2fastq per-sample table) and the unknown barcode counts
+DemuxFormat = namedtuple('DemuxFormat', ['name', 'sample_artifact', 'read_sample_reads', 'barcode_artifact', 'read_unknown_barcode_counts'])
+
+# Detected in order of registration
+DEMUX_FORMATS = []
+
+def register_demux_format(name, sample_artifact, read_sample_reads, barcode_artifact, read_unknown_barcode_counts):
+    """
+    Register the outputs of a demultiplexer.
+
+    :param name: Name of the demultiplexer, e.g. 'bcl2fastq'.
+    :param sample_artifact: The artifact with the per-sample reads.
+    :param read_sample_reads: Function reading the per-sample table from the path of 'sample_artifact'.
+    :param barcode_artifact: The artifact with the unknown barcodes.
+    :param read_unknown_barcode_counts: Function reading the unknown barcode counts (summed over the
+                                        lanes) from the path of 'barcode_artifact'.
+    """
+    DEMUX_FORMATS.append(DemuxFormat(name, sample_artifact, read_sample_reads, barcode_artifact, read_unknown_barcode_counts))
+
+def detect_demux_format(artifacts):
+    """ The demultiplexer format of a run folder scan, None if the run folder has none of their outputs """
+    for demux_format in DEMUX_FORMATS:
+        if demux_format.sample_artifact in artifacts or demux_format.barcode_artifact in artifacts:
+            return demux_format
+    return None
+
+def counts_fastq_reads(artifacts):
+    """ Check if the reads of a run folder scan are counted from its FASTQ files, i.e. it has no per-sample report """
+    demux_format = detect_demux_format(artifacts)
+    return demux_format is None or demux_format.sample_artifact not in artifacts
+
+def unknown_barcodes_artifact(artifacts):
+    """ The Artifact with the unknown barcodes of a run folder scan, None if there is none """
+    demux_format = detect_demux_format(artifacts)
+    return None if demux_format is None else artifacts.get(demux_format.barcode_artifact)
+
+def read_unknown_barcode_counts(artifacts):
+    """ The unknown barcode counts of a run folder scan, None if there is no unknown barcode report """
+    demux_format = detect_demux_format(artifacts)
+    if demux_format is None or demux_format.barcode_artifact not in artifacts:
+        return None
+    return demux_format.read_unknown_barcode_counts(artifacts[demux_format.barcode_artifact].path)
+
+###############################################################################
+#------------------------------ Format Readers -------------------------------#
+###############################################################################
+
+# The parser modules import pandas, so they are only imported once a run is parsed
+
+def read_multiqc_sample_reads(path):
+    from parsers.multiqc_parser import read_multiqc_bysample
+    return read_multiqc_bysample(path)
+
+def read_stats_json_unknown_barcodes(path):
+    from parsers.fastq_parser import read_stats_json_unknown_barcodes
+    return read_stats_json_unknown_barcodes(path)
+
+def read_bcl_convert_sample_reads(path):
+    from parsers.bcl_convert_parser import read_demultiplex_stats
+    return read_demultiplex_stats(path)
+
+def read_bcl_convert_unknown_barcodes(path):
+    from parsers.bcl_convert_parser import read_top_unknown_barcodes
+    return read_top_unknown_barcodes(path)
+
+register_demux_format('bcl2fastq', 'multiqc', read_multiqc_sample_reads, 'stats', read_stats_json_unknown_barcodes)
+register_demux_format('bcl_convert', 'demultiplex_stats', read_bcl_convert_sample_reads, 'top_unknown_barcodes', read_bcl_convert_unknown_barcodes)
+
+###############################################################################
+#------------------------------- Run Parsing ---------------------------------#
+###############################################################################
+
+def parse_sample_reads(record, fastq_folder_name, artifacts):
+    """
+    Parse the per-sample reads of a run folder into its run record, with the reader of its demultiplexer.
+
+    Runs without a per-sample report (e.g. MultiQC didn't run, or there is no demultiplexing report at all)
+    get their reads (and their yield and Q30) by counting their FASTQ files instead.
+
+    :param record: The RunStats record of the run to fill.
+    :param fastq_folder_name: The name of the run folder.
+    :param artifacts: The scan of the run folder (see 'run_folder.scan_run_folder').
+    :return: The filled record.
+    """
+    from parsers.multiqc_parser import fill_read_statistics
+
+    if counts_fastq_reads(artifacts):
+        from parsers.fastq_parser import count_fastq_reads_by_sample, fill_yield_statistics
+
+        df_by_sample = count_fastq_reads_by_sample(fastq_folder_name)
+        if df_by_sample is None:
+            return record
+        logger.info(f"No per-sample report for {fastq_folder_name}, counted the reads of its FASTQ files")
+        return fill_yield_statistics(fill_read_statistics(record, df_by_sample), df_by_sample)
+    demux_format = detect_demux_format(artifacts)
+    return fill_read_statistics(record, demux_format.read_sample_reads(artifacts[demux_format.sample_artifact].path))
+
+def parse_unknown_barcodes(record, fastq_folder_name, artifacts):
+    """
+    Parse the unknown barcodes of a run folder into its run record, with the reader of its demultiplexer.
+
+    :param record: The RunStats record of the run to fill.
+    :param fastq_folder_name: The name of the run folder.
+    :param artifacts: The scan of the run folder (see 'run_folder.scan_run_folder').
+    :return: The filled record.
+    """
+    from parsers.fastq_parser import fill_unknown_barcode_statistics
+
+    unknown_barcode_counts = read_unknown_barcode_counts(artifacts)
+    if unknown_barcode_counts is None:
+        logger.error(f"No unknown barcode report (Stats/Stats.json or Reports/Top_Unknown_Barcodes.csv) in {fastq_folder_name}")
+        return record
+    return fill_unknown_barcode_statistics(record, unknown_barcode_counts)
@@ -1,37 +1,53 @@
+import re
 import json
 import os
+import gzip
+import zlib
+import heapq
 import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-from config import FASTQ_FOLDER_PATH
+from utils.state_files import write_state_file
+from config import FASTQ_FOLDER_PATH, FASTQ_COUNTS_CACHE_FOLDER_PATH, FASTQ_COUNT_THREADS, FASTQ_COUNT_CHUNK_SIZE
 
 # Create a logger for the current module
 logger = logging.getLogger(__name__)
 
-def parse_fastq_stats_folder(df, fastq_folder_name):
-    """
-    Parse FastQ stats from a specified folder and update the DataFrame with the extracted data.
+# Number of unknown barcodes kept for the distribution string
+UNKNOWN_BARCODES_TOP_K = 15
+PHIX_BARCODE_PAIRED_END = 'GGGGGGGGGG+AGATCTCGGT'
+
+def read_stats_json_unknown_barcodes(stats_json_path):
+    """ Sum the unknown barcode counts of a bcl2fastq Stats.json over its lanes """
+    # Only the 'UnknownBarcodes' section is decoded, the rest of the (possibly huge) file is skipped
+    return aggregate_unknown_barcodes(stream_unknown_barcodes(stats_json_path))
 
-    :param df: The pandas DataFrame to update.
-    :param fastq_folder_name: The name of the folder containing FastQ stats.
+def fill_unknown_barcode_statistics(record, unknown_barcode_counts):
     """
-    stats_json_path = os.path.join(FASTQ_FOLDER_PATH, fastq_folder_name, "Stats", "Stats.json")
-    if not os.path.exists(stats_json_path):
-        logger.error(f"The path: '{stats_json_path}' does not exist!")
-        return
+    Compute the unknown barcode statistics of a run and update its run record.
 
-    with open(stats_json_path, 'r') as file:
-        stats_data = json.load(file)
+    :param record: The RunStats record of the run to fill.
+    :param unknown_barcode_counts: Dictionary mapping the unknown barcodes of the run to their counts,
+                                   summed over the lanes.
+    :return: The filled record.
+    """
+    total_counts = sum(unknown_barcode_counts.values())
+    unknown_barcodes = top_unknown_barcodes(unknown_barcode_counts, UNKNOWN_BARCODES_TOP_K)
+    phix_candidates = top_unknown_barcodes({barcode: count for barcode, count in unknown_barcode_counts.items() if is_phix_barcode(barcode)}, 1)
 
-    unknown_barcodes = extract_unknown_barcodes(stats_data)
-    distribution_string, main_unknown_barcode_percentage = calculate_barcode_percentages(unknown_barcodes)
-    phix_output_count, phix_barcode = find_phix_output(unknown_barcodes)
+    distribution_string, main_unknown_barcode_percentage = calculate_barcode_percentages(unknown_barcodes, total_counts)
+    phix_output_count, phix_barcode = find_phix_output(phix_candidates)
 
-    # Update DataFrame
-    df.loc[fastq_folder_name, 'Most Common Undetermined Barcode'] = unknown_barcodes[0][0] if unknown_barcodes else None
-    df.loc[fastq_folder_name, 'Undetermined Distribution String'] = distribution_string
-    df.loc[fastq_folder_name, 'Most Common Undetermined Barcode Percentage'] = main_unknown_barcode_percentage
-    df.loc[fastq_folder_name, 'Phix Output Count'] = phix_output_count
-    df.loc[fastq_folder_name, 'Phix Barcode'] = phix_barcode
+    # Update the run record
+    record.most_common_undetermined_barcode = unknown_barcodes[0][0] if unknown_barcodes else None
+    record.undetermined_distribution_string = distribution_string
+    record.most_common_undetermined_barcode_percentage = main_unknown_barcode_percentage
+    record.phix_output_count = phix_output_count
+    record.phix_barcode = phix_barcode
+    record.unknown_barcodes = [[barcode, count, count / total_counts * 100] for barcode, count in unknown_barcodes if count != 0]
+    record.unknown_barcode_counts = unknown_barcode_counts
+    return record
 
 def extract_unknown_barcodes(stats_data):
     """
@@ -40,28 +56,24 @@ def extract_unknown_barcodes(stats_data):
     :param stats_data: Parsed JSON data containing stats.
     :return: Sorted list of unknown barcodes and their counts.
     """
-    unknown_barcodes = {}
-    for lane in stats_data.get('UnknownBarcodes', []):
-        # Iterate through key-value pairs in each dictionary
-        for key, value in lane['Barcodes'].items():
-            # Update the combined dictionary, summing up values for duplicate keys
-            unknown_barcodes[key] = unknown_barcodes.get(key, 0) + value
-
+    unknown_barcodes = aggregate_unknown_barcodes(stats_data.get('UnknownBarcodes', []))
     return sorted(unknown_barcodes.items(), key=lambda x: x[1], reverse=True)
 
-def calculate_barcode_percentages(unknown_barcodes):
+def calculate_barcode_percentages(unknown_barcodes, total_counts=None):
     """
     Calculate barcode percentages from unknown barcode counts.
 
-    :param unknown_barcodes: List of unknown barcodes and their counts.
+    :param unknown_barcodes: List of unknown barcodes and their counts, sorted by count.
+    :param total_counts: Total count of all unknown barcodes, defaults to the sum over 'unknown_barcodes'.
     :return: Distribution string and the percentage of the most common unknown barcode.
     """
     if unknown_barcodes is None:
         return None, None
 
-    total_counts = sum(count for _, count in unknown_barcodes)
+    if total_counts is None:
+        total_counts = sum(count for _, count in unknown_barcodes)
     percentages = [round((count / total_counts) * 100, 1) for _, count in unknown_barcodes if count != 0]
-    distribution_string = '-'.join(map(str, percentages[:15])) # Limit to the top 15 percentages
+    distribution_string = '-'.join(map(str, percentages[:UNKNOWN_BARCODES_TOP_K])) # Limit to the top 15 percentages
     if percentages:
         return distribution_string, percentages[0]  
     else: 
@@ -74,13 +86,284 @@ def find_phix_output(unknown_barcodes):
     :param unknown_barcodes: List of unknown barcodes and their counts.
     :return: PhiX output count and barcode, if found.
     """
-    desired_pattern_no_plus = 'G'
-    desired_value_paired_end = 'GGGGGGGGGG+AGATCTCGGT'
     for barcode, value in unknown_barcodes:
-        if '+' in barcode and barcode == desired_value_paired_end:
+        if '+' in barcode and barcode == PHIX_BARCODE_PAIRED_END:
             logger.info(f"Found the pair with '+': {barcode}: {value}")
             return value, barcode
-        elif all(char == desired_pattern_no_plus for char in barcode):
+        elif is_phix_barcode(barcode):
             logger.info(f"Found the pair without '+': {barcode}: {value}")
             return value, barcode
     return None, None
+
+def is_phix_barcode(barcode):
+    """ PhiX reads show up as the paired-end 'GGGGGGGGGG+AGATCTCGGT' or as a poly-G single index """
+    return barcode == PHIX_BARCODE_PAIRED_END or all(char == 'G' for char in barcode)
+
+###############################################################################
+#------------------------ Streaming 'UnknownBarcodes' ------------------------#
+###############################################################################
+
+def aggregate_unknown_barcodes(lanes):
+    """
+    Sum the unknown barcode counts over all lanes.
+
+    bcl2fastq only reports the most frequent unknown barcodes of every lane, so the number of
+    distinct barcodes (and the memory of the aggregation) is bounded by lanes x that limit.
+
+    :param lanes: Iterable of the per-lane 'UnknownBarcodes' entries.
+    :return: Dictionary mapping the barcodes to their summed counts, in order of first appearance.
+    """
+    unknown_barcodes = {}
+    for lane in lanes:
+        for key, value in lane['Barcodes'].items():
+            unknown_barcodes[key] = unknown_barcodes.get(key, 0) + value
+    return unknown_barcodes
+
+def top_unknown_barcodes(unknown_barcode_counts, k):
+    """
+    Select the k most common unknown barcodes with a heap instead of sorting all of them.
+
+    Ties keep their order of first appearance, so the result equals the first k entries of
+    'extract_unknown_barcodes'.
+
+    :param unknown_barcode_counts: Dictionary mapping the barcodes to their counts.
+    :param k: Number of barcodes to keep.
+    :return: List of the k most common barcodes and their counts, sorted by count.
+    """
+    return heapq.nlargest(k, unknown_barcode_counts.items(), key=lambda x: x[1])
+
+def stream_unknown_barcodes(stats_json_path, chunk_size=1 << 20):
+    """
+    Yield the per-lane entries of the 'UnknownBarcodes' section of a Stats.json file.
+
+    The file is read in chunks and only the 'UnknownBarcodes' lanes are decoded one at a time, so
+    the 'ConversionResults' and 'DemuxResults' of large NovaSeq runs are never loaded into memory.
+
+    :param stats_json_path: Path to the Stats.json file.
+    :param chunk_size: Number of characters read at once.
+    :return: Generator of the lane dictionaries (with 'Lane' and 'Barcodes').
+    """
+    key = '"UnknownBarcodes"'
+    decoder = json.JSONDecoder()
+    with open(stats_json_path, 'r') as file:
+        # Skip ahead to the 'UnknownBarcodes' key, keeping a tail in case the key spans two chunks
+        buffer = ''
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            buffer = buffer[-len(key):] + chunk
+            position = buffer.find(key)
+            if position != -1:
+                buffer = buffer[position + len(key):]
+                break
+
+        position = 0
+        expected = ':['
+        while True:
+            if position >= len(buffer):
+                chunk = file.read(chunk_size)
+                if not chunk:
+                    raise ValueError(f"Unexpected end of '{stats_json_path}' in 'UnknownBarcodes'")
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            char = buffer[position]
+            if char.isspace():
+                position += 1
+            elif expected:
+                if char != expected[0]:
+                    raise ValueError(f"Unexpected '{char}' after 'UnknownBarcodes' in '{stats_json_path}'")
+                expected = expected[1:]
+                position += 1
+            elif char == ',':
+                position += 1
+            elif char == ']':
+                return
+            else:
+                try:
+                    lane, position = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    # The lane is not complete yet, read the next chunk
+                    chunk = file.read(chunk_size)
+                    if not chunk:
+                        raise
+                    buffer = buffer[position:] + chunk
+                    position = 0
+                    continue
+                yield lane
+
+###############################################################################
+#------------------------- Streaming FASTQ Read Counts -----------------------#
+###############################################################################
+
+# bcl2fastq output names, e.g. 'Sample-1_S3_L001_R1_001.fastq.gz' (no lane with --no-lane-splitting)
+FASTQ_FILE_PATTERN = re.compile(r'^(?P<sample>.+?)_S(?P<number>\d+)(?:_L\d{3})?_(?P<read>[RI]\d)_001\.fastq\.gz$')
+# Run folder entries that never contain the demultiplexed FASTQ files
+NON_FASTQ_FOLDERS = {'Data', 'InterOp', 'Thumbnail_Images', 'Logs', 'Stats', 'Reports', 'multiqc'}
+# Quality characters of Q30 and above (Phred+33)
+Q30_QUALITY_BYTE = 33 + 30
+
+def find_fastq_files(fastq_folder_name):
+    """
+    Find the demultiplexed read FASTQ files of a run folder, the index read files are skipped.
+
+    :param fastq_folder_name: The name of the run folder.
+    :return: List of (path, sample number, sample name, read) tuples, sorted by path.
+    """
+    fastq_files = []
+    for directory, folders, files in os.walk(os.path.join(FASTQ_FOLDER_PATH, fastq_folder_name)):
+        folders[:] = [folder for folder in folders if folder not in NON_FASTQ_FOLDERS]
+        for file_name in files:
+            match = FASTQ_FILE_PATTERN.match(file_name)
+            if match and match['read'].startswith('R'):
+                fastq_files.append((os.path.join(directory, file_name), int(match['number']), match['sample'], match['read']))
+    return sorted(fastq_files)
+
+# The FASTQ files of a run folder as a whole: the run folder path, their total size, latest mtime and number
+FastqFiles = namedtuple('FastqFiles', ['path', 'size', 'mtime', 'count'])
+
+def scan_fastq_files(fastq_folder_name):
+    """
+    Stat the FASTQ files of a run folder, to notice new or changed files without reading them.
+
+    :param fastq_folder_name: The name of the run folder.
+    :return: The FastqFiles of the run folder, None if it has no FASTQ files.
+    """
+    sizes = []
+    mtimes = []
+    for path, _, _, _ in find_fastq_files(fastq_folder_name):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue  # Removed since the folder was listed
+        sizes.append(stat.st_size)
+        mtimes.append(stat.st_mtime)
+    if not sizes:
+        return None
+    return FastqFiles(os.path.join(FASTQ_FOLDER_PATH, fastq_folder_name), sum(sizes), max(mtimes), len(sizes))
+
+def count_fastq_file(path, chunk_size=FASTQ_COUNT_CHUNK_SIZE):
+    """
+    Count the reads, bases and Q30 bases of a gzipped FASTQ file.
+
+    The file is decompressed in chunks and every chunk is processed with numpy: the position of a byte
+    within its 4-line record is the number of newlines before it, so the quality bytes are found without
+    splitting the chunk into lines. zlib and numpy release the GIL, so files are counted in parallel on
+    threads. The memory is bounded by a few times the chunk size per thread.
+
+    :param path: Path of the FASTQ file.
+    :param chunk_size: Number of decompressed bytes processed at once.
+    :return: Tuple of the number of reads, bases and bases with a quality of at least 30.
+    """
+    import numpy as np
+
+    lines = 0
+    bases = 0
+    q30_bases = 0
+    with gzip.open(path, 'rb') as fastq_file:
+        while True:
+            chunk = fastq_file.read(chunk_size)
+            if not chunk:
+                break
+            data = np.frombuffer(chunk, dtype=np.uint8)
+            newlines = data == ord('\n')
+            # Line of every byte within its record (0: header, 1: sequence, 2: '+', 3: quality), the uint8
+            # cumulative sum wraps around, which keeps the line number modulo 4. A newline already counts
+            # to the next line, so the newlines ending the '+' lines fall on line 3 (below the Q30 byte).
+            record_line = np.cumsum(newlines, dtype=np.uint8)
+            record_line += np.uint8(lines & 3)
+            record_line &= 3
+            quality = record_line == 3
+            chunk_lines = int(np.count_nonzero(newlines))
+            plus_line_ends = (lines + chunk_lines + 1) // 4 - (lines + 1) // 4
+            bases += int(np.count_nonzero(quality)) - plus_line_ends
+            quality &= data >= Q30_QUALITY_BYTE
+            q30_bases += int(np.count_nonzero(quality))
+            lines += chunk_lines
+    return lines // 4, bases, q30_bases
+
+def try_count_fastq_file(path):
+    """ Count a FASTQ file (see 'count_fastq_file'), None if it is truncated or can't be read """
+    try:
+        return count_fastq_file(path)
+    except (EOFError, OSError, zlib.error) as error:
+        logger.error(f"Could not read the FASTQ file '{path}': {error}")
+        return None
+
+def fastq_files_fingerprint(fastq_folder_name, fastq_files):
+    run_folder_path = os.path.join(FASTQ_FOLDER_PATH, fastq_folder_name)
+    fingerprint = []
+    for path, _, _, _ in fastq_files:
+        stat = os.stat(path)
+        fingerprint.append([os.path.relpath(path, run_folder_path), stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+def count_fastq_reads_by_sample(fastq_folder_name):
+    """
+    Count the reads of every sample from the FASTQ files of a run, for runs without a MultiQC report.
+
+    The reads of a sample are the reads of its R1 files (clusters, like the 'total' of bcl2fastq and
+    MultiQC), its yield and Q30 bases are summed over all its read files. The counts are cached per run
+    folder and only computed again if the FASTQ files changed.
+
+    :param fastq_folder_name: The name of the run folder.
+    :return: DataFrame with the columns of the MultiQC bcl2fastq per-sample table 'Sample', 'total',
+             'total_yield' and 'yieldQ30', ordered by sample number with the 'undetermined' sample last,
+             None if the run has no FASTQ files or one of them can't be read.
+    """
+    import pandas as pd
+
+    fastq_files = find_fastq_files(fastq_folder_name)
+    if not fastq_files:
+        return None
+    fingerprint = fastq_files_fingerprint(fastq_folder_name, fastq_files)
+    cache_path = os.path.join(FASTQ_COUNTS_CACHE_FOLDER_PATH, f"{fastq_folder_name}.json")
+    try:
+        with open(cache_path, 'r') as cache_file:
+            cached = json.load(cache_file)
+        if cached['fingerprint'] == fingerprint:
+            return pd.DataFrame(cached['samples'])
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    with ThreadPoolExecutor(max_workers=max(FASTQ_COUNT_THREADS, 1)) as executor:
+        counts = list(executor.map(try_count_fastq_file, [path for path, _, _, _ in fastq_files]))
+    if None in counts:
+        # A truncated or corrupt file (e.g. still being written) would give wrong totals
+        logger.error(f"Could not count the reads of the FASTQ files of {fastq_folder_name}")
+        return None
+
+    samples = {}
+    for (_, number, sample, read), (reads, bases, q30_bases) in zip(fastq_files, counts):
+        # bcl2fastq numbers the undetermined reads S0, MultiQC lists them last
+        key = (number == 0, number, sample)
+        totals = samples.setdefault(key, {'Sample': 'undetermined' if number == 0 else sample, 'total': 0, 'total_yield': 0, 'yieldQ30': 0})
+        if read == 'R1':
+            totals['total'] += reads
+        totals['total_yield'] += bases
+        totals['yieldQ30'] += q30_bases
+    if not any(undetermined for undetermined, _, _ in samples):
+        samples[(True, 0, 'undetermined')] = {'Sample': 'undetermined', 'total': 0, 'total_yield': 0, 'yieldQ30': 0}
+    rows = [samples[key] for key in sorted(samples)]
+
+    os.makedirs(FASTQ_COUNTS_CACHE_FOLDER_PATH, exist_ok=True)
+    write_state_file(cache_path, {'fingerprint': fingerprint, 'samples': rows})
+    return pd.DataFrame(rows)
+
+def fill_yield_statistics(record, df_by_sample):
+    """
+    Fill the yield (Gb) and Q30 (%) of a run from the FASTQ counts of its samples.
+
+    Only the read files are counted, not the index reads. The values of the InterOp files, parsed
+    afterwards, take precedence.
+
+    :param record: The RunStats record of the run to fill.
+    :param df_by_sample: The per-sample counts (see 'count_fastq_reads_by_sample').
+    :return: The filled record.
+    """
+    total_yield = int(df_by_sample['total_yield'].sum())
+    if total_yield:
+        record.yields = round(total_yield / 1e9, 2)
+        record.q_30 = round(int(df_by_sample['yieldQ30'].sum()) / total_yield * 100, 2)
+    return record
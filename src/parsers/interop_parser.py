@@ -0,0 +1,170 @@
+import os
+import struct
+import logging
+
+from utils.run_folder import artifact_path
+from config import INTEROP_CHUNK_RECORDS
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#--------------------------- InterOp Binary Metrics --------------------------#
+###############################################################################
+
+# The InterOp files of NovaSeq runs reach GBs, so the records are memory-mapped as numpy structured
+# arrays and aggregated in chunks, never loaded as a whole.
+
+# TileMetricsOut v2 metric codes
+TILE_CLUSTER_DENSITY = 100
+TILE_CLUSTER_COUNT = 102
+TILE_CLUSTER_COUNT_PF = 103
+# TileMetricsOut v3 record codes
+TILE_RECORD_CODE = ord('t')
+
+def map_records(path, header_size, dtype):
+    """ Memory-map the fixed-size records following the header of an InterOp file """
+    import numpy as np
+
+    record_count = (os.path.getsize(path) - header_size) // dtype.itemsize
+    if record_count <= 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=header_size, shape=(record_count,))
+
+def read_tile_metrics(path):
+    """
+    Sum the clusters and PF clusters and the cluster density per lane from a TileMetricsOut.bin (v2 or v3).
+
+    :param path: Path of the TileMetricsOut.bin file.
+    :return: Dictionary mapping the lanes to their 'clusters', 'clusters_pf', 'density_sum' (clusters/mm²,
+             summed over the tiles) and 'tiles'.
+    """
+    import numpy as np
+
+    with open(path, 'rb') as interop_file:
+        version, record_size = struct.unpack('<BB', interop_file.read(2))
+        if version == 3:
+            tile_area, = struct.unpack('<f', interop_file.read(4))
+    lanes = {}
+    if version == 2:
+        dtype = np.dtype([('lane', '<u2'), ('tile', '<u2'), ('code', '<u2'), ('value', '<f4')])
+        records = map_records(path, 2, dtype)
+        for start in range(0, len(records), INTEROP_CHUNK_RECORDS):
+            chunk = records[start:start + INTEROP_CHUNK_RECORDS]
+            for lane in np.unique(chunk['lane']):
+                in_lane = chunk[chunk['lane'] == lane]
+                totals = lanes.setdefault(int(lane), {'clusters': 0.0, 'clusters_pf': 0.0, 'density_sum': 0.0, 'tiles': 0})
+                densities = in_lane['value'][in_lane['code'] == TILE_CLUSTER_DENSITY]
+                totals['clusters'] += float(in_lane['value'][in_lane['code'] == TILE_CLUSTER_COUNT].sum(dtype=np.float64))
+                totals['clusters_pf'] += float(in_lane['value'][in_lane['code'] == TILE_CLUSTER_COUNT_PF].sum(dtype=np.float64))
+                totals['density_sum'] += float(densities.sum(dtype=np.float64))
+                totals['tiles'] += len(densities)
+    elif version == 3:
+        # The 't' records hold the cluster counts of a tile, the density is derived from the tile area of the header
+        dtype = np.dtype([('lane', '<u2'), ('tile', '<u4'), ('code', 'u1'), ('clusters', '<f4'), ('clusters_pf', '<f4')])
+        records = map_records(path, 6, dtype)
+        for start in range(0, len(records), INTEROP_CHUNK_RECORDS):
+            chunk = records[start:start + INTEROP_CHUNK_RECORDS]
+            chunk = chunk[chunk['code'] == TILE_RECORD_CODE]
+            for lane in np.unique(chunk['lane']):
+                in_lane = chunk[chunk['lane'] == lane]
+                totals = lanes.setdefault(int(lane), {'clusters': 0.0, 'clusters_pf': 0.0, 'density_sum': 0.0, 'tiles': 0})
+                totals['clusters'] += float(in_lane['clusters'].sum(dtype=np.float64))
+                totals['clusters_pf'] += float(in_lane['clusters_pf'].sum(dtype=np.float64))
+                totals['density_sum'] += float(in_lane['clusters'].sum(dtype=np.float64)) / tile_area
+                totals['tiles'] += len(in_lane)
+    else:
+        raise ValueError(f"Unsupported TileMetricsOut version {version} in '{path}'")
+    return lanes
+
+def read_q_metrics(path):
+    """
+    Sum the Q-score histograms per lane from a QMetricsOut.bin (v4 to v7), over all tiles and cycles.
+
+    The histograms count the base calls of the PF clusters. Binned files (v5 to v7) map every bin to its
+    Q-score with the bin definitions of the header.
+
+    :param path: Path of the QMetricsOut.bin file.
+    :return: Dictionary mapping the lanes to their 'bases' and 'q30_bases'.
+    """
+    import numpy as np
+
+    with open(path, 'rb') as interop_file:
+        version, record_size = struct.unpack('<BB', interop_file.read(2))
+        header_size = 2
+        bin_scores = None
+        if version in (5, 6, 7):
+            has_bins, = struct.unpack('<B', interop_file.read(1))
+            header_size += 1
+            if has_bins:
+                bin_count, = struct.unpack('<B', interop_file.read(1))
+                # Lower bounds, upper bounds and the Q-score every bin is remapped to
+                bin_definitions = interop_file.read(3 * bin_count)
+                bin_scores = np.frombuffer(bin_definitions[2 * bin_count:], dtype=np.uint8)
+                header_size += 1 + 3 * bin_count
+    if version not in (4, 5, 6, 7):
+        raise ValueError(f"Unsupported QMetricsOut version {version} in '{path}'")
+
+    tile_type = '<u4' if version == 7 else '<u2'
+    id_size = 8 if version == 7 else 6
+    histogram_size = (record_size - id_size) // 4
+    dtype = np.dtype([('lane', '<u2'), ('tile', tile_type), ('cycle', '<u2'), ('histogram', '<u4', (histogram_size,))])
+    # Unbinned histograms (and all v4/v5 records) have one entry per Q-score from Q1 to Q50
+    scores = np.arange(1, histogram_size + 1) if bin_scores is None or histogram_size != len(bin_scores) else bin_scores
+    q30 = scores >= 30
+
+    lanes = {}
+    records = map_records(path, header_size, dtype)
+    for start in range(0, len(records), INTEROP_CHUNK_RECORDS):
+        chunk = records[start:start + INTEROP_CHUNK_RECORDS]
+        for lane in np.unique(chunk['lane']):
+            histogram = chunk['histogram'][chunk['lane'] == lane].sum(axis=0, dtype=np.uint64)
+            totals = lanes.setdefault(int(lane), {'bases': 0, 'q30_bases': 0})
+            totals['bases'] += int(histogram.sum())
+            totals['q30_bases'] += int(histogram[q30].sum())
+    return lanes
+
+def lane_metric_values(clusters, clusters_pf, density_sum, tiles, bases, q30_bases):
+    """ Density (K/mm²), Clusters PF (%), Yields (Gb) and Q 30 (%), None where the counts are missing """
+    return [
+        round(density_sum / tiles / 1000, 1) if tiles else None,
+        round(clusters_pf / clusters * 100, 2) if clusters else None,
+        round(bases / 1e9, 2) if bases else None,
+        round(q30_bases / bases * 100, 2) if bases else None,
+    ]
+
+def parse_interop_metrics(record, fastq_folder_name, artifacts):
+    """
+    Compute the density, clusters PF, yield and Q30 of a run per lane and per run from its InterOp files.
+
+    The run values are the density averaged over all tiles, the clusters PF of all clusters and the
+    yield and Q30 over all cycles, index cycles included (as the 'Total' row of the Sequencing Analysis
+    Viewer). They take precedence over the values typed into the Sciebo protocols.
+
+    :param record: The RunStats record of the run to fill.
+    :param fastq_folder_name: The name of the run folder.
+    :param artifacts: The scan of the run folder (see 'run_folder.scan_run_folder').
+    :return: The filled record.
+    """
+    tile_metrics_path = artifact_path(artifacts, 'tile_metrics')
+    q_metrics_path = artifact_path(artifacts, 'q_metrics')
+    try:
+        tile_lanes = read_tile_metrics(tile_metrics_path) if tile_metrics_path is not None else {}
+        q_lanes = read_q_metrics(q_metrics_path) if q_metrics_path is not None else {}
+    except (ValueError, OSError, struct.error) as error:
+        logger.error(f"Could not read the InterOp files of {fastq_folder_name}: {error}")
+        return record
+    if not tile_lanes and not q_lanes:
+        return record
+
+    run_totals = {'clusters': 0.0, 'clusters_pf': 0.0, 'density_sum': 0.0, 'tiles': 0, 'bases': 0, 'q30_bases': 0}
+    for lane in sorted(set(tile_lanes) | set(q_lanes)):
+        totals = {**dict.fromkeys(run_totals, 0), **tile_lanes.get(lane, {}), **q_lanes.get(lane, {})}
+        for name in run_totals:
+            run_totals[name] += totals[name]
+        record.lane_metrics.append([lane] + lane_metric_values(**totals))
+
+    run_values = lane_metric_values(**run_totals)
+    for attribute, value in zip(('density', 'clusters_pf', 'yields', 'q_30'), run_values):
+        if value is not None:
+            setattr(record, attribute, value)
+    return record
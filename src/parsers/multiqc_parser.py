@@ -1,20 +1,23 @@
 import pandas as pd
 import numpy as np
-import os 
 import logging
 
-from config import FASTQ_FOLDER_PATH
-
 # get the logger for the current module
 logger = logging.getLogger(__name__)
 
-def parse_multiqc_data(df, fastq_folder_name):
-    multiqc_bcl2fastq_bysample_path = os.path.join(FASTQ_FOLDER_PATH, fastq_folder_name, "multiqc", "multiqc_data", "multiqc_bcl2fastq_bysample.txt")
-    if not os.path.exists(multiqc_bcl2fastq_bysample_path):
-        return  
+def read_multiqc_bysample(multiqc_bcl2fastq_bysample_path):
+    """ Read the MultiQC bcl2fastq per-sample table of a run """
+    return pd.read_csv(multiqc_bcl2fastq_bysample_path, sep='\t')
+
+def fill_read_statistics(record, df_by_sample):
+    """
+    Compute the read statistics of a run from its per-sample read counts.
 
-    df_by_sample = pd.read_csv(multiqc_bcl2fastq_bysample_path, sep='\t')
-    
+    :param record: The RunStats record of the run to fill.
+    :param df_by_sample: DataFrame with the columns 'Sample' and 'total' (reads), as in the MultiQC
+                         bcl2fastq per-sample table, including the 'undetermined' sample.
+    :return: The filled record.
+    """
     count_total_reads = df_by_sample['total'].sum()
     count_undetermined_reads = df_by_sample.loc[df_by_sample['Sample'] == 'undetermined', 'total'].iloc[0]
     undertermined_read_percentage = round(count_undetermined_reads / count_total_reads * 100, 1)
@@ -28,9 +31,12 @@ def parse_multiqc_data(df, fastq_folder_name):
     percentages = np.round((read_counts / count_total_reads) * 100, decimals=1)
     distribution_string = '-'.join(map(str, percentages))
 
-    # Update DataFrame directly
-    df.loc[fastq_folder_name, 'STD in Millions'] = std_deviation_millions
-    df.loc[fastq_folder_name, 'CV'] = cv_percentage
-    df.loc[fastq_folder_name, 'Undetermined Reads Percentage'] = undertermined_read_percentage
-    df.loc[fastq_folder_name, 'Read Distribution'] = distribution_string
-    df.loc[fastq_folder_name, 'Total Read Count in Millions'] = count_total_reads / 1e6
\ No newline at end of file
+    # Update the run record
+    record.std_in_millions = std_deviation_millions
+    record.cv = cv_percentage
+    record.undetermined_reads_percentage = undertermined_read_percentage
+    record.read_distribution = distribution_string
+    record.total_read_count_in_millions = count_total_reads / 1e6
+    # Per-sample reads (sample name, total) in file order, the 'undetermined' sample included
+    record.sample_reads = [[sample, total] for sample, total in zip(df_by_sample['Sample'].astype(str).tolist(), df_by_sample['total'].tolist())]
+    return record
@@ -1,37 +1,70 @@
-import openpyxl
-import xlrd
 import os
-import difflib
+import json
 import logging
-import Levenshtein
 import re
-import warnings
 
-from datetime import datetime, timedelta
-
-from utils.utilities import read_cache, write_cache
-from config import APPLICATION_MAPPING, SCIEBO_FOLDER_PATH
+# The workbook readers (openpyxl, xlrd), the schema (pandas) and Levenshtein are imported where they are
+# needed, so runs that find nothing new to parse don't pay for importing them
+from utils.sciebo_cache import get_cached_match, set_cached_match
+from utils.profiler import profiled_map, WORKBOOK_STAGE
+from utils.run_id import parse_run_id
+from utils.prefetch import io_map, Prefetcher
+from utils.state_files import write_state_file
+from config import SCIEBO_FOLDER_PATH, SCIEBO_INDEX_FILE_PATH, FLOWCELL_TOKEN_MIN_LENGTH
 
+logger = logging.getLogger(__name__)
 
-# Suppress specific openpyxl warnings
-warnings.filterwarnings("ignore", message="Data Validation extension is not supported and will be removed")
-warnings.filterwarnings("ignore", message="Unknown extension is not supported and will be removed")
 
-logger = logging.getLogger(__name__)
+SCIEBO_REPORT_COLUMNS = [
+    'Sequencing Kit', 'Cycles Read 1', 'Cycles Index 1', 'Cycles Read 2', 'Cycles Index 2', 'Density',
+    'Clusters PF', 'Yields', 'Q 30', 'Name', 'Protocol Name', 'Application', 'Phix Input'
+]
+# Measured from the InterOp (or FASTQ) files when the run has them, the values typed into the protocol only fill the gaps
+INTEROP_REPORT_COLUMNS = ['Density', 'Clusters PF', 'Yields', 'Q 30']
 
+def parse_sciebo_report(record, sciebo_report_path):
+    """
+    Fill a run record with the fields of its matched Sciebo report.
 
-def parse_sciebo_report(df, fastq_folder_name):
-    sciebo_report_path = find_corresponding_sciebo(fastq_folder_name)
-    if sciebo_report_path != None and sciebo_report_path.lower().endswith(".xlsx"):
-        parse_sciebo_xlsx_report(df, fastq_folder_name, sciebo_report_path)
-    elif sciebo_report_path != None and sciebo_report_path.lower().endswith(".xls"):
-        parse_sciebo_xls_report(df, fastq_folder_name, sciebo_report_path)
-    else:
-        df.loc[fastq_folder_name,"Sciebo Found"] = False
+    :param record: The RunStats record of the run to fill.
+    :param sciebo_report_path: The path returned by 'find_corresponding_sciebo', None if there was no match.
+    :return: The filled record.
+    """
+    if sciebo_report_path is None or not sciebo_report_path.lower().endswith((".xls", ".xlsx")):
+        record.sciebo_found = False
         logger.error("Unsupported file format for sciebo_report")
+        return record
+
+    # The fields were extracted when the workbook was indexed, no need to open it again
+    entry = get_sciebo_index()['workbooks'].get(sciebo_report_path)
+    if entry is None:
+        entry = scan_sciebo_workbook(sciebo_report_path)
+    if entry['fields'] is None:
+        record.sciebo_found = False
+        logger.error(f"Could not extract the report fields from {sciebo_report_path}")
+        return record
+    return write_sciebo_fields(record, entry['fields'])
+
+def write_sciebo_fields(record, fields):
+    """
+    Write the extracted report fields of a Sciebo workbook into a run record.
 
-def parse_sciebo_xls_report(df, fastq_folder_name, report_path):
-    """ Gather:
+    :param record: The RunStats record of the run to fill.
+    :param fields: Dictionary mapping the report columns to their values.
+    :return: The filled record.
+    """
+    from utils.schema import normalize_report_fields
+
+    fields = normalize_report_fields(fields)
+    record.update_columns({
+        column: fields[column] for column in SCIEBO_REPORT_COLUMNS
+        if column not in INTEROP_REPORT_COLUMNS or getattr(record, record.ATTRIBUTES[column]) is None
+    })
+    record.sciebo_found = True
+    return record
+
+def extract_xls_report_fields(label_cells, report_path):
+    """ Gather from the label cells of an .xls workbook:
     - Project Name
     - Sequencing Kit
     - Cycles Read 1/2
@@ -68,77 +101,64 @@ def parse_sciebo_xls_report(df, fastq_folder_name, report_path):
     # Combine the required parts to form the desired string
     protocol_name = f"{date_part}_{application_part}"
 
-    # Find the closest match using difflib
-    application = get_application_from_filename(application_part.lower())
-
-
-    # Open the Excel file
-    workbook = xlrd.open_workbook(report_path)
-
-    # Iterate through sheets
-    for sheet_name in workbook.sheet_names():
-        sheet = workbook.sheet_by_name(sheet_name)
-
-        # Iterate through rows and columns
-        for i in range(sheet.nrows):
-            for j in range(sheet.ncols):
-                cell_value = sheet.cell_value(i, j)
-
-                if cell_value is None:
-                    continue
-                if cell_value == "Cycles Read 1":
-                    cycles_read_1 = sheet.cell_value(i, j + 1)
-                elif cell_value == "Cycles Index 1":
-                    cycles_index_1 = sheet.cell_value(i, j + 1)
-                elif cell_value == "Cycles Index 2":
-                    cycles_index_2 = sheet.cell_value(i, j + 1)
-                elif cell_value == "Cycles Read 2":
-                    cycles_read_2 = sheet.cell_value(i, j + 1)
-                elif cell_value == "Density":
-                    density = sheet.cell_value(i, j + 1)
-                elif cell_value == "Clusters PF":
-                    clusters_pf = sheet.cell_value(i, j + 1)
-                elif cell_value == "Yield":
-                    yields = sheet.cell_value(i, j + 1)
-                    if type(yields) is str:
-                        yields = yields.replace(',', '.')
-                        yields =''.join(char for char in yields if char.isdigit() or char == '.')
-                elif cell_value == "% >= Q30":
-                    q_30 = sheet.cell_value(i, j + 1)
-                    if q_30 is None:
-                        continue
-                    try:
-                        if type(q_30) is str:
-                            q_30 = q_30.replace('%', '')
-                            q_30 = float(q_30.replace(' ',''))
-                        if q_30 < 1:
-                            q_30 *= 100
-                    except BaseException:
-                        logger.info(f"q_30 = {q_30} was not handled successfully")
-                elif isinstance(cell_value, str) and "kit" in cell_value.lower():
-                    # Find the position of ':' and get the substring after it
-                    index_colon = cell_value.find(':')
-                    if index_colon != -1:
-                        sequencing_kit = cell_value[index_colon + 1:].strip()
-                        sequencing_kit = sequencing_kit.lower()
-                elif isinstance(cell_value, str) and "project" in cell_value.lower():
-                    # Find the position of ':' and get the substring after it
-                    index_colon = cell_value.find(':')
-                    if index_colon != -1:
-                        project_name = cell_value[index_colon + 1:].strip()
-                elif isinstance(cell_value, str) and "phix" in cell_value.lower():
-                    if (year, month, day) > (2024, 1, 16):
-                        # The date is past 16.01.24 and the phix protocol is in place
-                        phix_input = sheet.cell_value(i, j + 1)
-                    else:
-                        # No Protocol prior to the 16.01.24
-                        phix_input = None
-
-    df.loc[fastq_folder_name, ['Sequencing Kit', 'Cycles Read 1', 'Cycles Index 1', 'Cycles Read 2', 'Cycles Index 2', 'Density', 'Clusters PF', 'Yields', 'Q 30', 'Name', 'Protocol Name', 'Application', 'Phix Input']] = [sequencing_kit, cycles_read_1, cycles_index_1, cycles_read_2, cycles_index_2, density, clusters_pf, yields, q_30, project_name, protocol_name, application, phix_input]
-    df.loc[fastq_folder_name,"Sciebo Found"] = True
-
-def parse_sciebo_xlsx_report(df, fastq_folder_name, report_path):
-    """ Gather:
+    # Resolved to its GPM name with the kit in the post-processing (see utils/name_normalizer.py)
+    application = application_part
+
+    # Iterate through the labels and the values next to them
+    for cell_value, next_value, _ in label_cells:
+        if cell_value == "Cycles Read 1":
+            cycles_read_1 = next_value
+        elif cell_value == "Cycles Index 1":
+            cycles_index_1 = next_value
+        elif cell_value == "Cycles Index 2":
+            cycles_index_2 = next_value
+        elif cell_value == "Cycles Read 2":
+            cycles_read_2 = next_value
+        elif cell_value == "Density":
+            density = next_value
+        elif cell_value == "Clusters PF":
+            clusters_pf = next_value
+        elif cell_value == "Yield":
+            yields = next_value
+            if type(yields) is str:
+                yields = yields.replace(',', '.')
+                yields =''.join(char for char in yields if char.isdigit() or char == '.')
+        elif cell_value == "% >= Q30":
+            q_30 = next_value
+            if q_30 is None:
+                continue
+            try:
+                if type(q_30) is str:
+                    q_30 = q_30.replace('%', '')
+                    q_30 = float(q_30.replace(' ',''))
+                if q_30 < 1:
+                    q_30 *= 100
+            except BaseException:
+                logger.info(f"q_30 = {q_30} was not handled successfully")
+        elif isinstance(cell_value, str) and "kit" in cell_value.lower():
+            # Find the position of ':' and get the substring after it
+            index_colon = cell_value.find(':')
+            if index_colon != -1:
+                sequencing_kit = cell_value[index_colon + 1:].strip()
+                sequencing_kit = sequencing_kit.lower()
+        elif isinstance(cell_value, str) and "project" in cell_value.lower():
+            # Find the position of ':' and get the substring after it
+            index_colon = cell_value.find(':')
+            if index_colon != -1:
+                project_name = cell_value[index_colon + 1:].strip()
+        elif isinstance(cell_value, str) and "phix" in cell_value.lower():
+            if (year, month, day) > (2024, 1, 16):
+                # The date is past 16.01.24 and the phix protocol is in place
+                phix_input = next_value
+            else:
+                # No Protocol prior to the 16.01.24
+                phix_input = None
+
+    values = [sequencing_kit, cycles_read_1, cycles_index_1, cycles_read_2, cycles_index_2, density, clusters_pf, yields, q_30, project_name, protocol_name, application, phix_input]
+    return dict(zip(SCIEBO_REPORT_COLUMNS, values))
+
+def extract_xlsx_report_fields(label_cells, report_path):
+    """ Gather from the label cells of an .xlsx workbook:
     - Project Name
     - Sequencing Kit
     - Cycles Read 1/2
@@ -175,244 +195,300 @@ def parse_sciebo_xlsx_report(df, fastq_folder_name, report_path):
     # Combine the required parts to form the desired string
     protocol_name = f"{date_part}_{application_part}"
     
-    # Find the closest match using difflib
-    application = get_application_from_filename(application_part.lower())
-
-    wb = openpyxl.load_workbook(filename=report_path, data_only=True)
-
-    # Get All Sheets
-    for excel_sheet_name in wb.sheetnames:
-
-        # Get Sheet Object by names
-        excel_sheet = wb[excel_sheet_name]
-
-        for i in range(1,excel_sheet.max_row):
-            for j in range(1, excel_sheet.max_column):
-                excel_sheet_name_cell = excel_sheet.cell(row=i, column=j).value
-                if excel_sheet_name_cell == None:
-                    continue
-                elif excel_sheet_name_cell == "Cycles Read 1":
-                    cycles_read_1 = excel_sheet.cell(row=i, column=j+1).value
-                elif excel_sheet_name_cell == "Cycles Index 1":
-                    cycles_index_1 = excel_sheet.cell(row=i, column=j+1).value
-                elif excel_sheet_name_cell == "Cycles Index 2":
-                    cycles_index_2 = excel_sheet.cell(row=i, column=j+1).value
-                elif excel_sheet_name_cell == "Cycles Read 2":
-                    cycles_read_2 = excel_sheet.cell(row=i, column=j+1).value
-                elif type(excel_sheet_name_cell) == str and  "Density" in excel_sheet_name_cell:
-                    density = excel_sheet.cell(row=i, column=j+1).value
-                elif type(excel_sheet_name_cell) == str and  "Clusters PF" in excel_sheet_name_cell:
-                    clusters_pf = excel_sheet.cell(row=i, column=j+1).value
-                elif type(excel_sheet_name_cell) == str and "Yield" in excel_sheet_name_cell :
-                    yields = excel_sheet.cell(row=i, column=j+1).value
-                    if type(yields) is str:
-                        yields = yields.replace(',', '.')
-                        yields =''.join(char for char in yields if char.isdigit() or char == '.')
-                elif type(excel_sheet_name_cell) == str and "Q30" in excel_sheet_name_cell:
-                    q_30 = excel_sheet.cell(row=i, column=j+1).value
-                    if q_30 is None:
-                        continue
-                    try:
-                        if type(q_30) is str:
-                            q_30 = q_30.replace('%', '')
-                            q_30 = float(q_30.replace(' ',''))
-                        if q_30 < 1:
-                            q_30 *= 100
-                        q_30 = str(q_30)
-                    except BaseException:
-                        logger.info(f"q_30 = {q_30} was not handled successfully")
-                elif type(excel_sheet_name_cell) == str and "Phix [%]" in excel_sheet_name_cell:
-                    if (year, month, day) > (2024, 1, 16):
-                        # The date is past 16.01.24 and the phix protocol is in place
-                        phix_input = excel_sheet.cell(row=i, column=j+1).value
-                        if phix_input is None or phix_input == "":
-                            phix_input = excel_sheet.cell(row=i, column=j+2).value
-                    else:
-                        # No Protocol prior to the 16.01.24
-                        phix_input = None
-                elif type(excel_sheet_name_cell) == str and "Sequencing Kit" in excel_sheet_name_cell:
-                    sequencing_kit = excel_sheet.cell(row=i, column=j+1).value
-                    if sequencing_kit is None or sequencing_kit == "":
-                            sequencing_kit = excel_sheet.cell(row=i, column=j+2).value
-                elif type(excel_sheet_name_cell) == str and "kit" in excel_sheet_name_cell.lower():
-                    if sequencing_kit is not None:
-                        # sequencing_kit was already found using the new template
-                        continue
-                    # Find the position of ':' and get the substring after it
-                    index_colon = excel_sheet_name_cell.find(':')
-                    if index_colon != -1:
-                        sequencing_kit = excel_sheet_name_cell[index_colon + 1:].strip()
-                        sequencing_kit = sequencing_kit.lower()
-                elif type(excel_sheet_name_cell) == str and "project" in excel_sheet_name_cell.lower():
-                    # Find the position of ':' and get the substring after it
-                    index_colon = excel_sheet_name_cell.find(':')
-                    if index_colon != -1:
-                        project_name = excel_sheet_name_cell[index_colon + 1:].strip()
-                    if project_name is None or project_name == "":
-                        project_name = excel_sheet.cell(row=i, column=j+1).value
-                    if project_name is None or project_name == "":
-                        project_name = excel_sheet.cell(row=i, column=j+2).value
-
-    df.loc[fastq_folder_name, ['Sequencing Kit', 'Cycles Read 1', 'Cycles Index 1', 'Cycles Read 2', 'Cycles Index 2', 'Density', 'Clusters PF', 'Yields', 'Q 30', 'Name', 'Protocol Name', 'Application', 'Phix Input']] = [sequencing_kit, cycles_read_1, cycles_index_1, cycles_read_2, cycles_index_2, density, clusters_pf, yields, q_30, project_name, protocol_name, application, phix_input]
-    df.loc[fastq_folder_name,"Sciebo Found"] = True
-
-def get_application_from_filename(filename):
-    parts = filename.split('_')
-    application_part = parts[-1]  # Last part of the filename
-    closest_match = difflib.get_close_matches(application_part.lower(), APPLICATION_MAPPING.keys(), n=1, cutoff=0.6)
-    application = APPLICATION_MAPPING.get(closest_match[0], 'unknown') if closest_match else 'unknown'
-    return application
+    # Resolved to its GPM name with the kit in the post-processing (see utils/name_normalizer.py)
+    application = application_part
+
+    # Iterate through the labels and the values next to them
+    for excel_sheet_name_cell, next_value, next_next_value in label_cells:
+        if excel_sheet_name_cell == "Cycles Read 1":
+            cycles_read_1 = next_value
+        elif excel_sheet_name_cell == "Cycles Index 1":
+            cycles_index_1 = next_value
+        elif excel_sheet_name_cell == "Cycles Index 2":
+            cycles_index_2 = next_value
+        elif excel_sheet_name_cell == "Cycles Read 2":
+            cycles_read_2 = next_value
+        elif type(excel_sheet_name_cell) == str and  "Density" in excel_sheet_name_cell:
+            density = next_value
+        elif type(excel_sheet_name_cell) == str and  "Clusters PF" in excel_sheet_name_cell:
+            clusters_pf = next_value
+        elif type(excel_sheet_name_cell) == str and "Yield" in excel_sheet_name_cell :
+            yields = next_value
+            if type(yields) is str:
+                yields = yields.replace(',', '.')
+                yields =''.join(char for char in yields if char.isdigit() or char == '.')
+        elif type(excel_sheet_name_cell) == str and "Q30" in excel_sheet_name_cell:
+            q_30 = next_value
+            if q_30 is None:
+                continue
+            try:
+                if type(q_30) is str:
+                    q_30 = q_30.replace('%', '')
+                    q_30 = float(q_30.replace(' ',''))
+                if q_30 < 1:
+                    q_30 *= 100
+                q_30 = str(q_30)
+            except BaseException:
+                logger.info(f"q_30 = {q_30} was not handled successfully")
+        elif type(excel_sheet_name_cell) == str and "Phix [%]" in excel_sheet_name_cell:
+            if (year, month, day) > (2024, 1, 16):
+                # The date is past 16.01.24 and the phix protocol is in place
+                phix_input = next_value
+                if phix_input is None or phix_input == "":
+                    phix_input = next_next_value
+            else:
+                # No Protocol prior to the 16.01.24
+                phix_input = None
+        elif type(excel_sheet_name_cell) == str and "Sequencing Kit" in excel_sheet_name_cell:
+            sequencing_kit = next_value
+            if sequencing_kit is None or sequencing_kit == "":
+                    sequencing_kit = next_next_value
+        elif type(excel_sheet_name_cell) == str and "kit" in excel_sheet_name_cell.lower():
+            if sequencing_kit is not None:
+                # sequencing_kit was already found using the new template
+                continue
+            # Find the position of ':' and get the substring after it
+            index_colon = excel_sheet_name_cell.find(':')
+            if index_colon != -1:
+                sequencing_kit = excel_sheet_name_cell[index_colon + 1:].strip()
+                sequencing_kit = sequencing_kit.lower()
+        elif type(excel_sheet_name_cell) == str and "project" in excel_sheet_name_cell.lower():
+            # Find the position of ':' and get the substring after it
+            index_colon = excel_sheet_name_cell.find(':')
+            if index_colon != -1:
+                project_name = excel_sheet_name_cell[index_colon + 1:].strip()
+            if project_name is None or project_name == "":
+                project_name = next_value
+            if project_name is None or project_name == "":
+                project_name = next_next_value
+
+    values = [sequencing_kit, cycles_read_1, cycles_index_1, cycles_read_2, cycles_index_2, density, clusters_pf, yields, q_30, project_name, protocol_name, application, phix_input]
+    return dict(zip(SCIEBO_REPORT_COLUMNS, values))
 
 ###############################################################################
 #-------------------- Functions for 'Fastq-Sciebo' mathcing ------------------#
 ###############################################################################
 
 def find_corresponding_sciebo(fastq_folder):
-    cache = read_cache()
+    sciebo_index = get_sciebo_index()
+
+    run_id = parse_run_id(fastq_folder)
+    sequence_date_prefix = run_id.date_prefix
+    flowcell_id = run_id.flowcell_id
+    sciebo_candidates = sciebo_index['by_run_date'].get(sequence_date_prefix, [])
+    candidate_mtimes = {sciebo_file: sciebo_index['mtimes'][sciebo_file] for sciebo_file in sciebo_candidates}
 
     # Check the cache first
-    if fastq_folder in cache:
-        if cache[fastq_folder] != '':
-            logger.info(f"Using cached sciebo file for {fastq_folder}: {cache[fastq_folder]}")
-            return cache[fastq_folder]
+    cached = get_cached_match(fastq_folder, candidate_mtimes, sciebo_index['mtimes'])
+    if cached is not None:
+        if cached['path'] != '':
+            logger.info(f"Using cached sciebo file for {fastq_folder}: {cached['path']}")
+            return cached['path']
         else:
-            # Check if more than 3 months have passed
-            if has_three_months_passed(fastq_folder):
-                logger.info("3 months have passed since the given date - Skipping Sciebo search")
-                return None
+            logger.info(f"No sciebo candidate changed since the last search for {fastq_folder} - Skipping Sciebo search")
+            return None
 
     # Beggining the search for the corresponding sciebo
-    sequence_date_prefix = fastq_folder.split('_')[0]
-    flowcell_id = fastq_folder.split('_')[3][1:]
-    sciebo_files = []
-
-    # Walk through the directory tree
-    for folder_path, _, files in os.walk(SCIEBO_FOLDER_PATH):
-        for file_name in files:
-            sciebo_file_path = os.path.join(folder_path, file_name)
-            sciebo_files.append(sciebo_file_path)
-
-    sciebo_candidates = [file for file in sciebo_files if sciebo_date_match(file, sequence_date_prefix)]
     if len(sciebo_candidates) == 0:
+        # Not cached as a miss, the index lookup is cheap
         logger.info(f"zero sciebo candidates for {fastq_folder}")
         return None
     elif len(sciebo_candidates) == 1:
-        cache[fastq_folder] = sciebo_candidates[0]
-        write_cache(cache)
+        set_cached_match(fastq_folder, sciebo_candidates[0], sciebo_index['mtimes'][sciebo_candidates[0]])
         logger.info(f"single sciebo match found for {fastq_folder}! {sciebo_candidates[0]}")
         return sciebo_candidates[0]
     else:
         logger.info(f"multiple candidates for {fastq_folder}! {sciebo_candidates}")
-        for sciebo_file in sciebo_candidates:
-            if sciebo_fastq_match(flowcell_id, sciebo_file):
-                logger.info(f"sciebo match found from multiple candidates for {fastq_folder}! {sciebo_file}")
-                cache[fastq_folder] = sciebo_file
-                write_cache(cache)
-                return sciebo_file
+        flowcell_hits = find_flowcell_workbooks(flowcell_id)
+        matched_candidates = [sciebo_file for sciebo_file in sciebo_candidates if sciebo_file in flowcell_hits]
+        if matched_candidates:
+            # Prefer an exact flowcell match, ties keep the candidate order
+            sciebo_file = min(matched_candidates, key=lambda candidate: flowcell_hits[candidate])
+            logger.info(f"sciebo match found from multiple candidates for {fastq_folder}! {sciebo_file} (flowcell matches: {flowcell_hits})")
+            set_cached_match(fastq_folder, sciebo_file, sciebo_index['mtimes'][sciebo_file])
+            return sciebo_file
     logger.info(f"No sciebo match was found for {fastq_folder}")
-    cache[fastq_folder] = ''
-    write_cache(cache)
+    # Only valid as long as the candidates of the run date stay the same
+    set_cached_match(fastq_folder, '', candidate_mtimes=candidate_mtimes)
     return None
 
-def sciebo_date_match(file_name, desired_date):
-    """ Find if the sciebo corresponds to the specific run date
+###############################################################################
+#------------------------ Sciebo Workbook Index ------------------------------#
+###############################################################################
+
+# The index is loaded and refreshed once per process, all lookups are answered from memory
+_sciebo_index = None
+# Bump whenever the content of the index entries changes, so stored entries are scanned again
+SCIEBO_INDEX_ENTRY_VERSION = 2
+
+def get_sciebo_index(mapper=map):
     """
-    report_path = file_name
-    if file_name.lower().endswith(".xls"):
-        # Open the Excel file
-        try:
-            workbook = xlrd.open_workbook(report_path)
-        except:
-            return False
-        # Iterate through sheets
-        for sheet_name in workbook.sheet_names():
-            sheet = workbook.sheet_by_name(sheet_name)
-            # Iterate through rows and columns
-            for i in range(sheet.nrows):
-                for j in range(sheet.ncols):
-                    cell_value = sheet.cell_value(i, j)
-                    if type(cell_value) is str:
-                        if cell_value == "Run name":
-                            try:
-                                run_name = sheet.cell_value(i, j + 1)
-                            except:
-                                continue
-                            if  run_name is not None and run_name.startswith(desired_date):
-                                return True
-
-    elif file_name.lower().endswith(".xlsx"):
-        # Open the Excel file
-        try:
-            workbook = openpyxl.load_workbook(filename=report_path, data_only=True)
-        except:
-            return False
-        # Iterate through sheets
-        for excel_sheet_name in workbook.sheetnames:
-            sheet = workbook[excel_sheet_name]
-            for i in range(1,sheet.max_row):
-                for j in range(1, sheet.max_column):
-                    cell_value = sheet.cell(row=i, column=j).value
-                    if type(cell_value) is str:
-                        if cell_value == "Run name":
-                            try:
-                                run_name = sheet.cell(row=i, column=j+1).value
-                            except:
-                                continue
-                            if  run_name is not None and run_name.startswith(desired_date):
-                                return True
-    
-    return False
-
-def sciebo_fastq_match(flowcell_id, sciebo_file):
-    report_path = sciebo_file
-
-    if sciebo_file.lower().endswith(".xls"):
-        # Open the Excel file
-        workbook = xlrd.open_workbook(report_path)
-        # Iterate through sheets
-        for sheet_name in workbook.sheet_names():
-            sheet = workbook.sheet_by_name(sheet_name)
-            # Iterate through rows and columns
-            for i in range(sheet.nrows):
-                for j in range(sheet.ncols):
-                    cell_value = sheet.cell_value(i, j)
-                    if type(cell_value) is str:
-                        result_list = re.split(', | ', cell_value)
-                        threshold = 1
-                        for word in result_list:
-                            distance = Levenshtein.distance(flowcell_id, word)
-                            if distance <= threshold:
-                                return True
-                       
-    elif sciebo_file.lower().endswith(".xlsx"):
-        # Open the Excel file
-        workbook = openpyxl.load_workbook(filename=report_path, data_only=True)
-        # Iterate through sheets
-        for excel_sheet_name in workbook.sheetnames:
-            sheet = workbook[excel_sheet_name]
-            for i in range(1,sheet.max_row):
-                for j in range(1, sheet.max_column):
-                    cell_value = sheet.cell(row=i, column=j).value
-                    if type(cell_value) is str:
-                        result_list = re.split(', | ', cell_value)
-                        threshold = 1
-                        for word in result_list:
-                            distance = Levenshtein.distance(flowcell_id, word)
-                            if distance <= threshold:
-                                return True              
-
-    return False
-
-def has_three_months_passed(date_str):
-    # Extract date part (assuming the format is YYMMDD at the beginning of the string)
-    date_part = date_str[:6]
-    # Convert the date part to a datetime object
-    date_format = '%y%m%d'
-    extracted_date = datetime.strptime(date_part, date_format)
-    # Calculate the date 3 months from the extracted date
-    three_months_later = extracted_date + timedelta(days=90)
-    # Get the current date
-    current_date = datetime.now()
-
-    # Check if the current date is greater than or equal to the date 3 months from the extracted date
-    return current_date >= three_months_later
\ No newline at end of file
+    Return the Sciebo workbook index, loading and refreshing it on the first call.
+
+    :param mapper: A map-like callable used to scan the new or changed workbooks, e.g. 'executor.map'.
+    :return: Dictionary with the indexed 'workbooks', the in-memory 'by_run_date' and 'by_flowcell' lookups,
+             the 'mtimes' of the workbooks and the 'latest_mtime' of all workbooks.
+    """
+    global _sciebo_index
+    if _sciebo_index is None:
+        workbooks = refresh_sciebo_index(load_sciebo_index(), mapper)
+        save_sciebo_index(workbooks)
+        _sciebo_index = {
+            'workbooks': workbooks,
+            'by_run_date': build_run_date_lookup(workbooks),
+            'by_flowcell': build_flowcell_lookup(workbooks),
+            'mtimes': {sciebo_file_path: entry['mtime'] for sciebo_file_path, entry in workbooks.items()},
+            'latest_mtime': max((entry['mtime'] for entry in workbooks.values()), default=0),
+        }
+    return _sciebo_index
+
+def reset_sciebo_index():
+    """ Forget the in-memory index, so the next 'get_sciebo_index' picks up new or changed workbooks """
+    global _sciebo_index
+    _sciebo_index = None
+
+def load_sciebo_index():
+    try:
+        with open(SCIEBO_INDEX_FILE_PATH, 'r') as index_file:
+            return json.load(index_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}  # Return an empty dict if the file doesn't exist or is invalid
+
+def save_sciebo_index(workbooks):
+    write_state_file(SCIEBO_INDEX_FILE_PATH, workbooks, indent=4, default=str)
+
+def find_sciebo_workbooks():
+    """ The paths of all .xls and .xlsx workbooks in the Sciebo folder, in directory walk order """
+    sciebo_file_paths = []
+    # Walk through the directory tree
+    for folder_path, _, files in os.walk(SCIEBO_FOLDER_PATH):
+        for file_name in files:
+            if file_name.lower().endswith((".xls", ".xlsx")):
+                sciebo_file_paths.append(os.path.join(folder_path, file_name))
+    return sciebo_file_paths
+
+def refresh_sciebo_index(workbooks, mapper=map):
+    """
+    Walk the Sciebo folder once and rescan only the workbooks that are new, whose mtime/size changed or
+    whose entry has an older version.
+
+    :param workbooks: The previously stored index, mapping workbook paths to their entries.
+    :param mapper: A map-like callable used to scan the new or changed workbooks.
+    :return: The refreshed index in directory walk order, without the workbooks that were removed.
+    """
+    refreshed = {}
+    changed_paths = []
+    sciebo_file_paths = find_sciebo_workbooks()
+
+    # The stats are issued concurrently on the I/O threads
+    for sciebo_file_path, stat in zip(sciebo_file_paths, io_map(os.stat, sciebo_file_paths)):
+        entry = workbooks.get(sciebo_file_path)
+        if entry is not None and entry.get('version') == SCIEBO_INDEX_ENTRY_VERSION and (entry['mtime'], entry['size']) == (stat.st_mtime, stat.st_size):
+            refreshed[sciebo_file_path] = entry
+        else:
+            refreshed[sciebo_file_path] = None
+            changed_paths.append(sciebo_file_path)
+
+    logger.info(f"Sciebo index: {len(refreshed) - len(changed_paths)} unchanged, {len(changed_paths)} (re)scanned workbooks")
+    # Read the next workbooks while the current ones are scanned
+    with Prefetcher(changed_paths, lambda sciebo_file_path: [sciebo_file_path]) as prefetcher:
+        for sciebo_file_path, entry in zip(changed_paths, profiled_map(mapper, scan_sciebo_workbook, changed_paths, WORKBOOK_STAGE)):
+            prefetcher.advance()
+            refreshed[sciebo_file_path] = entry
+    return refreshed
+
+def build_run_date_lookup(workbooks):
+    """
+    Map the YYMMDD prefix of every indexed run name to the workbooks that mention it.
+
+    :param workbooks: The Sciebo index, mapping workbook paths to their entries.
+    :return: Dictionary mapping run date prefixes to lists of workbook paths, in index order.
+    """
+    by_run_date = {}
+    for sciebo_file_path, entry in workbooks.items():
+        for run_date in dict.fromkeys(run_name[:6] for run_name in entry['run_names']):
+            by_run_date.setdefault(run_date, []).append(sciebo_file_path)
+    return by_run_date
+
+def build_flowcell_lookup(workbooks):
+    """
+    Build a deletion-neighbourhood index over the flowcell tokens of all workbooks.
+
+    Two words are within an edit distance of one only if they share a variant with at most one
+    character deleted, so a lookup only has to compare the flowcell ID with the few tokens that
+    share one of its deletion variants instead of every token of every workbook.
+
+    :param workbooks: The Sciebo index, mapping workbook paths to their entries.
+    :return: Dictionary with the workbooks of every token ('tokens') and the tokens of every deletion variant ('deletions').
+    """
+    token_workbooks = {}
+    for sciebo_file_path, entry in workbooks.items():
+        for token in entry['flowcell_tokens']:
+            token_workbooks.setdefault(token, []).append(sciebo_file_path)
+
+    deletions = {}
+    for token in token_workbooks:
+        for variant in deletion_variants(token):
+            deletions.setdefault(variant, []).append(token)
+    return {'tokens': token_workbooks, 'deletions': deletions}
+
+def deletion_variants(word):
+    """ The word itself and all the words with one of its characters deleted """
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+def find_flowcell_workbooks(flowcell_id):
+    """
+    Find all indexed workbooks that mention a flowcell ID, allowing an edit distance of one.
+
+    :param flowcell_id: The flowcell ID taken from the run folder name.
+    :return: Dictionary mapping the matching workbook paths to their smallest edit distance.
+    """
+    import Levenshtein
+
+    threshold = 1
+    flowcell_lookup = get_sciebo_index()['by_flowcell']
+    candidate_tokens = {token for variant in deletion_variants(flowcell_id) for token in flowcell_lookup['deletions'].get(variant, [])}
+
+    matches = {}
+    for token in candidate_tokens:
+        # Sharing a deletion variant allows up to two edits, confirm the actual distance
+        distance = Levenshtein.distance(flowcell_id, token)
+        if distance > threshold:
+            continue
+        for sciebo_file_path in flowcell_lookup['tokens'][token]:
+            matches[sciebo_file_path] = min(distance, matches.get(sciebo_file_path, distance))
+    return matches
+
+def scan_sciebo_workbook(report_path):
+    """
+    Open a Sciebo workbook once and extract everything needed for matching and parsing.
+
+    :param report_path: Path to the .xls or .xlsx workbook.
+    :return: Index entry with the file mtime/size, run names, flowcell tokens and report fields.
+    """
+    from utils.workbook_reader import read_workbook_label_cells
+
+    stat = os.stat(report_path)
+    entry = {'version': SCIEBO_INDEX_ENTRY_VERSION, 'mtime': stat.st_mtime, 'size': stat.st_size, 'run_names': [], 'flowcell_tokens': [], 'fields': None}
+    try:
+        label_cells = read_workbook_label_cells(report_path)
+    except Exception:
+        logger.warning(f"Could not open the sciebo workbook {report_path}")
+        return entry
+
+    entry['run_names'] = [next_value for label, next_value, _ in label_cells if label == "Run name" and isinstance(next_value, str)]
+    flowcell_tokens = {}
+    for label, _, _ in label_cells:
+        for word in re.split(', | ', label):
+            if len(word) >= FLOWCELL_TOKEN_MIN_LENGTH:
+                flowcell_tokens[word] = None
+    entry['flowcell_tokens'] = list(flowcell_tokens)
+
+    try:
+        if report_path.lower().endswith(".xls"):
+            entry['fields'] = extract_xls_report_fields(label_cells, report_path)
+        else:
+            entry['fields'] = extract_xlsx_report_fields(label_cells, report_path)
+    except Exception:
+        logger.warning(f"Could not extract the report fields from {report_path}")
+    return entry
@@ -0,0 +1,203 @@
+import os
+import json
+import logging
+from array import array
+
+from utils.prefetch import io_map
+from utils.run_id import parse_run_id
+from utils.run_folder import scan_run_folders
+from utils.state_files import replace_state_file
+from parsers.demux_formats import unknown_barcodes_artifact, read_unknown_barcode_counts
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#------------------------ Unknown Barcode Count Store ------------------------#
+###############################################################################
+
+# The store is a Parquet table with one row per (run, unknown barcode) and the columns 'Project Name',
+# 'Barcode' (both dictionary encoded, every run and barcode sequence is stored once) and 'Count', summed
+# over the lanes. The fingerprint of the unknown barcode report (Stats.json or Top_Unknown_Barcodes.csv) of
+# every run is kept in the file metadata, so only the runs whose report changed are read again.
+FINGERPRINTS_METADATA_KEY = b'stats_fingerprints'
+
+class BarcodeCountCollector:
+    """
+    The unknown barcode counts of the runs parsed in this build, interned into compact arrays
+    instead of one dictionary per run.
+    """
+    def __init__(self):
+        self.barcode_ids = {}
+        self.folders = []
+        self.run_index = array('i')
+        self.barcode_index = array('i')
+        self.counts = array('q')
+
+    def add(self, folder, unknown_barcode_counts):
+        run_id = len(self.folders)
+        self.folders.append(folder)
+        for barcode, count in unknown_barcode_counts.items():
+            self.run_index.append(run_id)
+            self.barcode_index.append(self.barcode_ids.setdefault(barcode, len(self.barcode_ids)))
+            self.counts.append(count)
+
+    def to_frame(self, folders):
+        """ The counts of the given folders as a store table """
+        import numpy as np
+        import pandas as pd
+
+        run_index = np.frombuffer(self.run_index, dtype=np.int32)
+        selected = np.isin(run_index, [run_id for run_id, folder in enumerate(self.folders) if folder in folders])
+        return pd.DataFrame({
+            'Project Name': pd.Categorical.from_codes(run_index[selected], categories=pd.Index(self.folders, dtype=str)),
+            'Barcode': pd.Categorical.from_codes(np.frombuffer(self.barcode_index, dtype=np.int32)[selected], categories=pd.Index(list(self.barcode_ids), dtype=str)),
+            'Count': np.frombuffer(self.counts, dtype=np.int64)[selected],
+        })
+
+_collected = BarcodeCountCollector()
+
+def reset_collected_barcodes():
+    """ Drop the counts collected so far, e.g. between two builds in watch mode """
+    global _collected
+    _collected = BarcodeCountCollector()
+
+def collect_unknown_barcodes(folder, record):
+    """
+    Move the unknown barcode counts of a parsed run record into the collector of this build.
+
+    :param folder: The run folder name.
+    :param record: The RunStats record, its 'unknown_barcode_counts' are released.
+    """
+    if record.unknown_barcode_counts is not None:
+        _collected.add(folder, record.unknown_barcode_counts)
+        record.unknown_barcode_counts = None
+
+def unknown_barcodes_fingerprint(artifacts):
+    artifact = unknown_barcodes_artifact(artifacts)
+    return None if artifact is None else [artifact.path, artifact.mtime, artifact.size]
+
+def load_barcode_store(store_path):
+    """
+    Load the unknown barcode count store.
+
+    :param store_path: Path of the Parquet store.
+    :return: Tuple of the store DataFrame and the dictionary mapping the folders to the fingerprints of
+             their unknown barcode reports, an empty table if there is no store yet.
+    """
+    import pandas as pd
+    import pyarrow.parquet as pq
+
+    try:
+        table = pq.read_table(store_path)
+    except FileNotFoundError:
+        strings = pd.CategoricalDtype(pd.Index([], dtype=str))
+        empty = pd.DataFrame({'Project Name': pd.Series([], dtype=strings), 'Barcode': pd.Series([], dtype=strings), 'Count': pd.Series([], dtype='int64')})
+        return empty, {}
+    fingerprints = json.loads((table.schema.metadata or {}).get(FINGERPRINTS_METADATA_KEY, b'{}'))
+    return table.to_pandas(), fingerprints
+
+def update_barcode_store(run_ids, store_path, deferred_folders=()):
+    """
+    Bring the unknown barcode count store up to date with the run folders.
+
+    The counts of the runs parsed in this build are taken from the collector, the runs whose unknown
+    barcode report changed without being parsed (or that are missing from the store) are read again. Deferred runs keep
+    their stored counts. The store is only rewritten if a run was added, changed or removed.
+
+    :param run_ids: List of the RunIds of the run folders.
+    :param store_path: Path of the Parquet store.
+    :param deferred_folders: Folders whose outputs are still being written.
+    """
+    import numpy as np
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pandas.api.types import union_categoricals
+
+    store, stored_fingerprints = load_barcode_store(store_path)
+    folders = [run_id.folder for run_id in run_ids if run_id.folder not in deferred_folders]
+    scans = scan_run_folders(folders)
+    fingerprints = {folder: unknown_barcodes_fingerprint(scans[folder]) for folder in folders}
+    fingerprints = {folder: fingerprint for folder, fingerprint in fingerprints.items() if fingerprint is not None}
+    fingerprints.update({folder: stored_fingerprints[folder] for folder in deferred_folders if folder in stored_fingerprints})
+
+    changed = {folder for folder, fingerprint in fingerprints.items() if stored_fingerprints.get(folder) != fingerprint}
+    removed = set(stored_fingerprints) - set(fingerprints)
+    if not changed and not removed and os.path.exists(store_path):
+        # Still the counts of the current runs, marked as written by this build (see 'run_manifest.outputs_up_to_date')
+        os.utime(store_path)
+        return
+
+    unread = sorted(changed - set(_collected.folders))
+    for folder, counts in zip(unread, io_map(lambda folder: read_unknown_barcode_counts(scans[folder]), unread)):
+        _collected.add(folder, counts)
+    kept = store[~store['Project Name'].isin(changed | removed)]
+    parsed = _collected.to_frame(changed)
+    # Merged on the dictionary codes, the sequences are not materialized as strings per row
+    store = pd.DataFrame({
+        column: union_categoricals([kept[column], parsed[column]], ignore_order=True).remove_unused_categories()
+        for column in ('Project Name', 'Barcode')
+    })
+    store['Count'] = np.concatenate([kept['Count'].to_numpy(), parsed['Count'].to_numpy()])
+
+    table = pa.Table.from_pandas(store, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, FINGERPRINTS_METADATA_KEY: json.dumps(fingerprints).encode()})
+    replace_state_file(store_path, lambda temporary_path: pq.write_table(table, temporary_path))
+    logger.info(f"Unknown barcode store: {len(changed)} runs updated, {len(removed)} removed, {len(store)} counts of {store['Project Name'].nunique()} runs")
+
+###############################################################################
+#------------------------------- Store Queries -------------------------------#
+###############################################################################
+
+def with_run_columns(store):
+    """
+    Add the 'Percentage' of every count (of the unknown barcode reads of its run) and the run columns
+    'Date', 'Month', 'Instrument' and 'Sequencer', parsed once per run folder.
+    """
+    import pandas as pd
+
+    store = store.copy()
+    store['Percentage'] = store['Count'] / store.groupby('Project Name', observed=True)['Count'].transform('sum') * 100
+    run_ids = {folder: parse_run_id(folder) for folder in store['Project Name'].cat.categories}
+    runs = pd.DataFrame({
+        'Date': pd.to_datetime([run_id.date for run_id in run_ids.values()]),
+        'Instrument': [run_id.instrument for run_id in run_ids.values()],
+        'Sequencer': [run_id.sequencer for run_id in run_ids.values()],
+    }, index=list(run_ids))
+    runs['Month'] = runs['Date'].dt.to_period('M').astype(str)
+    codes = store['Project Name'].cat.codes.to_numpy()
+    for column in runs.columns:
+        store[column] = runs[column].to_numpy()[codes]
+    return store
+
+def runs_with_barcode(store, barcode, min_percentage=0):
+    """
+    Find the runs where an unknown barcode exceeded a percentage of the unknown barcode reads.
+
+    :param store: The store DataFrame (see 'load_barcode_store').
+    :param barcode: The barcode sequence, e.g. 'GGGGGGGGGG+AGATCTCGGT'.
+    :param min_percentage: The percentage the barcode has to exceed.
+    :return: DataFrame with the run folders, their dates, instruments, counts and percentages, sorted by date.
+    """
+    store = with_run_columns(store)
+    hits = store[(store['Barcode'] == barcode) & (store['Percentage'] > min_percentage)]
+    columns = ['Project Name', 'Date', 'Instrument', 'Sequencer', 'Count', 'Percentage']
+    return hits[columns].astype({'Project Name': str}).sort_values('Date').reset_index(drop=True)
+
+def rollup_barcodes(store, by=('Instrument', 'Month'), top=10):
+    """
+    Sum the unknown barcode counts per group of runs, e.g. per instrument and month.
+
+    :param store: The store DataFrame (see 'load_barcode_store').
+    :param by: The run columns to group by ('Instrument', 'Sequencer', 'Month', 'Date').
+    :param top: Number of the most common barcodes kept per group.
+    :return: DataFrame with the group columns, 'Barcode', 'Count', 'Runs' (number of runs the barcode
+             appears in) and 'Percentage' (of the unknown barcode reads of the group).
+    """
+    by = list(by)
+    store = with_run_columns(store)
+    store['Barcode'] = store['Barcode'].astype(str)
+    rollup = store.groupby(by + ['Barcode']).agg(Count=('Count', 'sum'), Runs=('Project Name', 'nunique')).reset_index()
+    rollup['Percentage'] = rollup['Count'] / rollup.groupby(by)['Count'].transform('sum') * 100
+    rollup = rollup.sort_values(by + ['Count'], ascending=[True] * len(by) + [False])
+    return rollup.groupby(by).head(top).reset_index(drop=True)
@@ -0,0 +1,200 @@
+import re
+import json
+import logging
+
+from utils.state_files import write_state_file
+from config import (
+    SEQUENCING_KIT_TO_CLUSTERS,
+    APPLICATION_MAPPING,
+    NAME_ALIASES_FILE_PATH,
+    KIT_MATCH_SCORE_CUTOFF,
+    APPLICATION_MATCH_SCORE_CUTOFF,
+)
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#--------------------------- Name Normalization ------------------------------#
+###############################################################################
+
+# Tokens that tell kits apart (instrument, flowcell type, kit version, cycles, output): a raw kit name may
+# leave some out, but must not contain one its canonical kit doesn't have (e.g. 's3' or '600 cycles')
+KIT_KEY_TOKEN = re.compile(r'^(\w*seq|s\d|sp|v\d+(\.\d+)?|\d+|micro|nano|mid|high)$')
+
+def normalize_kit_text(text):
+    """ Lowercase a kit name and strip the punctuation and spelling variants, e.g. '(150-cycle)' -> '150 cycles' """
+    text = str(text).lower()
+    text = re.sub(r'[–—\-_/(),:;]', ' ', text)
+    text = re.sub(r'\bcycle\b', 'cycles', text)
+    return ' '.join(text.split())
+
+def normalize_application_text(text):
+    """ Lowercase an application name without separators, e.g. 'RNA-seq' -> 'rnaseq' """
+    return re.sub(r'[\s\-_.]', '', str(text).lower())
+
+class NameNormalizer:
+    """
+    Resolve free-text names to canonical IDs.
+
+    A name is resolved by an exact match of its normalized text, then by the persisted alias table and
+    finally by a fuzzy match (rapidfuzz) above a score cutoff. Fuzzy matches are added to the alias table,
+    so they stay stable and can be corrected by hand. All results are memoized, the names that could not
+    be resolved are counted for the report.
+    """
+    def __init__(self, kind, canonical_ids, normalize, scorer_name, score_cutoff, aliases, key_tokens=None):
+        """
+        :param kind: Name of the kind of names, e.g. 'kit', used as key in the alias table.
+        :param canonical_ids: Dictionary mapping the known names to their canonical IDs.
+        :param normalize: Function normalizing the text of a name.
+        :param scorer_name: Name of the rapidfuzz.fuzz scorer used for the fuzzy matches.
+        :param score_cutoff: Minimal fuzzy score (0-100) of a match.
+        :param aliases: The persisted aliases of this kind, mapping normalized names to canonical IDs.
+        :param key_tokens: Optional pattern of the tokens a fuzzy match must not contradict.
+        """
+        self.kind = kind
+        self.normalize = normalize
+        self.choices = {normalize(name): canonical_id for name, canonical_id in canonical_ids.items()}
+        self.canonical_ids = set(canonical_ids.values())
+        self.scorer_name = scorer_name
+        self.score_cutoff = score_cutoff
+        self.key_tokens = key_tokens
+        self.aliases = {}
+        for alias, canonical_id in aliases.items():
+            if canonical_id in self.canonical_ids:
+                self.aliases[alias] = canonical_id
+            else:
+                logger.warning(f"Ignoring the {kind} alias '{alias}': '{canonical_id}' is not a known {kind}")
+        self.aliases_changed = False
+        self.memo = {}
+        self.unresolved = {}
+
+    def resolve(self, name):
+        """
+        Resolve a name to its canonical ID.
+
+        :param name: The raw name, e.g. as typed into a protocol.
+        :return: The canonical ID, None if the name could not be resolved.
+        """
+        canonical_id = self.memoized_lookup(name)
+        if canonical_id is None and name is not None and name == name:
+            self.count_unresolved(name, 1)
+        return canonical_id
+
+    def memoized_lookup(self, name):
+        if name is None or name != name:
+            return None
+        if name not in self.memo:
+            self.memo[name] = self.lookup(self.normalize(name))
+        return self.memo[name]
+
+    def count_unresolved(self, name, count):
+        if str(name).strip():  # Empty cells are missing, not unresolved
+            self.unresolved[name] = self.unresolved.get(name, 0) + count
+
+    def lookup(self, text):
+        if not text:
+            return None
+        if text in self.choices:
+            return self.choices[text]
+        if text in self.aliases:
+            return self.aliases[text]
+        canonical_id = self.fuzzy_match(text)
+        if canonical_id is not None:
+            logger.info(f"Resolved the {self.kind} '{text}' to '{canonical_id}', added to the alias table")
+            self.aliases[text] = canonical_id
+            self.aliases_changed = True
+        return canonical_id
+
+    def fuzzy_match(self, text):
+        from rapidfuzz import fuzz, process
+
+        scorer = getattr(fuzz, self.scorer_name)
+        matches = process.extract(text, list(self.choices), scorer=scorer, score_cutoff=self.score_cutoff, limit=None)
+        candidates = [(score, choice) for choice, score, _ in matches if self.key_tokens is None or self.compatible(text, choice)]
+        if not candidates:
+            return None
+        # Equal scores (e.g. a name matching a subset of the tokens of several kits) go to the closest spelling
+        _, choice = max(candidates, key=lambda candidate: (candidate[0], fuzz.ratio(text, candidate[1])))
+        return self.choices[choice]
+
+    def compatible(self, text, choice):
+        """ Check that the name has no key token its candidate doesn't have """
+        text_tokens = {token for token in text.split() if self.key_tokens.match(token)}
+        return text_tokens <= set(choice.split())
+
+    def resolve_series(self, names):
+        """
+        Resolve a column of names, each distinct name is resolved once.
+
+        :param names: pandas Series of raw names.
+        :return: Series of the canonical IDs, None where a name could not be resolved.
+        """
+        resolved = {}
+        for name, count in names.value_counts().items():
+            resolved[name] = self.memoized_lookup(name)
+            if resolved[name] is None:
+                self.count_unresolved(name, count)
+        return names.map(resolved)
+
+###############################################################################
+#------------------------ Kit and Application Names --------------------------#
+###############################################################################
+
+# The normalizers are created and their alias tables loaded once per process
+_normalizers = None
+
+def get_normalizers():
+    global _normalizers
+    if _normalizers is None:
+        aliases = load_name_aliases()
+        _normalizers = {
+            'kit': NameNormalizer(
+                'kit', {kit: kit for kit in SEQUENCING_KIT_TO_CLUSTERS}, normalize_kit_text,
+                'token_set_ratio', KIT_MATCH_SCORE_CUTOFF, aliases.get('kit', {}), KIT_KEY_TOKEN),
+            'application': NameNormalizer(
+                'application', APPLICATION_MAPPING, normalize_application_text,
+                'ratio', APPLICATION_MATCH_SCORE_CUTOFF, aliases.get('application', {})),
+        }
+    return _normalizers
+
+def reset_unresolved_names():
+    """ Forget the unresolved names counted so far, e.g. between two builds in watch mode """
+    for normalizer in get_normalizers().values():
+        normalizer.unresolved.clear()
+
+def load_name_aliases():
+    try:
+        with open(NAME_ALIASES_FILE_PATH, 'r') as aliases_file:
+            return json.load(aliases_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}  # Return an empty dict if the file doesn't exist or is invalid
+
+def save_name_aliases():
+    """ Write the alias tables if fuzzy matches were added """
+    normalizers = get_normalizers()
+    if not any(normalizer.aliases_changed for normalizer in normalizers.values()):
+        return
+    aliases = {kind: dict(sorted(normalizer.aliases.items())) for kind, normalizer in normalizers.items()}
+    write_state_file(NAME_ALIASES_FILE_PATH, aliases, indent=4)
+    for normalizer in normalizers.values():
+        normalizer.aliases_changed = False
+
+def write_unresolved_names(csv_path):
+    """
+    Write the names that could not be resolved, with the number of runs they appear in.
+
+    :param csv_path: Path of the CSV report (columns 'Kind', 'Name', 'Runs').
+    """
+    import csv
+
+    rows = [
+        (kind, name, count)
+        for kind, normalizer in get_normalizers().items()
+        for name, count in sorted(normalizer.unresolved.items(), key=lambda item: -item[1])
+    ]
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(['Kind', 'Name', 'Runs'])
+        writer.writerows(rows)
+    if rows:
+        logger.warning(f"{len(rows)} kit or application names could not be resolved, see {csv_path}")
@@ -0,0 +1,132 @@
+import os
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from config import PREFETCH_THREADS, PREFETCH_LOOKAHEAD, PREFETCH_BYTE_BUDGET
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#------------------------------ I/O Prefetching ------------------------------#
+###############################################################################
+
+# The run folders and Sciebo workbooks live on network mounts, where every stat and read waits for a
+# round trip. Stats and reads are issued from a thread pool, so many of them are in flight at once.
+_settings = {'threads': PREFETCH_THREADS, 'lookahead': PREFETCH_LOOKAHEAD, 'byte_budget': PREFETCH_BYTE_BUDGET}
+# The I/O threads of 'io_map', shared by all calls and started on first use
+_io_executor = None
+
+def configure_prefetch(threads=None, byte_budget=None, lookahead=None):
+    """
+    Override the prefetch settings of config.py for this process.
+
+    :param threads: Number of I/O threads, 0 or 1 disables the concurrent I/O.
+    :param byte_budget: Maximum number of bytes read ahead for items that were not parsed yet.
+    :param lookahead: Number of items prefetched ahead of the one being parsed.
+    """
+    for name, value in (('threads', threads), ('byte_budget', byte_budget), ('lookahead', lookahead)):
+        if value is not None:
+            _settings[name] = value
+    if threads is not None:
+        # Started again with the new number of threads on the next 'io_map'
+        shutdown_io_executor()
+
+def shutdown_io_executor():
+    """ Stop the I/O threads of 'io_map', e.g. before worker processes are forked """
+    global _io_executor
+    if _io_executor is not None:
+        _io_executor.shutdown()
+        _io_executor = None
+
+def io_map(function, items):
+    """
+    Map an I/O bound function (stat, hash, ...) over items on the I/O threads.
+
+    :return: List of the results, in the order of the items.
+    """
+    global _io_executor
+    items = list(items)
+    if _settings['threads'] <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=_settings['threads'], thread_name_prefix='io')
+    return list(_io_executor.map(function, items))
+
+class Prefetcher:
+    """
+    Read the files of the next items on the I/O threads while the current item is parsed.
+
+    The files are read and discarded, the parsers (in this or a worker process) then find them in the
+    page cache. The consumer calls 'advance' once per parsed item, in the order of the items. A file is
+    only stat'ed, not read, when reading it would exceed the byte budget of the items prefetched but not
+    parsed yet.
+    """
+    READ_CHUNK_SIZE = 1 << 20
+
+    def __init__(self, items, paths_of):
+        """
+        :param items: The items in the order they are parsed.
+        :param paths_of: Callable returning the file paths of an item to prefetch.
+        """
+        self.items = list(items)
+        self.paths_of = paths_of
+        self.byte_budget = _settings['byte_budget']
+        self.executor = ThreadPoolExecutor(max_workers=_settings['threads']) if _settings['threads'] > 1 else None
+        self.lock = threading.Lock()
+        self.reserved_bytes = 0
+        self.prefetched = deque()
+        self.next_index = 0
+        for _ in range(_settings['lookahead']):
+            self.prefetch_next()
+
+    def prefetch_next(self):
+        if self.executor is None or self.next_index >= len(self.items):
+            return
+        item = self.items[self.next_index]
+        self.next_index += 1
+        reservation = {'bytes': 0, 'released': False}
+        self.prefetched.append(reservation)
+        for path in self.paths_of(item):
+            if path is not None:
+                self.executor.submit(self.warm, path, reservation)
+
+    def warm(self, path, reservation):
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return
+        with self.lock:
+            if reservation['released'] or self.reserved_bytes + size > self.byte_budget:
+                return
+            self.reserved_bytes += size
+            reservation['bytes'] += size
+        try:
+            buffer = bytearray(self.READ_CHUNK_SIZE)
+            with open(path, 'rb', buffering=0) as file:
+                while file.readinto(buffer):
+                    pass
+        except OSError:
+            logger.warning(f"Could not prefetch {path}")
+
+    def advance(self):
+        """ Mark the oldest prefetched item as parsed, releasing its bytes, and prefetch the next item """
+        if self.prefetched:
+            reservation = self.prefetched.popleft()
+            with self.lock:
+                self.reserved_bytes -= reservation['bytes']
+                reservation['released'] = True
+        self.prefetch_next()
+
+    def close(self):
+        # The pending reads are cancelled and the running ones awaited, so no prefetch thread outlives the
+        # prefetcher (e.g. while the worker processes of the next build are forked)
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
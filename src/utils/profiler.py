@@ -0,0 +1,187 @@
+import csv
+import json
+import time
+import logging
+import tracemalloc
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Stages recorded per run folder and per Sciebo workbook, used to name the slowest runs and workbooks
+RUN_STAGES = ('sample reads', 'unknown barcodes', 'interop', 'sciebo report')
+WORKBOOK_STAGE = 'sciebo workbook'
+
+###############################################################################
+#------------------------------ Stage Profiler -------------------------------#
+###############################################################################
+
+# Profiling is off unless 'enable_profiling' is called, the stages are then no-ops
+_enabled = False
+_samples = []
+_open_stages = []
+
+def enable_profiling():
+    """ Start recording the stages of this process, including the Python memory allocations """
+    global _enabled
+    _enabled = True
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def is_profiling():
+    return _enabled
+
+def reset_profile():
+    """ Drop the recorded samples, e.g. between two builds in watch mode """
+    _samples.clear()
+
+@contextmanager
+def profile_stage(stage, key=None):
+    """
+    Record the wall time, bytes read and peak memory of a stage.
+
+    Stages can be nested, the peak memory of an outer stage includes the peaks of its inner stages. The
+    bytes read are those of the whole process while the stage is open, so they are only exact when no
+    other thread reads meanwhile, which is why '--profile' turns off the I/O threads and the prefetching.
+
+    :param stage: The stage name, e.g. 'sample reads'.
+    :param key: What the stage worked on, e.g. the run folder or the workbook path.
+    """
+    if not _enabled:
+        yield
+        return
+
+    current, peak = tracemalloc.get_traced_memory()
+    if _open_stages:
+        _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak)
+    tracemalloc.reset_peak()
+    frame = {'start_memory': current, 'peak': 0}
+    _open_stages.append(frame)
+    bytes_read = read_process_bytes()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        end_bytes_read = read_process_bytes()
+        _open_stages.pop()
+        frame['peak'] = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+        if _open_stages:
+            _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], frame['peak'])
+        _samples.append({
+            'stage': stage,
+            'key': key,
+            'seconds': seconds,
+            'bytes_read': None if bytes_read is None else end_bytes_read - bytes_read,
+            'peak_memory': frame['peak'] - frame['start_memory'],
+        })
+
+def read_process_bytes():
+    """ Bytes read by this process so far (including page cache hits), None where /proc is not available """
+    try:
+        with open('/proc/self/io', 'r') as io_file:
+            for line in io_file:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+class ProfiledCall:
+    """
+    Picklable wrapper running a function inside a stage, so stages can be recorded in worker processes.
+
+    The call returns the result together with the samples it recorded, 'profiled_map' adds them to
+    the samples of the main process.
+    """
+    def __init__(self, function, stage, key=None):
+        self.function = function
+        self.stage = stage
+        self.key = key
+
+    def __call__(self, item):
+        if not _enabled:
+            enable_profiling()
+        first_sample = len(_samples)
+        with profile_stage(self.stage, item if self.key is None else self.key(item)):
+            result = self.function(item)
+        samples = _samples[first_sample:]
+        del _samples[first_sample:]
+        return result, samples
+
+def profiled_map(mapper, function, items, stage, key=None):
+    """
+    Map a function over items, recording a stage per item when profiling is enabled.
+
+    :param mapper: A map-like callable, e.g. 'map' or 'executor.map'.
+    :param function: The function to map, must be picklable for process pools.
+    :param items: The items to map over, used as the stage keys.
+    :param stage: The stage name.
+    :param key: Optional picklable function returning the stage key of an item, e.g. 'operator.itemgetter(0)'.
+    :return: An iterator over the results, in the order of the items.
+    """
+    if not _enabled:
+        return mapper(function, items)
+    return collect_samples(mapper(ProfiledCall(function, stage, key), items))
+
+def collect_samples(profiled_results):
+    for result, samples in profiled_results:
+        _samples.extend(samples)
+        yield result
+
+###############################################################################
+#------------------------------ Profile Report -------------------------------#
+###############################################################################
+
+def summarize_profile(top=10):
+    """
+    Summarize the recorded samples per stage and name the slowest runs and workbooks.
+
+    :param top: Number of slowest runs and workbooks to report.
+    :return: Dictionary with the per-stage totals, the slowest runs and the slowest workbooks.
+    """
+    stages = {}
+    runs = {}
+    for sample in _samples:
+        summary = stages.setdefault(sample['stage'], {'calls': 0, 'seconds': 0.0, 'bytes_read': 0, 'peak_memory': 0})
+        summary['calls'] += 1
+        summary['seconds'] += sample['seconds']
+        summary['bytes_read'] += sample['bytes_read'] or 0
+        summary['peak_memory'] = max(summary['peak_memory'], sample['peak_memory'])
+        if sample['stage'] in RUN_STAGES:
+            run = runs.setdefault(sample['key'], {'run': sample['key'], 'seconds': 0.0, 'bytes_read': 0})
+            run['seconds'] += sample['seconds']
+            run['bytes_read'] += sample['bytes_read'] or 0
+
+    workbooks = [
+        {'workbook': sample['key'], 'seconds': sample['seconds'], 'bytes_read': sample['bytes_read']}
+        for sample in _samples if sample['stage'] == WORKBOOK_STAGE
+    ]
+    return {
+        'stages': stages,
+        'slowest_runs': sorted(runs.values(), key=lambda run: run['seconds'], reverse=True)[:top],
+        'slowest_workbooks': sorted(workbooks, key=lambda workbook: workbook['seconds'], reverse=True)[:top],
+    }
+
+def write_profile_report(json_path, csv_path, top=10):
+    """
+    Write the profile summary as JSON and every recorded sample as CSV.
+
+    :param json_path: Path of the JSON summary.
+    :param csv_path: Path of the CSV with one row per recorded stage.
+    :param top: Number of slowest runs and workbooks to report.
+    """
+    summary = summarize_profile(top)
+    with open(json_path, 'w') as json_file:
+        json.dump(summary, json_file, indent=4)
+    with open(csv_path, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=['stage', 'key', 'seconds', 'bytes_read', 'peak_memory'])
+        writer.writeheader()
+        writer.writerows(_samples)
+
+    for stage, stage_summary in summary['stages'].items():
+        logger.info(f"Profile: {stage}: {stage_summary['seconds']:.2f}s over {stage_summary['calls']} calls, "
+                    f"{stage_summary['bytes_read']} bytes read, peak {stage_summary['peak_memory']} bytes")
+    for run in summary['slowest_runs'][:3]:
+        logger.info(f"Profile: slow run {run['run']}: {run['seconds']:.2f}s")
+    for workbook in summary['slowest_workbooks'][:3]:
+        logger.info(f"Profile: slow workbook {workbook['workbook']}: {workbook['seconds']:.2f}s")
@@ -0,0 +1,219 @@
+import json
+import logging
+
+from utils.state_files import write_state_file
+from config import (
+    QC_DRIFT_METRICS,
+    QC_DRIFT_WINDOW,
+    QC_DRIFT_MIN_RUNS,
+    QC_DRIFT_EWMA_ALPHA,
+    QC_DRIFT_Z_THRESHOLD,
+    QC_DRIFT_EWMA_THRESHOLD,
+)
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#---------------------------- QC Drift Detection -----------------------------#
+###############################################################################
+
+# Every run is scored against the baseline of the runs of its sequencer before it: the median and the
+# interquartile range of the last QC_DRIFT_WINDOW values of a metric give a robust z-score, which flags
+# single outliers (a bad kit or library), and the EWMA of these z-scores flags a sustained drift (a
+# degrading instrument) before single runs stand out.
+
+# The IQR of a normal distribution in standard deviations
+IQR_TO_SIGMA = 1.349
+PHIX_DEVIATION = 'Phix Output Deviation'
+SCORE_COLUMNS = ['Project Name', 'Date', 'Sequencer', 'Metric', 'Value', 'Baseline', 'Z Score', 'EWMA Z']
+ALERT_COLUMNS = SCORE_COLUMNS + ['Alert']
+
+def drift_parameters():
+    """ The settings the scores depend on, stored with the state so it is rebuilt when they change """
+    return {
+        'metrics': QC_DRIFT_METRICS, 'window': QC_DRIFT_WINDOW, 'min_runs': QC_DRIFT_MIN_RUNS,
+        'alpha': QC_DRIFT_EWMA_ALPHA, 'z_threshold': QC_DRIFT_Z_THRESHOLD, 'ewma_threshold': QC_DRIFT_EWMA_THRESHOLD,
+    }
+
+def drift_runs(df):
+    """
+    The metrics of the runs in the order they are scored, by date (and project name for runs of the same day).
+
+    :param df: The post-processed statistics DataFrame, indexed by the project names.
+    :return: DataFrame with the 'Date', 'Sequencer' and metric columns (PHIX_DEVIATION is the PhiX output
+             minus the PhiX input, in percentage points), runs without a date are left out.
+    """
+    import pandas as pd
+
+    runs = pd.DataFrame({'Date': pd.to_datetime(df['Date']), 'Sequencer': df['Sequencer'].astype(str)}, index=df.index)
+    numbers = lambda column: pd.to_numeric(df[column], errors='coerce').astype('float64')
+    for metric in QC_DRIFT_METRICS:
+        runs[metric] = numbers('Phix Output Percent') - numbers('Phix Input') if metric == PHIX_DEVIATION else numbers(metric)
+    runs.index.name = 'Project Name'
+    runs = runs[runs['Date'].notna()].reset_index().sort_values(['Date', 'Project Name'])
+    return runs.set_index('Project Name')
+
+def run_hashes(runs):
+    """ Hash of the date, sequencer and metrics of every run, to detect changed runs """
+    import pandas as pd
+
+    return {project: str(row_hash) for project, row_hash in pd.util.hash_pandas_object(runs, index=True).items()}
+
+def score_runs(runs):
+    """
+    Score all runs against the baselines of their sequencers, vectorized over the whole history.
+
+    :param runs: The runs in scoring order (see 'drift_runs').
+    :return: Tuple of the long-format scores (see SCORE_COLUMNS) and the state of the baselines after
+             the last run, to score further runs with 'score_new_runs'.
+    """
+    import pandas as pd
+
+    scores = []
+    baselines = {}
+    for metric in QC_DRIFT_METRICS:
+        values = runs[['Date', 'Sequencer', metric]].dropna()
+        sequencers = values['Sequencer']
+        # The baseline of a run only includes the runs before it
+        window = values.groupby('Sequencer')[metric].shift().groupby(sequencers).rolling(QC_DRIFT_WINDOW, min_periods=QC_DRIFT_MIN_RUNS)
+        baseline = window.median().droplevel(0)
+        scale = (window.quantile(0.75).droplevel(0) - window.quantile(0.25).droplevel(0)) / IQR_TO_SIGMA
+        z_scores = (values[metric] - baseline) / scale.where(scale > 0)
+        ewma = z_scores.groupby(sequencers).ewm(alpha=QC_DRIFT_EWMA_ALPHA, adjust=False, ignore_na=True).mean().droplevel(0)
+        scores.append(pd.DataFrame({
+            'Date': values['Date'], 'Sequencer': sequencers, 'Metric': metric, 'Value': values[metric],
+            'Baseline': baseline, 'Z Score': z_scores, 'EWMA Z': ewma,
+        }, index=values.index))
+
+        last_ewma = ewma.groupby(sequencers).last()
+        for sequencer, sequencer_values in values.groupby('Sequencer')[metric]:
+            baselines[f"{sequencer}|{metric}"] = {
+                'window': sequencer_values.tail(QC_DRIFT_WINDOW).tolist(),
+                'ewma': None if pd.isna(last_ewma.get(sequencer)) else float(last_ewma[sequencer]),
+            }
+    scores = pd.concat(scores).rename_axis('Project Name').reset_index()
+    return scores[SCORE_COLUMNS], baselines
+
+def score_new_runs(runs, baselines):
+    """
+    Score runs that come after all scored runs of their sequencers, updating the baselines.
+
+    Every run and metric is scored in constant time from the last QC_DRIFT_WINDOW values and the EWMA
+    of its sequencer, with the same results as 'score_runs' over the whole history.
+
+    :param runs: The new runs in scoring order (see 'drift_runs').
+    :param baselines: The state of the baselines, updated in place.
+    :return: The long-format scores of the new runs (see SCORE_COLUMNS).
+    """
+    import numpy as np
+    import pandas as pd
+
+    rows = []
+    for project, run in runs.iterrows():
+        for metric in QC_DRIFT_METRICS:
+            value = run[metric]
+            if pd.isna(value):
+                continue
+            baseline = baselines.setdefault(f"{run['Sequencer']}|{metric}", {'window': [], 'ewma': None})
+            median = z_score = np.nan
+            if len(baseline['window']) >= QC_DRIFT_MIN_RUNS:
+                median = float(np.median(baseline['window']))
+                lower, upper = np.quantile(baseline['window'], [0.25, 0.75])
+                scale = (upper - lower) / IQR_TO_SIGMA
+                z_score = (value - median) / scale if scale > 0 else np.nan
+            if not np.isnan(z_score):
+                previous = baseline['ewma']
+                baseline['ewma'] = z_score if previous is None else (1 - QC_DRIFT_EWMA_ALPHA) * previous + QC_DRIFT_EWMA_ALPHA * z_score
+            baseline['window'] = (baseline['window'] + [float(value)])[-QC_DRIFT_WINDOW:]
+            ewma = np.nan if baseline['ewma'] is None else baseline['ewma']
+            rows.append((project, run['Date'], run['Sequencer'], metric, value, median, z_score, ewma))
+    return pd.DataFrame(rows, columns=SCORE_COLUMNS)
+
+def flag_alerts(scores):
+    """
+    Select the scores of the runs that stand out ('outlier') or continue a drift ('drift') of their sequencer.
+
+    The scores are compared in the direction of QC_DRIFT_METRICS (high values, low values or both).
+
+    :param scores: The long-format scores (see SCORE_COLUMNS).
+    :return: The flagged scores with their 'Alert' (see ALERT_COLUMNS).
+    """
+    import numpy as np
+
+    directions = scores['Metric'].map(QC_DRIFT_METRICS).to_numpy()
+    severity = lambda column: np.where(directions == 0, scores[column].abs(), scores[column] * directions)
+    outlier = severity('Z Score') >= QC_DRIFT_Z_THRESHOLD
+    drift = severity('EWMA Z') >= QC_DRIFT_EWMA_THRESHOLD
+    alerts = scores[outlier | drift].copy()
+    alerts['Alert'] = np.where(outlier[outlier | drift], 'outlier', 'drift')
+    return alerts[ALERT_COLUMNS].reset_index(drop=True)
+
+###############################################################################
+#------------------------------ Incremental State ----------------------------#
+###############################################################################
+
+def load_drift_state(state_path):
+    try:
+        with open(state_path, 'r') as state_file:
+            return json.load(state_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def save_drift_state(state_path, state):
+    write_state_file(state_path, state)
+
+def detect_drift(df, state_path):
+    """
+    Score the runs for QC drift and outliers and collect the alerts of all runs.
+
+    The baselines, the hashes of the scored runs and the alerts are kept in a state file. When the
+    scored runs are unchanged and the new runs are the latest of their sequencers, only the new runs
+    are scored. Otherwise (e.g. a run was parsed again, removed or dated before the latest run of its
+    sequencer) the whole history is scored again.
+
+    :param df: The post-processed statistics DataFrame, indexed by the project names.
+    :param state_path: Path of the JSON state file.
+    :return: DataFrame of the alerts (see ALERT_COLUMNS), by date.
+    """
+    import pandas as pd
+
+    runs = drift_runs(df)
+    hashes = run_hashes(runs)
+    state = load_drift_state(state_path)
+
+    incremental = state is not None and state.get('parameters') == drift_parameters()
+    if incremental:
+        scored = state['hashes']
+        new_runs = runs[~runs.index.isin(list(scored))]
+        run_keys = list(zip(new_runs['Date'].dt.strftime('%Y-%m-%d'), new_runs.index))
+        incremental = (
+            all(hashes.get(project) == run_hash for project, run_hash in scored.items())
+            and all(tuple(state['latest'].get(sequencer, ('', ''))) < run_key for sequencer, run_key in zip(new_runs['Sequencer'], run_keys))
+        )
+
+    if incremental:
+        if new_runs.empty:
+            alerts = pd.DataFrame(state['alerts'], columns=ALERT_COLUMNS)
+            alerts['Date'] = pd.to_datetime(alerts['Date'])
+            return alerts
+        baselines = state['baselines']
+        new_alerts = flag_alerts(score_new_runs(new_runs, baselines))
+        alerts = pd.DataFrame(state['alerts'], columns=ALERT_COLUMNS)
+        alerts['Date'] = pd.to_datetime(alerts['Date'])
+        alerts = pd.concat([alerts, new_alerts], ignore_index=True) if not alerts.empty else new_alerts
+        logger.info(f"QC drift: scored {len(new_runs)} new runs, {len(new_alerts)} new alerts")
+    else:
+        scores, baselines = score_runs(runs)
+        alerts = flag_alerts(scores)
+        logger.info(f"QC drift: scored all {len(runs)} runs, {len(alerts)} alerts")
+
+    latest = runs.reset_index().groupby('Sequencer').last()
+    state = {
+        'parameters': drift_parameters(),
+        'hashes': hashes,
+        'latest': {sequencer: [row['Date'].strftime('%Y-%m-%d'), row['Project Name']] for sequencer, row in latest.iterrows()},
+        'baselines': baselines,
+        'alerts': alerts.assign(Date=alerts['Date'].dt.strftime('%Y-%m-%d')).astype(object).where(alerts.notna(), None).values.tolist(),
+    }
+    save_drift_state(state_path, state)
+    return alerts
@@ -0,0 +1,139 @@
+import os
+import json
+import logging
+
+from utils.state_files import state_file_lock, replace_state_file
+from config import QC_ROLLUP_METRICS, QC_ROLLUP_PERCENTILES
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#--------------------------------- QC Rollups --------------------------------#
+###############################################################################
+
+# The rollups are a long-format table with one row per (month, sequencer, application, metric) and the
+# number of runs, median and percentiles of the metric, for the dashboards to read instead of aggregating
+# the statistics on every filter change. Medians and percentiles can't be updated from the previous values,
+# so every group is fingerprinted by the values of its runs (kept in the Parquet file metadata) and only
+# the groups whose runs were added, changed or removed are aggregated again.
+GROUP_COLUMNS = ['Month', 'Sequencer', 'Application']
+FINGERPRINTS_METADATA_KEY = b'group_fingerprints'
+
+def percentile_column(percentile):
+    """ Column name of a percentile, e.g. 0.1 -> 'P10' """
+    return 'Median' if percentile == 0.5 else f"P{round(percentile * 100)}"
+
+ROLLUP_COLUMNS = GROUP_COLUMNS + ['Metric', 'Runs'] + [percentile_column(percentile) for percentile in QC_ROLLUP_PERCENTILES]
+
+def group_keys(table):
+    """ The group key of every row of a run or rollup table, e.g. '2024-02|novaseq|RNAseq' """
+    return table['Month'] + '|' + table['Sequencer'] + '|' + table['Application']
+
+def run_groups(df):
+    """
+    The rollup group and the metrics of every run.
+
+    :param df: The post-processed statistics DataFrame, indexed by the project names.
+    :return: DataFrame with the group columns (runs without an application go to 'unknown') and the metrics.
+    """
+    import pandas as pd
+
+    runs = pd.DataFrame({
+        'Month': pd.to_datetime(df['Date']).dt.to_period('M').astype(str),
+        'Sequencer': df['Sequencer'].astype(str),
+        'Application': df['Application'].astype(object).fillna('unknown').astype(str),
+    }, index=df.index)
+    for metric in QC_ROLLUP_METRICS:
+        runs[metric] = pd.to_numeric(df[metric], errors='coerce').astype('float64')
+    return runs
+
+def group_fingerprints(runs):
+    """
+    Fingerprint every group by the project names and metrics of its runs.
+
+    The row hashes of the runs are summed (modulo 2^64), so the fingerprint doesn't depend on the order
+    of the runs.
+
+    :param runs: The run groups (see 'run_groups').
+    :return: Dictionary mapping the group keys (see 'group_keys') to their fingerprints.
+    """
+    import pandas as pd
+
+    row_hashes = pd.util.hash_pandas_object(runs[QC_ROLLUP_METRICS].reset_index(), index=False)
+    sums = pd.Series(row_hashes.to_numpy(), index=group_keys(runs).to_numpy()).groupby(level=0).sum()
+    return {key: str(fingerprint) for key, fingerprint in sums.items()}
+
+def compute_rollups(runs):
+    """
+    Aggregate the metrics of the runs per group.
+
+    :param runs: The run groups (see 'run_groups'), e.g. only the runs of the changed groups.
+    :return: The rollup table (see ROLLUP_COLUMNS), the metrics without any value in a group are left out.
+    """
+    import pandas as pd
+
+    values = runs.melt(id_vars=GROUP_COLUMNS, value_vars=QC_ROLLUP_METRICS, var_name='Metric', value_name='Value').dropna(subset=['Value'])
+    if values.empty:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    grouped = values.groupby(GROUP_COLUMNS + ['Metric'])['Value']
+    rollups = grouped.quantile(QC_ROLLUP_PERCENTILES).unstack().round(4)
+    rollups.columns = [percentile_column(percentile) for percentile in rollups.columns]
+    rollups.insert(0, 'Runs', grouped.size())
+    return rollups.reset_index()[ROLLUP_COLUMNS]
+
+def load_rollups(parquet_path):
+    """
+    Load the stored rollups.
+
+    :param parquet_path: Path of the Parquet rollup table.
+    :return: Tuple of the rollup DataFrame and the dictionary of the group fingerprints, None if there
+             are no stored rollups yet.
+    """
+    import pyarrow.parquet as pq
+
+    try:
+        table = pq.read_table(parquet_path)
+    except FileNotFoundError:
+        return None, {}
+    fingerprints = json.loads((table.schema.metadata or {}).get(FINGERPRINTS_METADATA_KEY, b'{}'))
+    return table.to_pandas(), fingerprints
+
+def update_rollups(df, parquet_path, csv_path):
+    """
+    Bring the QC rollups up to date with the statistics, aggregating only the changed groups.
+
+    :param df: The post-processed statistics DataFrame, indexed by the project names.
+    :param parquet_path: Path of the Parquet rollup table, holding the group fingerprints.
+    :param csv_path: Path of the CSV copy of the rollups, for the Shiny app.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    runs = run_groups(df)
+    fingerprints = group_fingerprints(runs)
+    rollups, stored_fingerprints = load_rollups(parquet_path)
+    if rollups is None:
+        stored_fingerprints = {}
+    changed = {key for key, fingerprint in fingerprints.items() if stored_fingerprints.get(key) != fingerprint}
+    removed = set(stored_fingerprints) - set(fingerprints)
+    if not changed and not removed and os.path.exists(csv_path):
+        # Still the rollups of the current runs, marked as written by this build (see 'run_manifest.outputs_up_to_date')
+        os.utime(parquet_path)
+        os.utime(csv_path)
+        return
+
+    updated = compute_rollups(runs[group_keys(runs).isin(changed)])
+    if rollups is not None:
+        kept = rollups[~group_keys(rollups).isin(changed | removed)]
+        updated = pd.concat([kept, updated], ignore_index=True) if not kept.empty else updated
+    rollups = updated.sort_values(GROUP_COLUMNS + ['Metric']).reset_index(drop=True)
+    rollups = rollups.astype({column: 'str' for column in GROUP_COLUMNS + ['Metric']} | {'Runs': 'int64'})
+
+    table = pa.Table.from_pandas(rollups, preserve_index=False)
+    table = table.replace_schema_metadata({**table.schema.metadata, FINGERPRINTS_METADATA_KEY: json.dumps(fingerprints).encode()})
+    # Both files are published under the lock of the Parquet table, so concurrent builds don't mix them
+    with state_file_lock(parquet_path):
+        replace_state_file(parquet_path, lambda temporary_path: pq.write_table(table, temporary_path), locked=True)
+        replace_state_file(csv_path, lambda temporary_path: rollups.to_csv(temporary_path, index=False), locked=True)
+    logger.info(f"QC rollups: {len(changed)} groups updated, {len(removed)} removed, {len(fingerprints)} groups")
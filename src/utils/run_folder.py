@@ -0,0 +1,82 @@
+import os
+import logging
+from collections import namedtuple
+
+from utils.prefetch import io_map
+from config import FASTQ_FOLDER_PATH
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#--------------------------- Run Folder Artifacts ----------------------------#
+###############################################################################
+
+# The outputs of a run folder the parsers read, by name, relative to the run folder
+RUN_ARTIFACTS = {
+    # bcl2fastq (and the MultiQC report run on it)
+    'multiqc': "multiqc/multiqc_data/multiqc_bcl2fastq_bysample.txt",
+    'stats': "Stats/Stats.json",
+    # BCL Convert (e.g. NovaSeq X runs)
+    'demultiplex_stats': "Reports/Demultiplex_Stats.csv",
+    'top_unknown_barcodes': "Reports/Top_Unknown_Barcodes.csv",
+    # Sequencer metrics
+    'tile_metrics': "InterOp/TileMetricsOut.bin",
+    'q_metrics': "InterOp/QMetricsOut.bin",
+}
+# Only the folders on the way to an artifact are scanned, not the (possibly thousands of) FASTQ files
+ARTIFACT_FOLDERS = {os.path.dirname(path) for path in RUN_ARTIFACTS.values()}
+ARTIFACT_FOLDERS |= {folder.rsplit('/', 1)[0] for folder in ARTIFACT_FOLDERS if '/' in folder}
+ARTIFACT_NAMES = {path: name for name, path in RUN_ARTIFACTS.items()}
+
+Artifact = namedtuple('Artifact', ['path', 'size', 'mtime'])
+
+def scan_run_folder(fastq_folder_name):
+    """
+    Find the artifacts of a run folder with a single scan, instead of probing every path of every parser.
+
+    Every folder leading to an artifact is listed once with 'os.scandir' and only the artifacts found
+    are stat'ed, which saves most round-trips on the network mount.
+
+    :param fastq_folder_name: The name of the run folder.
+    :return: Dictionary mapping the names of the existing artifacts (see RUN_ARTIFACTS) to their
+             Artifact (absolute path, size and mtime).
+    """
+    artifacts = {}
+    pending = [""]
+    while pending:
+        relative_folder = pending.pop()
+        try:
+            entries = list(os.scandir(os.path.join(FASTQ_FOLDER_PATH, fastq_folder_name, relative_folder)))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        for entry in entries:
+            relative_path = f"{relative_folder}/{entry.name}" if relative_folder else entry.name
+            if relative_path in ARTIFACT_FOLDERS and entry.is_dir():
+                pending.append(relative_path)
+            elif relative_path in ARTIFACT_NAMES and entry.is_file():
+                stat = entry.stat()
+                artifacts[ARTIFACT_NAMES[relative_path]] = Artifact(entry.path, stat.st_size, stat.st_mtime)
+    return artifacts
+
+def artifact_path(artifacts, name):
+    """ The path of an artifact of a run folder scan, None if the run folder doesn't have it """
+    artifact = artifacts.get(name)
+    return None if artifact is None else artifact.path
+
+# The scans of the current build, so every run folder is scanned once per build
+_scans = {}
+
+def reset_run_folder_scans():
+    """ Forget the scans of the last build, e.g. between two builds in watch mode """
+    _scans.clear()
+
+def scan_run_folders(fastq_folder_names):
+    """
+    Scan the run folders on the I/O threads, reusing the scans of this build.
+
+    :param fastq_folder_names: The names of the run folders.
+    :return: Dictionary mapping the run folders to their artifacts (see 'scan_run_folder').
+    """
+    unscanned = [folder for folder in fastq_folder_names if folder not in _scans]
+    _scans.update(zip(unscanned, io_map(scan_run_folder, unscanned)))
+    return {folder: _scans[folder] for folder in fastq_folder_names}
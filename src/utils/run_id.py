@@ -0,0 +1,70 @@
+from datetime import datetime
+from functools import lru_cache
+
+from config import INSTRUMENT_SEQUENCERS
+
+###############################################################################
+#----------------------------- Run Folder Names ------------------------------#
+###############################################################################
+
+class RunId:
+    """
+    The parts of an Illumina run folder name, e.g. '240206_NB501289_0783_AH3WVJAFX7':
+    run date, instrument ID, run number and flowcell (with its A/B position prefix).
+    """
+    __slots__ = ('folder', 'date', 'instrument', 'run_number', 'flowcell', 'sequencer')
+
+    def __init__(self, folder, date, instrument, run_number, flowcell, sequencer):
+        self.folder = folder
+        self.date = date
+        self.instrument = instrument
+        self.run_number = run_number
+        self.flowcell = flowcell
+        self.sequencer = sequencer
+
+    @property
+    def date_prefix(self):
+        """ The run date as it starts the folder and run names (YYMMDD) """
+        return self.folder[:6]
+
+    @property
+    def flowcell_id(self):
+        """ The flowcell ID without the A/B position prefix, as written in the Sciebo protocols """
+        return self.flowcell[1:]
+
+    def __repr__(self):
+        return f"RunId({self.folder!r})"
+
+@lru_cache(maxsize=None)
+def parse_run_id(folder_name):
+    """
+    Parse a run folder name once, the result is cached for every later lookup.
+
+    :param folder_name: Name of the run folder.
+    :return: The RunId, None if the name doesn't have the 'YYMMDD_INSTRUMENT_RUNNUMBER_FLOWCELL' format.
+    """
+    parts = folder_name.split('_')
+    if len(parts) < 4 or not all(parts[:4]):
+        return None
+    try:
+        # Extracting the YYMMDD part from the folder name
+        date = datetime.strptime(parts[0], '%y%m%d').date()
+    except ValueError:
+        return None
+    return RunId(folder_name, date, parts[1], parts[2], parts[3], sequencer_of_instrument(parts[1]))
+
+def sequencer_of_instrument(instrument_id):
+    """ Look up the sequencer of an instrument ID in INSTRUMENT_SEQUENCERS, '' for unknown instruments """
+    for prefix, sequencer in INSTRUMENT_SEQUENCERS.items():
+        if instrument_id.startswith(prefix):
+            return sequencer
+    return ""
+
+def parse_run_ids(folder_names):
+    """
+    Parse the run folder names, skipping the folders that are not run folders.
+
+    :param folder_names: Iterable of folder names.
+    :return: List of the RunIds of the valid run folders, in the given order.
+    """
+    return [run_id for run_id in map(parse_run_id, folder_names) if run_id is not None]
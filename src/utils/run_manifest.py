@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+import logging
+
+from utils.run_stats import RunStats
+from utils.run_folder import RUN_ARTIFACTS, Artifact
+from utils.state_files import write_state_file
+from parsers.demux_formats import counts_fastq_reads
+from parsers.fastq_parser import FastqFiles, scan_fastq_files
+from config import RUN_MANIFEST_FILE_PATH
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the content of the run records changes, so stored records are parsed again
+RUN_RECORD_VERSION = 8
+
+###############################################################################
+#-------------------------- Run Folder Manifest ------------------------------#
+###############################################################################
+
+# The fields of a fingerprinted input (see 'fingerprint_run_inputs')
+INPUT_FIELDS = {'path', 'mtime', 'size', 'sha1'}
+
+def load_run_manifest():
+    """
+    Load the run manifest, an unreadable manifest or entry only means the runs are parsed again.
+
+    :return: Dictionary mapping the run folders to their manifest entries (see 'manifest_entry'),
+             without the malformed entries. Empty if the manifest doesn't exist or can't be read.
+    """
+    try:
+        with open(RUN_MANIFEST_FILE_PATH, 'r') as manifest_file:
+            manifest = json.load(manifest_file)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        logger.warning(f"Could not read the run manifest, parsing all runs again: {error}")
+        return {}
+    if not isinstance(manifest, dict):
+        logger.warning("The run manifest is malformed, parsing all runs again")
+        return {}
+    return {folder: entry for folder, entry in manifest.items() if is_valid_entry(entry)}
+
+def is_valid_entry(entry):
+    """ Check the structure of a manifest entry, e.g. of a hand-edited manifest """
+    if not isinstance(entry, dict) or not isinstance(entry.get('inputs'), dict) or not isinstance(entry.get('record'), dict):
+        return False
+    return all(
+        fingerprint is None or (isinstance(fingerprint, dict) and fingerprint.keys() >= INPUT_FIELDS)
+        for fingerprint in entry['inputs'].values()
+    )
+
+def save_run_manifest(manifest):
+    write_state_file(RUN_MANIFEST_FILE_PATH, manifest, indent=4, default=to_json_value)
+
+def to_json_value(value):
+    """ Convert the numpy scalars (and anything else json can't handle) of a run record """
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def run_inputs(fastq_folder_name, artifacts, sciebo_report_path):
+    """
+    Collect the input files a run record is parsed from, with their size and mtime.
+
+    :param fastq_folder_name: The name of the run folder.
+    :param artifacts: The scan of the run folder (see 'run_folder.scan_run_folder').
+    :param sciebo_report_path: The matched Sciebo workbook, None if there was no match.
+    :return: Dictionary mapping the input names (the artifacts of RUN_ARTIFACTS, 'fastq' and 'sciebo') to
+             their Artifact, None for missing files. The 'fastq' input (see 'fastq_parser.FastqFiles') is
+             only collected for runs without a per-sample report, whose reads are counted from their
+             FASTQ files.
+    """
+    inputs = {name: artifacts.get(name) for name in RUN_ARTIFACTS}
+    inputs['fastq'] = scan_fastq_files(fastq_folder_name) if counts_fastq_reads(artifacts) else None
+    inputs['sciebo'] = None
+    if sciebo_report_path is not None:
+        try:
+            stat = os.stat(sciebo_report_path)
+            inputs['sciebo'] = Artifact(sciebo_report_path, stat.st_size, stat.st_mtime)
+        except FileNotFoundError:
+            pass
+    return inputs
+
+def fingerprint_run_inputs(inputs, previous_inputs=None):
+    """
+    Fingerprint the input files of a run with their mtime, size and content hash.
+
+    The hash is only recomputed when the mtime or size differ from the previous fingerprint.
+
+    :param inputs: Dictionary mapping the input names to their Artifact (see 'run_inputs').
+    :param previous_inputs: The fingerprints stored in the manifest for this run, if any.
+    :return: Dictionary mapping the input names to their fingerprints, None for missing files.
+    """
+    previous_inputs = previous_inputs or {}
+    fingerprints = {}
+    for name, artifact in inputs.items():
+        if artifact is None:
+            fingerprints[name] = None
+            continue
+        previous = previous_inputs.get(name)
+        if isinstance(artifact, FastqFiles):
+            # The FASTQ files are too large to hash, their number, total size and latest mtime stand in for their content
+            sha1 = hashlib.sha1(json.dumps(artifact).encode()).hexdigest()
+        elif previous is not None and (previous['path'], previous['mtime'], previous['size']) == (artifact.path, artifact.mtime, artifact.size):
+            sha1 = previous['sha1']
+        else:
+            sha1 = hash_file(artifact.path)
+        fingerprints[name] = {'path': artifact.path, 'mtime': artifact.mtime, 'size': artifact.size, 'sha1': sha1}
+    return fingerprints
+
+def manifest_entry(inputs, record):
+    """ Store the fingerprinted inputs of a run with its RunStats record """
+    return {'version': RUN_RECORD_VERSION, 'inputs': inputs, 'record': record.to_dict()}
+
+def stored_record(entry):
+    """ Restore the RunStats record of a manifest entry """
+    return RunStats.from_dict(entry['record'])
+
+def can_reuse_record(entry, current_inputs):
+    """
+    Check if the stored record of a run can be reused instead of parsing the run again.
+
+    :param entry: The manifest entry of the run, None if the run is not in the manifest.
+    :param current_inputs: The current fingerprints of the run inputs.
+    :return: True if the record has the current version and the inputs did not change.
+    """
+    if not is_current_entry(entry):
+        return False
+    return inputs_unchanged(entry['inputs'], current_inputs)
+
+def is_current_entry(entry):
+    """ Check if a manifest entry exists and its record has the current version """
+    return entry is not None and entry.get('version') == RUN_RECORD_VERSION
+
+def inputs_unchanged(previous_inputs, current_inputs):
+    """
+    Check if a run has the same inputs, by path and content, as when it was last parsed.
+
+    :param previous_inputs: The fingerprints stored in the manifest.
+    :param current_inputs: The current fingerprints.
+    :return: True if the stored record can be reused, False otherwise.
+    """
+    if previous_inputs is None or previous_inputs.keys() != current_inputs.keys():
+        return False
+    for name, current in current_inputs.items():
+        previous = previous_inputs[name]
+        if previous is None or current is None:
+            if previous is not current:
+                return False
+        elif (previous['path'], previous['sha1']) != (current['path'], current['sha1']):
+            return False
+    return True
+
+def outputs_up_to_date(output_paths, input_paths=()):
+    """
+    Check if the outputs were written after the manifest was last saved.
+
+    The manifest is only saved when a run record or the set of runs changed, so outputs that are
+    newer than the manifest were built from the current records.
+
+    :param output_paths: Paths of the output files.
+    :param input_paths: Paths of further inputs of the outputs (e.g. the alias table), missing ones are ignored.
+    :return: True if all outputs exist and none is older than the manifest or the inputs.
+    """
+    try:
+        input_mtime = os.stat(RUN_MANIFEST_FILE_PATH).st_mtime
+    except FileNotFoundError:
+        return False
+    for path in input_paths:
+        if os.path.exists(path):
+            input_mtime = max(input_mtime, os.stat(path).st_mtime)
+    try:
+        return all(os.stat(path).st_mtime >= input_mtime for path in output_paths)
+    except FileNotFoundError:
+        return False
+
+def hash_file(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
@@ -0,0 +1,87 @@
+###############################################################################
+#-------------------------------- Run Record ---------------------------------#
+###############################################################################
+
+class RunStats:
+    """
+    The parsed statistics of a single run folder, filled by the parsers.
+
+    The attributes are declared in __slots__, so a record has no per-instance dictionary. Every
+    attribute except 'sample_reads', 'unknown_barcodes', 'unknown_barcode_counts' and 'lane_metrics' corresponds to a
+    column of the statistics DataFrame, which is built once from all records (see 'main.build_dataframe').
+    """
+    # Attribute -> statistics column
+    COLUMNS = {
+        # MultiQC
+        'std_in_millions': 'STD in Millions',
+        'cv': 'CV',
+        'undetermined_reads_percentage': 'Undetermined Reads Percentage',
+        'read_distribution': 'Read Distribution',
+        'total_read_count_in_millions': 'Total Read Count in Millions',
+        # Stats.json
+        'most_common_undetermined_barcode': 'Most Common Undetermined Barcode',
+        'undetermined_distribution_string': 'Undetermined Distribution String',
+        'most_common_undetermined_barcode_percentage': 'Most Common Undetermined Barcode Percentage',
+        'phix_output_count': 'Phix Output Count',
+        'phix_barcode': 'Phix Barcode',
+        # Sciebo report
+        'sciebo_found': 'Sciebo Found',
+        'sequencing_kit': 'Sequencing Kit',
+        'cycles_read_1': 'Cycles Read 1',
+        'cycles_index_1': 'Cycles Index 1',
+        'cycles_read_2': 'Cycles Read 2',
+        'cycles_index_2': 'Cycles Index 2',
+        'density': 'Density',
+        'clusters_pf': 'Clusters PF',
+        'yields': 'Yields',
+        'q_30': 'Q 30',
+        'name': 'Name',
+        'protocol_name': 'Protocol Name',
+        'application': 'Application',
+        'phix_input': 'Phix Input',
+    }
+    ATTRIBUTES = {column: attribute for attribute, column in COLUMNS.items()}
+    # Per-sample reads (sample name, total) in file order, the 'undetermined' sample included
+    SAMPLE_READS_KEY = 'Sample Reads'
+    # Most common unknown barcodes (barcode, count, percentage of the unknown reads), sorted by count
+    UNKNOWN_BARCODES_KEY = 'Unknown Barcodes'
+    # Metrics of every lane (lane, density, clusters PF, yield, Q30) read from the InterOp files, sorted by lane
+    LANE_METRICS_KEY = 'Lane Metrics'
+
+    # All unknown barcode counts of a freshly parsed run, moved into the barcode store (see
+    # 'barcode_store.collect_unknown_barcodes') and not kept in the run manifest
+    __slots__ = tuple(COLUMNS) + ('sample_reads', 'unknown_barcodes', 'unknown_barcode_counts', 'lane_metrics')
+
+    def __init__(self):
+        for attribute in self.COLUMNS:
+            setattr(self, attribute, None)
+        self.sample_reads = []
+        self.unknown_barcodes = []
+        self.unknown_barcode_counts = None
+        self.lane_metrics = []
+
+    def update_columns(self, values):
+        """ Set the attributes from a dictionary keyed by the statistics columns """
+        for column, value in values.items():
+            setattr(self, self.ATTRIBUTES[column], value)
+
+    def to_dict(self):
+        """ The record keyed by the statistics columns, without the unset values, as stored in the run manifest """
+        record = {column: getattr(self, attribute) for attribute, column in self.COLUMNS.items() if getattr(self, attribute) is not None}
+        if self.sample_reads:
+            record[self.SAMPLE_READS_KEY] = self.sample_reads
+        if self.unknown_barcodes:
+            record[self.UNKNOWN_BARCODES_KEY] = self.unknown_barcodes
+        if self.lane_metrics:
+            record[self.LANE_METRICS_KEY] = self.lane_metrics
+        return record
+
+    @classmethod
+    def from_dict(cls, record):
+        """ Restore a record stored with 'to_dict' """
+        run_stats = cls()
+        run_stats.update_columns({column: value for column, value in record.items() if column not in (cls.SAMPLE_READS_KEY, cls.UNKNOWN_BARCODES_KEY, cls.LANE_METRICS_KEY)})
+        run_stats.sample_reads = record.get(cls.SAMPLE_READS_KEY, [])
+        run_stats.unknown_barcodes = record.get(cls.UNKNOWN_BARCODES_KEY, [])
+        run_stats.lane_metrics = record.get(cls.LANE_METRICS_KEY, [])
+        return run_stats
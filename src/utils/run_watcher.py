@@ -0,0 +1,117 @@
+import os
+import time
+import logging
+
+from config import FASTQ_FOLDER_PATH
+from utils.run_id import parse_run_ids
+from utils.run_folder import RUN_ARTIFACTS, scan_run_folder
+from utils.prefetch import io_map
+from parsers.demux_formats import counts_fastq_reads
+from parsers.fastq_parser import scan_fastq_files
+from parsers.sciebo_parser import find_sciebo_workbooks
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#------------------------------ Run Watcher ----------------------------------#
+###############################################################################
+
+# The outputs a run is parsed from (demultiplexing reports and InterOp files), in snapshot order
+OUTPUT_NAMES = list(RUN_ARTIFACTS)
+
+def snapshot_run_folder(fastq_folder_name):
+    """
+    Stat the outputs (e.g. MultiQC TSV, Stats.json and the InterOp files, see 'run_folder.RUN_ARTIFACTS') of
+    a run folder, and its FASTQ files if it has no per-sample report, since its reads are then counted
+    from the FASTQ files.
+
+    :param fastq_folder_name: The name of the run folder.
+    :return: Tuple of (mtime, size) per output and (mtime, size, count) for the FASTQ files, None for
+             missing outputs.
+    """
+    # A fresh scan, the scans cached for a build (see 'run_folder.scan_run_folders') are outdated on the next poll
+    artifacts = scan_run_folder(fastq_folder_name)
+    fastq_files = scan_fastq_files(fastq_folder_name) if counts_fastq_reads(artifacts) else None
+    return tuple(
+        (artifacts[name].mtime, artifacts[name].size) if name in artifacts else None for name in OUTPUT_NAMES
+    ) + ((fastq_files.mtime, fastq_files.size, fastq_files.count) if fastq_files is not None else None,)
+
+def snapshot_run_outputs():
+    """
+    Snapshot the outputs of every run folder (see 'snapshot_run_folder'), concurrently on the I/O threads.
+
+    :return: Dictionary mapping the run folders to their output tuples.
+    """
+    folders = [run_id.folder for run_id in parse_run_ids(os.listdir(FASTQ_FOLDER_PATH))]
+    return dict(zip(folders, io_map(snapshot_run_folder, folders)))
+
+def stat_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None  # Removed since the folder was walked
+
+def snapshot_sciebo_workbooks():
+    """
+    Snapshot the Sciebo workbooks, so new or changed protocols are matched to the runs already ingested.
+
+    The set of workbooks is part of the snapshot, since the Sciebo sync client and copies keep the older
+    mtime of a workbook added late.
+
+    :return: Tuple of the latest mtime of the workbooks and the frozenset of their paths.
+    """
+    paths = find_sciebo_workbooks()
+    mtimes = [mtime for mtime in io_map(stat_mtime, paths) if mtime is not None]
+    return (max(mtimes, default=0), frozenset(paths))
+
+def outputs_settled(outputs, settle_seconds, now=None):
+    """
+    Check if the outputs of a run are complete, i.e. none of them was written to for a while.
+
+    Missing outputs don't block a run: it is parsed with what exists and parsed again once they appear.
+
+    :param outputs: The (mtime, size, ...) tuples of a run (see 'snapshot_run_folder').
+    :param settle_seconds: Time without modification after which the outputs are considered complete.
+    :param now: The current time, defaults to 'time.time()'.
+    :return: True if the run can be parsed, False if it is still being written.
+    """
+    now = time.time() if now is None else now
+    mtimes = [output[0] for output in outputs if output is not None]
+    return not mtimes or now - max(mtimes) >= settle_seconds
+
+def watch_runs(build, poll_interval=30, settle_seconds=60):
+    """
+    Poll the run and Sciebo folders and rebuild the statistics whenever the outputs of a run or the
+    Sciebo workbooks appear or change.
+
+    Polling is used instead of inotify since the run folders live on a network mount. Runs whose
+    outputs are still being written are passed as deferred, so 'build' keeps their previous rows
+    until they settle. Changed workbooks only trigger a build once they settled too. A failing build
+    is logged and retried on the next poll.
+
+    :param build: Callable taking the set of deferred run folders, e.g. an incremental 'build_statistics'.
+    :param poll_interval: Seconds between two polls.
+    :param settle_seconds: Seconds without modification after which a run's outputs are complete.
+    """
+    last_snapshot = None
+    last_deferred = set()
+    last_sciebo = None
+    while True:
+        snapshot = snapshot_run_outputs()
+        deferred = {folder for folder, outputs in snapshot.items() if not outputs_settled(outputs, settle_seconds)}
+        sciebo = snapshot_sciebo_workbooks()
+        if not outputs_settled([sciebo], settle_seconds):
+            # A workbook is still being written, it is picked up on a later poll
+            sciebo = last_sciebo
+        if snapshot != last_snapshot or deferred != last_deferred or sciebo != last_sciebo:
+            changed = [folder for folder, outputs in snapshot.items() if last_snapshot is None or last_snapshot.get(folder) != outputs]
+            logger.info(f"Watch: {len(changed)} new or changed runs, {len(deferred)} still being written"
+                        + (", Sciebo workbooks changed" if last_sciebo is not None and sciebo != last_sciebo else ""))
+            try:
+                build(deferred)
+            except Exception:
+                # Keep watching, the build is retried on the next poll
+                logger.exception("Watch: building the statistics failed")
+            else:
+                last_snapshot, last_deferred, last_sciebo = snapshot, deferred, sciebo
+        time.sleep(poll_interval)
@@ -0,0 +1,124 @@
+import re
+import pandas as pd
+
+###############################################################################
+#----------------------- Sequencing Statistics Schema ------------------------#
+###############################################################################
+
+# Output columns and their types, the units of the numeric columns are given in the comments
+STATISTICS_SCHEMA = {
+    "Protocol Name": "string",
+    "Date": "datetime64[ns]",
+    "Sciebo Found": "boolean",
+    "Application": "string",
+    "Sequencer": "string",
+    "STD in Millions": "float64",
+    "CV": "float64",                                            # %
+    "Undetermined Reads Percentage": "float64",                 # %
+    "Most Common Undetermined Barcode": "string",
+    "Most Common Undetermined Barcode Percentage": "float64",   # %
+    "Undetermined Distribution String": "string",
+    "Read Distribution": "string",
+    "Number of Samples Above Requirement": "Int64",
+    "Number of Samples Below Requirement": "Int64",
+    "Sequencing Kit": "string",
+    "Cycles Read 1": "float64",
+    "Cycles Index 1": "float64",
+    "Cycles Read 2": "float64",
+    "Cycles Index 2": "float64",
+    "Density": "float64",                                       # K/mm²
+    "Clusters PF": "float64",                                   # %
+    "Yields": "float64",                                        # Gb
+    "Q 30": "float64",                                          # %
+    "Phix Input": "float64",                                    # %
+    "Phix Output Percent": "float64",                           # %
+    "Phix Barcode": "string",
+    "Name": "string",
+    "Total Read Count in Millions": "float64",
+    "Expected Clusters": "float64",                             # clusters (lower bound of the kit specification)
+    "Ratio Total Read Count and Expected Cluster": "float64",
+}
+
+# Sciebo report fields that are typed by hand and may carry units, separators or fractions instead of percentages
+NUMERIC_REPORT_FIELDS = ["Cycles Read 1", "Cycles Index 1", "Cycles Read 2", "Cycles Index 2", "Density", "Yields", "Phix Input"]
+PERCENTAGE_REPORT_FIELDS = ["Clusters PF", "Q 30"]
+
+CLUSTER_COUNT_MULTIPLIERS = {'mio': 1e6, 'million': 1e6, 'billion': 1e9}
+# Decimals of the percentages, as measured from the InterOp and FASTQ files (a fraction times 100 isn't exact)
+PERCENTAGE_DECIMALS = 2
+
+# The first number of a value: a comma followed by exactly three digits (and no further digit) separates the
+# thousands, e.g. '1,100 K/mm²', any other comma is a decimal comma, e.g. '23,9'
+NUMBER_PATTERN = re.compile(r'(?P<integer>[1-9]\d{0,2}(?:,\d{3})+(?!\d)|\d+)(?P<decimal>[.,]\d+)?')
+
+def parse_number(value):
+    """
+    Parse the first number of a value typed into a protocol sheet, e.g. '112 K/mm²', '1,100 K/mm²' or '23,9'.
+
+    :param value: The raw cell value.
+    :return: The number as float, None if the value has no number.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return None if pd.isna(value) else float(value)
+    match = NUMBER_PATTERN.search(str(value))
+    if match is None:
+        return None
+    return float(match['integer'].replace(',', '') + (match['decimal'] or '').replace(',', '.'))
+
+def parse_percentage(value):
+    """ Parse a percentage, converting fractions (< 1) to percent, so "1" stays 1 % """
+    number = parse_number(value)
+    if number is not None and number < 1:
+        number *= 100
+    return number
+
+def parse_cluster_count(text):
+    """
+    Parse the expected clusters of a sequencing kit, e.g. '400 mio.' or '3.3–4.1 billion'.
+
+    :param text: The expected clusters as written in SEQUENCING_KIT_TO_CLUSTERS.
+    :return: The lower bound of the specification as number of clusters, None if it can't be parsed.
+    """
+    number = parse_number(text)
+    if number is None:
+        return None
+    for unit, multiplier in CLUSTER_COUNT_MULTIPLIERS.items():
+        if unit in str(text).lower():
+            return number * multiplier
+    return number
+
+def normalize_report_fields(fields):
+    """
+    Normalize the hand-typed Sciebo report fields into numbers.
+
+    :param fields: Dictionary mapping the report columns to their raw values.
+    :return: A new dictionary with the numeric fields parsed.
+    """
+    normalized = dict(fields)
+    for column in NUMERIC_REPORT_FIELDS:
+        normalized[column] = parse_number(fields.get(column))
+    for column in PERCENTAGE_REPORT_FIELDS:
+        # The .xlsx extractor passes the Q30 as text, the .xls extractor as number, both end up the same
+        percentage = parse_percentage(fields.get(column))
+        normalized[column] = None if percentage is None else round(percentage, PERCENTAGE_DECIMALS)
+    return normalized
+
+def apply_schema(df):
+    """
+    Cast the columns of the statistics DataFrame to the types of STATISTICS_SCHEMA.
+
+    :param df: The post-processed DataFrame.
+    :return: The DataFrame with typed columns.
+    """
+    for column, dtype in STATISTICS_SCHEMA.items():
+        if column not in df.columns:
+            continue
+        if dtype in ("float64", "Int64"):
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+        elif dtype.startswith("datetime"):
+            df[column] = pd.to_datetime(df[column]).astype(dtype)
+        else:
+            df[column] = df[column].astype(dtype)
+    return df
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import logging
+
+from utils.state_files import state_file_lock, write_state_file
+
+logger = logging.getLogger(__name__)
+
+# Resolved relative to this module, so the cache doesn't depend on the working directory
+CACHE_FILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sciebo_cache.json')
+
+###############################################################################
+#------------------------------ Sciebo Cache ---------------------------------#
+###############################################################################
+
+# The cache is read once per process, new matches are kept in memory until 'flush_cache'
+_cache = None
+_pending = {}
+
+def load_cache():
+    """
+    Return the in-memory cache, reading the cache file on the first call.
+
+    :return: Dictionary mapping run folders to their entries ({'path', 'timestamp', 'mtime'}).
+             An empty 'path' records that no Sciebo report was found among the 'candidates'.
+    """
+    global _cache
+    if _cache is None:
+        _cache = read_cache_file()
+    return _cache
+
+def read_cache_file():
+    try:
+        with open(CACHE_FILE_PATH, 'r') as cache_file:
+            cache = json.load(cache_file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}  # Return an empty dict if the file doesn't exist or is invalid
+    return {fastq_folder: upgrade_entry(entry) for fastq_folder, entry in cache.items()}
+
+def upgrade_entry(entry):
+    """ Older caches only stored the matched path (or '' for no match) """
+    if isinstance(entry, str):
+        return {'path': entry, 'timestamp': 0, 'mtime': None}
+    return entry
+
+def get_cached_match(fastq_folder, candidate_mtimes, workbook_mtimes=None):
+    """
+    Look up the cached Sciebo match of a run folder, ignoring stale entries.
+
+    A match is stale when the matched workbook was removed or modified after it was cached, a miss is
+    stale when the candidate workbooks of the run (those with its run date) were added, removed or
+    modified since. The mtimes of other workbooks don't matter, so a workbook copied in with an older
+    mtime still invalidates the misses of its runs.
+
+    :param fastq_folder: The run folder name.
+    :param candidate_mtimes: Dictionary mapping the candidate workbooks of the run to their mtimes.
+    :param workbook_mtimes: Dictionary mapping the existing workbooks to their mtimes, e.g. from the Sciebo
+                            index. Without it the matched workbook is stat'ed.
+    :return: The cache entry, or None if there is no valid entry.
+    """
+    entry = load_cache().get(fastq_folder)
+    if entry is None:
+        return None
+
+    if entry['path'] == '':
+        # Misses of older caches don't record their candidates
+        return entry if entry.get('candidates') == candidate_mtimes else None
+
+    if workbook_mtimes is not None:
+        mtime = workbook_mtimes.get(entry['path'])
+    else:
+        mtime = os.stat(entry['path']).st_mtime if os.path.exists(entry['path']) else None
+    if mtime is None:
+        return None
+    if entry['mtime'] is None:
+        # Entry of an older cache, adopt the current mtime of the workbook
+        set_cached_match(fastq_folder, entry['path'], mtime)
+        return load_cache()[fastq_folder]
+    return entry if entry['mtime'] == mtime else None
+
+def set_cached_match(fastq_folder, sciebo_file_path, mtime=None, candidate_mtimes=None):
+    """
+    Record the Sciebo match (or '' for no match) of a run folder, to be written by 'flush_cache'.
+
+    :param fastq_folder: The run folder name.
+    :param sciebo_file_path: The matched workbook, or '' if no match was found.
+    :param mtime: The mtime of the matched workbook, stat'ed if not given.
+    :param candidate_mtimes: For a miss, the candidate workbooks that didn't match with their mtimes
+                             (see 'get_cached_match').
+    """
+    if sciebo_file_path and mtime is None:
+        mtime = os.stat(sciebo_file_path).st_mtime
+    entry = {'path': sciebo_file_path, 'timestamp': time.time(), 'mtime': mtime}
+    if not sciebo_file_path:
+        entry['candidates'] = candidate_mtimes or {}
+    load_cache()[fastq_folder] = entry
+    _pending[fastq_folder] = entry
+
+def flush_cache():
+    """
+    Write the pending cache entries in a single atomic update.
+
+    The cache file is locked, re-read to keep the entries written by concurrent runs, updated and
+    replaced through a rename, so readers never see a partially written file.
+    """
+    if not _pending:
+        return
+    with state_file_lock(CACHE_FILE_PATH):
+        cache = read_cache_file()
+        cache.update(_pending)
+        write_state_file(CACHE_FILE_PATH, cache, locked=True, indent=4)
+    logger.info(f"Wrote {len(_pending)} sciebo cache entries")
+    _pending.clear()
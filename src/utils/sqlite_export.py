@@ -0,0 +1,197 @@
+import re
+import sqlite3
+import logging
+import pandas as pd
+
+from utils.schema import STATISTICS_SCHEMA
+
+logger = logging.getLogger(__name__)
+
+###############################################################################
+#------------------------------- SQLite Export -------------------------------#
+###############################################################################
+
+# Bump whenever the tables change (e.g. a column is added to STATISTICS_SCHEMA), the tables are then recreated
+SQLITE_SCHEMA_VERSION = 3
+
+SQL_TYPES = {'string': 'TEXT', 'datetime64[ns]': 'TEXT', 'boolean': 'INTEGER', 'Int64': 'INTEGER', 'float64': 'REAL'}
+
+def sql_column_name(column):
+    """ Column name usable without quoting, e.g. 'Clusters PF' -> 'clusters_pf' """
+    return re.sub(r'\W+', '_', column.strip().lower()).strip('_')
+
+RUN_COLUMNS = {column: sql_column_name(column) for column in STATISTICS_SCHEMA}
+
+def create_tables(connection):
+    """
+    Create the tables of the statistics database, dropping them first if they have an older layout.
+
+    - runs: one row per run, the columns of STATISTICS_SCHEMA, dates as 'YYYY-MM-DD'
+    - run_samples: the reads of every sample of a run, in the order of the MultiQC report
+    - barcodes: every unknown barcode sequence once
+    - run_unknown_barcodes: the most common unknown barcodes of every run
+    - run_lanes: the InterOp metrics of every lane of a run
+    - qc_alerts: the runs flagged by the QC drift detection, one row per run and metric
+    """
+    if connection.execute("PRAGMA user_version").fetchone()[0] != SQLITE_SCHEMA_VERSION:
+        for table in ('qc_alerts', 'run_lanes', 'run_unknown_barcodes', 'barcodes', 'run_samples', 'runs'):
+            connection.execute(f"DROP TABLE IF EXISTS {table}")
+    run_columns = ',\n'.join(f"    {RUN_COLUMNS[column]} {SQL_TYPES[dtype]}" for column, dtype in STATISTICS_SCHEMA.items())
+    statements = f"""
+CREATE TABLE IF NOT EXISTS runs (
+    project_name TEXT PRIMARY KEY,
+{run_columns}
+);
+CREATE INDEX IF NOT EXISTS runs_date ON runs (date);
+CREATE INDEX IF NOT EXISTS runs_sequencer_date ON runs (sequencer, date);
+CREATE INDEX IF NOT EXISTS runs_application_date ON runs (application, date);
+
+CREATE TABLE IF NOT EXISTS run_samples (
+    project_name TEXT NOT NULL REFERENCES runs (project_name) ON DELETE CASCADE,
+    sample_index INTEGER NOT NULL,
+    sample TEXT NOT NULL,
+    total_reads INTEGER NOT NULL,
+    fraction REAL,
+    undetermined INTEGER NOT NULL,
+    PRIMARY KEY (project_name, sample_index)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS barcodes (
+    barcode_id INTEGER PRIMARY KEY,
+    sequence TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS run_unknown_barcodes (
+    project_name TEXT NOT NULL REFERENCES runs (project_name) ON DELETE CASCADE,
+    rank INTEGER NOT NULL,
+    barcode_id INTEGER NOT NULL REFERENCES barcodes (barcode_id),
+    count INTEGER NOT NULL,
+    percentage REAL NOT NULL,
+    PRIMARY KEY (project_name, rank)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS run_unknown_barcodes_barcode ON run_unknown_barcodes (barcode_id);
+
+CREATE TABLE IF NOT EXISTS run_lanes (
+    project_name TEXT NOT NULL REFERENCES runs (project_name) ON DELETE CASCADE,
+    lane INTEGER NOT NULL,
+    density REAL,
+    clusters_pf REAL,
+    yields REAL,
+    q_30 REAL,
+    PRIMARY KEY (project_name, lane)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS qc_alerts (
+    project_name TEXT NOT NULL REFERENCES runs (project_name) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    date TEXT NOT NULL,
+    sequencer TEXT NOT NULL,
+    value REAL NOT NULL,
+    baseline REAL,
+    z_score REAL,
+    ewma_z REAL,
+    alert TEXT NOT NULL,
+    PRIMARY KEY (project_name, metric)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS qc_alerts_sequencer_date ON qc_alerts (sequencer, date);
+"""
+    # One by one, 'executescript' would commit the transaction of the export
+    for statement in statements.split(';'):
+        if statement.strip():
+            connection.execute(statement)
+    connection.execute(f"PRAGMA user_version = {SQLITE_SCHEMA_VERSION}")
+
+SAMPLE_COLUMNS = ['project_name', 'sample_index', 'sample', 'total_reads', 'fraction', 'undetermined']
+UNKNOWN_BARCODE_COLUMNS = ['project_name', 'rank', 'barcode_id', 'count', 'percentage']
+LANE_COLUMNS = ['project_name', 'lane', 'density', 'clusters_pf', 'yields', 'q_30']
+ALERT_COLUMNS = ['project_name', 'metric', 'date', 'sequencer', 'value', 'baseline', 'z_score', 'ewma_z', 'alert']
+
+def upsert_statement(table, columns, key_length):
+    """ INSERT statement of a row that updates the existing row with the same key (the first 'key_length' columns) """
+    updates = ', '.join(f"{column} = excluded.{column}" for column in columns[key_length:])
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT ({', '.join(columns[:key_length])}) DO UPDATE SET {updates}")
+
+def to_sql_value(value):
+    """ Convert the missing values and numpy scalars of a DataFrame row for sqlite3 """
+    if value is None or value is pd.NA or (isinstance(value, float) and value != value):
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def sql_rows(df, columns):
+    return [tuple(map(to_sql_value, row)) for row in df[columns].astype(object).itertuples(index=False, name=None)]
+
+def export_statistics_sqlite(df, samples, barcodes, lanes, alerts, sqlite_path):
+    """
+    Upsert the statistics of all runs into the SQLite database, creating it if needed.
+
+    Runs are inserted or updated by their project name, their samples by their position in the run and
+    their barcodes by their rank and their lanes by their number. Runs that are no longer in the statistics
+    are deleted with their samples, barcodes and lanes, as are the samples and barcodes beyond the current
+    ones of a run and the lanes a run no longer has. Everything is written
+    in one transaction, in WAL mode, so readers (e.g. the Shiny app) can keep querying the previous state
+    while the database is updated.
+
+    :param df: The post-processed statistics DataFrame, indexed by the project names.
+    :param samples: The long-format per-sample table (see 'utilities.build_sample_table').
+    :param barcodes: The long-format unknown barcode table (see 'utilities.build_barcode_table').
+    :param lanes: The long-format InterOp lane table (see 'utilities.build_lane_table').
+    :param alerts: The QC alerts of the runs (see 'qc_drift.detect_drift').
+    :param sqlite_path: Path of the SQLite database.
+    """
+    runs = df.reset_index()[['Project Name'] + list(STATISTICS_SCHEMA)]
+    runs['Date'] = runs['Date'].dt.strftime('%Y-%m-%d')
+    run_rows = sql_rows(runs, list(runs.columns))
+    project_names = set(runs['Project Name'])
+
+    samples = samples[samples['Project Name'].isin(project_names)].assign(
+        **{'Sample Index': lambda table: table.groupby('Project Name').cumcount()})
+    sample_rows = sql_rows(samples, ['Project Name', 'Sample Index', 'Sample', 'Total Reads', 'Fraction', 'Undetermined'])
+    barcodes = barcodes[barcodes['Project Name'].isin(project_names)]
+    # Number of samples and barcodes of every run, the rows beyond are deleted
+    sample_counts = [(name, count) for name, count in samples.groupby('Project Name').size().reindex(list(project_names), fill_value=0).items()]
+    barcode_counts = [(name, count) for name, count in barcodes.groupby('Project Name').size().reindex(list(project_names), fill_value=0).items()]
+    lanes = lanes[lanes['Project Name'].isin(project_names)]
+    lane_rows = sql_rows(lanes, ['Project Name', 'Lane', 'Density', 'Clusters PF', 'Yields', 'Q 30'])
+    alerts = alerts[alerts['Project Name'].isin(project_names)].assign(Date=lambda table: table['Date'].dt.strftime('%Y-%m-%d'))
+    alert_rows = sql_rows(alerts, ['Project Name', 'Metric', 'Date', 'Sequencer', 'Value', 'Baseline', 'Z Score', 'EWMA Z', 'Alert'])
+
+    # Transactions are started explicitly, so the table creation is part of the export transaction
+    connection = sqlite3.connect(sqlite_path, isolation_level=None)
+    try:
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA foreign_keys = ON")
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            create_tables(connection)
+            stale_runs = [(name,) for (name,) in connection.execute("SELECT project_name FROM runs") if name not in project_names]
+            connection.executemany("DELETE FROM runs WHERE project_name = ?", stale_runs)
+            connection.executemany(upsert_statement('runs', ['project_name'] + [RUN_COLUMNS[column] for column in STATISTICS_SCHEMA], 1), run_rows)
+
+            connection.executemany(upsert_statement('run_samples', SAMPLE_COLUMNS, 2), sample_rows)
+            connection.executemany("DELETE FROM run_samples WHERE project_name = ? AND sample_index >= ?", sample_counts)
+
+            connection.executemany("INSERT OR IGNORE INTO barcodes (sequence) VALUES (?)",
+                                   [(sequence,) for sequence in barcodes['Barcode'].unique()])
+            barcode_ids = pd.Series(dict((sequence, barcode_id) for barcode_id, sequence in connection.execute("SELECT barcode_id, sequence FROM barcodes")), dtype='Int64')
+            barcode_rows = sql_rows(barcodes.assign(**{'Barcode ID': barcodes['Barcode'].map(barcode_ids)}),
+                                    ['Project Name', 'Rank', 'Barcode ID', 'Count', 'Percentage'])
+            connection.executemany(upsert_statement('run_unknown_barcodes', UNKNOWN_BARCODE_COLUMNS, 2), barcode_rows)
+            connection.executemany("DELETE FROM run_unknown_barcodes WHERE project_name = ? AND rank > ?", barcode_counts)
+            connection.execute("DELETE FROM barcodes WHERE barcode_id NOT IN (SELECT barcode_id FROM run_unknown_barcodes)")
+
+            # Lanes are numbered but not necessarily contiguous (e.g. single-lane reads of a NovaSeq run)
+            connection.execute("CREATE TEMPORARY TABLE current_lanes (project_name TEXT, lane INTEGER, PRIMARY KEY (project_name, lane))")
+            connection.executemany("INSERT INTO current_lanes VALUES (?, ?)", [row[:2] for row in lane_rows])
+            connection.executemany(upsert_statement('run_lanes', LANE_COLUMNS, 2), lane_rows)
+            connection.execute("DELETE FROM run_lanes WHERE (project_name, lane) NOT IN (SELECT project_name, lane FROM current_lanes)")
+            connection.execute("DROP TABLE current_lanes")
+
+            # The alerts are few, they are replaced as a whole
+            connection.execute("DELETE FROM qc_alerts")
+            connection.executemany(f"INSERT INTO qc_alerts ({', '.join(ALERT_COLUMNS)}) VALUES ({', '.join('?' * len(ALERT_COLUMNS))})", alert_rows)
+    finally:
+        connection.close()
+    logger.info(f"Upserted {len(run_rows)} runs ({len(stale_runs)} removed), {len(sample_rows)} samples, {len(barcode_rows)} unknown barcodes, {len(lane_rows)} lanes and {len(alert_rows)} QC alerts into {sqlite_path}")
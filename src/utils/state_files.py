@@ -0,0 +1,73 @@
+import os
+import json
+import fcntl
+import tempfile
+from contextlib import contextmanager
+
+###############################################################################
+#-------------------------------- State Files --------------------------------#
+###############################################################################
+
+# The state files (Sciebo cache and index, run manifest, QC drift baselines, Parquet stores, ...) are
+# read by concurrent builds, e.g. a cron job and the watch mode, and a build may be killed at any time.
+# They are written under an exclusive lock into a temporary file that replaces the state file, so a
+# reader sees either the old or the new content, never a partially written file.
+
+@contextmanager
+def state_file_lock(state_path):
+    """
+    Hold the exclusive lock of a state file (the file '<state_path>.lock' next to it).
+
+    :param state_path: Path of the state file.
+    """
+    with open(state_path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def write_state_file(state_path, state, locked=False, **json_options):
+    """
+    Write a JSON state file atomically.
+
+    :param state_path: Path of the state file, in an existing folder.
+    :param state: The JSON serializable state.
+    :param locked: True if the caller already holds the lock (see 'state_file_lock'), e.g. to merge the
+                   state with the current file content first.
+    :param json_options: Further arguments of 'json.dump', e.g. 'indent'.
+    """
+    def write_json(temporary_path):
+        with open(temporary_path, 'w') as state_file:
+            json.dump(state, state_file, **json_options)
+
+    replace_state_file(state_path, write_json, locked)
+
+def replace_state_file(state_path, write, locked=False):
+    """
+    Replace a state file atomically with the content of a writer, e.g. a Parquet table or a CSV file.
+
+    :param state_path: Path of the state file.
+    :param write: Callable writing the new content to the temporary path it is given.
+    :param locked: True if the caller already holds the lock (see 'state_file_lock').
+    """
+    if not locked:
+        with state_file_lock(state_path):
+            replace_state_file(state_path, write, locked=True)
+        return
+
+    state_folder = os.path.dirname(state_path)
+    file_descriptor, temporary_path = tempfile.mkstemp(dir=state_folder or '.', prefix=f".{os.path.basename(state_path)}.", suffix='.tmp')
+    os.close(file_descriptor)
+    try:
+        write(temporary_path)
+        file_descriptor = os.open(temporary_path, os.O_RDONLY)
+        try:
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, state_path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
@@ -1,92 +1,96 @@
-import json
-import re
 import pandas as pd
-from datetime import datetime
 
 from config import  SEQUENCING_KIT_TO_MAX_CLUSTERS
 
-CACHE_FILE_PATH = 'src/utils/sciebo_cache.json'  # Define the path to your cache file
-
 ###############################################################################
 #------------------------------ Utility Functions ----------------------------#
 ###############################################################################
 
-def is_valid_folder(folder_name):
+def build_sample_table(records):
     """
-    Check if the folder name matches the expected format for sequencing projects.
+    Collect the per-sample reads of all run records into a long-format table.
 
-    :param folder_name: Name of the folder to check.
-    :return: True if the folder name is valid, False otherwise.
+    :param records: Dictionary mapping folder names to their RunStats records.
+    :return: DataFrame with one row per (run, sample) and the typed columns 'Project Name', 'Sample',
+             'Total Reads', 'Fraction' (of the run's reads) and 'Undetermined'.
     """
-    return re.match(r'^\d{6}', folder_name) is not None
-    
-def extract_date_from_folder(folder_name):
-    try:
-        # Extracting the YYMMDD part from the folder name
-        date_str = folder_name[:6]
-        # Converting the date string to a datetime object
-        date_obj = datetime.strptime(date_str, '%y%m%d')
-        # Formatting the datetime object as 'DD.MM.YYYY'
-        formatted_date = date_obj.strftime('%d.%m.%Y')
-        return formatted_date
-
-    except ValueError:
-        # Handle the case where the folder name doesn't match the expected format
-        return None
-
-def extract_sequencer_from_folder(folder_name):
-    name_array = folder_name.split('_')
-    if len(name_array) <= 1 :
-        return ""
-    instrument_id = name_array[1]
-    if instrument_id.startswith("NB501289"):
-        return "nextseq500"
-    elif instrument_id.startswith("M00818"):
-        return "miseq1"
-    elif instrument_id.startswith("M04404"):
-        return "miseq2"
-    elif instrument_id.startswith("A01742"):
-        return "novaseq"
-    else: 
-        return ""
-    
-def check_read_count(row):
-    """ Count above and below requirement samples"""
-    samples_above_requirement = 0
-    samples_below_requirement = 0
-    expected_reading_per_sample = row['Expected Reading Per Sample']
-    sample_read_distribution = row['Read Distribution']
-
-    if expected_reading_per_sample is None or sample_read_distribution is None:
-        return None, None  # No comparison for 'None' types
-    
-    sample_read_distribution = [float(x) for x in sample_read_distribution.split('-')]
-    # Convert from percenatges to actuall read numbers
-    total_read_count = row["Total Read Count in Millions"] * 1000000
-    sample_read_distribution = [x * total_read_count for x in sample_read_distribution]
-    # Drop undetemined reads
-    sample_read_distribution = sample_read_distribution[:-1]
+    rows = [
+        (folder, sample, reads)
+        for folder, record in records.items()
+        for sample, reads in record.sample_reads
+    ]
+    samples = pd.DataFrame(rows, columns=['Project Name', 'Sample', 'Total Reads'])
+    samples = samples.astype({'Project Name': 'string', 'Sample': 'string', 'Total Reads': 'int64'})
+    samples['Fraction'] = samples['Total Reads'] / samples.groupby('Project Name')['Total Reads'].transform('sum')
+    samples['Undetermined'] = (samples['Sample'] == 'undetermined').astype('bool')
+    return samples
+
+def build_barcode_table(records):
+    """
+    Collect the most common unknown barcodes of all run records into a long-format table.
 
-    for sample_reads_count in sample_read_distribution:
-        if sample_reads_count < expected_reading_per_sample:
-            # Number of Samples Above Requirement increased by 1
-            samples_below_requirement += 1  
-        elif sample_reads_count >= expected_reading_per_sample:
-            # Number of Samples Below Requirement increased by 1
-            samples_above_requirement += 1 
+    :param records: Dictionary mapping folder names to their RunStats records.
+    :return: DataFrame with one row per (run, barcode) and the typed columns 'Project Name', 'Rank'
+             (1 for the most common barcode of the run), 'Barcode', 'Count' and 'Percentage' (of the
+             run's unknown barcode reads).
+    """
+    rows = [
+        (folder, rank, barcode, count, percentage)
+        for folder, record in records.items()
+        for rank, (barcode, count, percentage) in enumerate(record.unknown_barcodes, start=1)
+    ]
+    barcodes = pd.DataFrame(rows, columns=['Project Name', 'Rank', 'Barcode', 'Count', 'Percentage'])
+    return barcodes.astype({'Project Name': 'string', 'Rank': 'int64', 'Barcode': 'string', 'Count': 'int64', 'Percentage': 'float64'})
+
+def build_lane_table(records):
+    """
+    Collect the InterOp lane metrics of all run records into a long-format table.
 
-    return samples_above_requirement, samples_below_requirement  # No change in counts
+    :param records: Dictionary mapping folder names to their RunStats records.
+    :return: DataFrame with one row per (run, lane) and the typed columns 'Project Name', 'Lane',
+             'Density' (K/mm²), 'Clusters PF' (%), 'Yields' (Gb) and 'Q 30' (%).
+    """
+    rows = [
+        (folder, *lane_metrics)
+        for folder, record in records.items()
+        for lane_metrics in record.lane_metrics
+    ]
+    lanes = pd.DataFrame(rows, columns=['Project Name', 'Lane', 'Density', 'Clusters PF', 'Yields', 'Q 30'])
+    return lanes.astype({'Project Name': 'string', 'Lane': 'int64', 'Density': 'float64', 'Clusters PF': 'float64', 'Yields': 'float64', 'Q 30': 'float64'})
+
+def count_samples_by_requirement(df, samples):
+    """
+    Count the samples of every run above and below the expected reads per sample of its application.
 
-def calculate_ratios(df):
+    :param df: The DataFrame with the 'Expected Reading Per Sample' column, indexed by the folder names.
+    :param samples: The long-format sample table (see 'build_sample_table').
+    :return: Tuple of Series with the number of samples above and below the requirement, NaN where
+             the application has no requirement or the run has no sample reads.
+    """
+    determined = samples[~samples['Undetermined']]
+    expected = determined['Project Name'].map(df['Expected Reading Per Sample'])
+    has_requirement = expected.notna()
+    above_requirement = (determined['Total Reads'] >= expected)[has_requirement]
+
+    counts = pd.DataFrame({
+        'Project Name': determined.loc[has_requirement, 'Project Name'],
+        'above': above_requirement,
+        'below': ~above_requirement,
+    }).groupby('Project Name').sum()
+    counts = counts.reindex(df.index)
+    return counts['above'], counts['below']
+
+def calculate_ratios(df, kits):
     """
     Calculate ratios of total read count to expected clusters and update the DataFrame.
 
     :param df: The DataFrame to update.
+    :param kits: Series of the resolved sequencing kits of the runs (keys of SEQUENCING_KIT_TO_MAX_CLUSTERS).
     """
     total_read_count = df['Total Read Count in Millions'] * 1e6
     df['Ratio Total Read Count and Expected Cluster'] = (
         total_read_count /
-        df['Sequencing Kit'].str.lower().map(SEQUENCING_KIT_TO_MAX_CLUSTERS)
+        pd.to_numeric(kits.map(SEQUENCING_KIT_TO_MAX_CLUSTERS))
     ).round(2)
 
 def adjust_phix_percentages(df):
@@ -100,14 +104,3 @@ def adjust_phix_percentages(df):
         pd.to_numeric(df['Phix Output Count'], errors='coerce') / total_read_count
     ) * 100
     df[['Phix Output Percent', 'Phix Input']] = df[['Phix Output Percent', 'Phix Input']].round(2)
-
-def read_cache():
-    try:
-        with open(CACHE_FILE_PATH, 'r') as cache_file:
-            return json.load(cache_file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}  # Return an empty dict if the file doesn't exist or is invalid
-
-def write_cache(cache_data):
-    with open(CACHE_FILE_PATH, 'w') as cache_file:
-        json.dump(cache_data, cache_file, indent=4)
@@ -0,0 +1,64 @@
+import openpyxl
+import xlrd
+import warnings
+
+# openpyxl warnings raised by the protocol workbooks, suppressed while a workbook is loaded
+OPENPYXL_IGNORED_WARNINGS = [
+    "Data Validation extension is not supported and will be removed",
+    "Unknown extension is not supported and will be removed",
+]
+
+###############################################################################
+#------------------------- Label-Indexed Workbooks ---------------------------#
+###############################################################################
+
+def read_workbook_label_cells(report_path):
+    """
+    Open an .xls or .xlsx workbook once and collect every text cell with the values to its right.
+
+    The .xlsx files are opened in read-only mode and streamed row by row as value tuples instead of
+    being loaded fully and accessed cell by cell.
+
+    :param report_path: Path to the workbook.
+    :return: List of (label, next value, second next value) tuples of the text cells, in the order the
+             cells are scanned (sheet by sheet, row by row, left to right), so a field found in several
+             cells keeps the value of the last one.
+    """
+    label_cells = []
+    for row in iter_workbook_rows(report_path):
+        for j, cell_value in enumerate(row):
+            if type(cell_value) is not str:
+                continue
+            next_value = row[j + 1] if j + 1 < len(row) else None
+            next_next_value = row[j + 2] if j + 2 < len(row) else None
+            label_cells.append((cell_value, next_value, next_next_value))
+    return label_cells
+
+def iter_workbook_rows(report_path):
+    """
+    Yield the rows of all sheets of a workbook as tuples of cell values.
+
+    :param report_path: Path to the .xls or .xlsx workbook.
+    """
+    if report_path.lower().endswith(".xls"):
+        workbook = xlrd.open_workbook(report_path, on_demand=True)
+        try:
+            for sheet_name in workbook.sheet_names():
+                sheet = workbook.sheet_by_name(sheet_name)
+                for i in range(sheet.nrows):
+                    yield tuple(sheet.row_values(i))
+        finally:
+            workbook.release_resources()
+    else:
+        with warnings.catch_warnings():
+            for message in OPENPYXL_IGNORED_WARNINGS:
+                warnings.filterwarnings("ignore", message=message)
+            workbook = openpyxl.load_workbook(filename=report_path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                # Read-only sheets trust the dimensions stored in the file, which some writers get wrong,
+                # so the rows are read up to the last one actually present
+                sheet.reset_dimensions()
+                yield from sheet.iter_rows(values_only=True)
+        finally:
+            workbook.close()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules import each other from the source folder, as when running 'python src/main.py'
+SRC_FOLDER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_FOLDER_PATH)
@@ -0,0 +1,119 @@
+import gzip
+import random
+
+import pytest
+
+import parsers.fastq_parser as fastq_parser
+import utils.run_folder as run_folder_module
+from parsers.demux_formats import parse_sample_reads
+from parsers.fastq_parser import count_fastq_file, count_fastq_reads_by_sample
+from utils.run_folder import scan_run_folder
+from utils.run_manifest import run_inputs
+from utils.run_stats import RunStats
+from utils.run_watcher import snapshot_run_folder
+
+def fastq_records(reads, seed):
+    """ FASTQ records of varying lengths and qualities, with the read names repeated on some '+' lines """
+    rng = random.Random(seed)
+    records = []
+    for read in range(reads):
+        length = rng.randint(1, 151)
+        sequence = ''.join(rng.choice('ACGTN') for _ in range(length))
+        quality = ''.join(chr(33 + rng.randint(2, 41)) for _ in range(length))
+        plus = f"+read{read}" if read % 3 == 0 else '+'
+        records.append((f"@read{read} 1:N:0:ACGT", sequence, plus, quality))
+    return records
+
+def expected_counts(records):
+    return (
+        len(records),
+        sum(len(sequence) for _, sequence, _, _ in records),
+        sum(ord(character) - 33 >= 30 for _, _, _, quality in records for character in quality),
+    )
+
+def write_fastq(path, records):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(path, 'wt') as fastq_file:
+        fastq_file.writelines(f"{line}\n" for record in records for line in record)
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 64, 4096, 1 << 20])
+def test_count_fastq_file(tmp_path, chunk_size):
+    records = fastq_records(300, seed=chunk_size)
+    path = tmp_path / 'Sample-1_S1_L001_R1_001.fastq.gz'
+    write_fastq(path, records)
+    assert count_fastq_file(str(path), chunk_size=chunk_size) == expected_counts(records)
+
+def test_count_empty_fastq_file(tmp_path):
+    path = tmp_path / 'Sample-1_S1_R1_001.fastq.gz'
+    write_fastq(path, [])
+    assert count_fastq_file(str(path)) == (0, 0, 0)
+
+@pytest.fixture
+def run_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(fastq_parser, 'FASTQ_FOLDER_PATH', str(tmp_path / 'fastq'))
+    monkeypatch.setattr(run_folder_module, 'FASTQ_FOLDER_PATH', str(tmp_path / 'fastq'))
+    monkeypatch.setattr(fastq_parser, 'FASTQ_COUNTS_CACHE_FOLDER_PATH', str(tmp_path / 'fastq_counts'))
+    return tmp_path / 'fastq' / '240101_NB501289_0001_AHXXXXBGXY'
+
+def test_count_fastq_reads_by_sample(run_folder, monkeypatch):
+    files = {
+        'Project/Sample-2_S2_L001_R1_001.fastq.gz': fastq_records(20, seed=1),
+        'Project/Sample-2_S2_L002_R1_001.fastq.gz': fastq_records(30, seed=2),
+        'Project/Sample-2_S2_L001_R2_001.fastq.gz': fastq_records(20, seed=3),
+        'Project/Sample-1_S1_L001_R1_001.fastq.gz': fastq_records(10, seed=4),
+        'Project/Sample-1_S1_L001_I1_001.fastq.gz': fastq_records(10, seed=5),
+        'Undetermined_S0_L001_R1_001.fastq.gz': fastq_records(5, seed=6),
+        'InterOp/Ignored_S9_L001_R1_001.fastq.gz': fastq_records(5, seed=7),
+    }
+    for name, records in files.items():
+        write_fastq(run_folder / name, records)
+
+    df = count_fastq_reads_by_sample(run_folder.name)
+    assert df['Sample'].tolist() == ['Sample-1', 'Sample-2', 'undetermined']
+    # The reads are the R1 reads, the yield and Q30 bases are summed over the read files (not the index reads)
+    assert df['total'].tolist() == [10, 50, 5]
+    sample_2 = [expected_counts(files[f"Project/Sample-2_S2_{read}_001.fastq.gz"]) for read in ['L001_R1', 'L002_R1', 'L001_R2']]
+    assert df.loc[1, 'total_yield'] == sum(bases for _, bases, _ in sample_2)
+    assert df.loc[1, 'yieldQ30'] == sum(q30_bases for _, _, q30_bases in sample_2)
+
+    # Unchanged files are read from the cache
+    monkeypatch.setattr(fastq_parser, 'count_fastq_file', None)
+    cached = count_fastq_reads_by_sample(run_folder.name)
+    assert cached.to_dict('records') == df.to_dict('records')
+
+def test_truncated_fastq_file(run_folder):
+    write_fastq(run_folder / 'Sample-1_S1_R1_001.fastq.gz', fastq_records(50, seed=1))
+    truncated_path = run_folder / 'Sample-2_S2_R1_001.fastq.gz'
+    write_fastq(truncated_path, fastq_records(500, seed=2))
+    content = truncated_path.read_bytes()
+    truncated_path.write_bytes(content[:len(content) // 2])
+
+    assert fastq_parser.try_count_fastq_file(str(truncated_path)) is None
+    assert count_fastq_reads_by_sample(run_folder.name) is None
+    # The counts of an incomplete run aren't cached
+    assert not (run_folder.parent.parent / 'fastq_counts').exists()
+
+def test_bcl2fastq_run_without_multiqc_report(run_folder):
+    """ A bcl2fastq run always has Stats.json, its reads are counted from the FASTQ files until MultiQC ran """
+    write_fastq(run_folder / 'Project/Sample-1_S1_L001_R1_001.fastq.gz', fastq_records(30, seed=1))
+    write_fastq(run_folder / 'Project/Sample-2_S2_L001_R1_001.fastq.gz', fastq_records(10, seed=2))
+    write_fastq(run_folder / 'Undetermined_S0_L001_R1_001.fastq.gz', fastq_records(10, seed=3))
+    (run_folder / 'Stats').mkdir()
+    (run_folder / 'Stats/Stats.json').write_text('{"UnknownBarcodes": []}')
+
+    artifacts = scan_run_folder(run_folder.name)
+    assert set(artifacts) == {'stats'}
+    record = parse_sample_reads(RunStats(), run_folder.name, artifacts)
+    assert record.sample_reads == [['Sample-1', 30], ['Sample-2', 10], ['undetermined', 10]]
+    assert record.read_distribution == '60.0-20.0-20.0'
+    # The FASTQ files are an input of the run and watched, until the MultiQC report appears
+    assert run_inputs(run_folder.name, artifacts, None)['fastq'].count == 3
+    assert snapshot_run_folder(run_folder.name)[-1][2] == 3
+
+    multiqc_path = run_folder / 'multiqc/multiqc_data/multiqc_bcl2fastq_bysample.txt'
+    multiqc_path.parent.mkdir(parents=True)
+    multiqc_path.write_text('Sample\ttotal\nSample-1\t300\nSample-2\t100\nundetermined\t100\n')
+    artifacts = scan_run_folder(run_folder.name)
+    assert parse_sample_reads(RunStats(), run_folder.name, artifacts).sample_reads[0] == ['Sample-1', 300]
+    assert run_inputs(run_folder.name, artifacts, None)['fastq'] is None
+    assert snapshot_run_folder(run_folder.name)[-1] is None
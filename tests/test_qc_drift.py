@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from config import QC_DRIFT_METRICS
+from utils.qc_drift import drift_runs, score_new_runs, score_runs
+
+def statistics(runs=300, seed=1):
+    """ A post-processed statistics DataFrame with the drift metrics of several sequencers, with gaps and ties """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Date': pd.Timestamp('2022-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 700, runs)), unit='D'),
+        'Sequencer': rng.choice(['novaseq', 'nextseq', 'miseq'], runs),
+        'CV': rng.normal(10, 2, runs).round(2),
+        'Q 30': rng.normal(90, 1.5, runs).round(2),
+        'Undetermined Reads Percentage': rng.gamma(2, 2, runs).round(2),
+        'Phix Output Percent': rng.normal(1, 0.2, runs).round(2),
+        'Phix Input': rng.choice([1.0, 1.0, 0.5], runs),
+        'Ratio Total Read Count and Expected Cluster': rng.choice([0.8, 0.9, 1.0, 1.1], runs),
+    }, index=pd.Index([f"Project_{i:04d}" for i in range(runs)], name='Project Name'))
+    df.loc[rng.random(runs) < 0.05, 'CV'] = np.nan
+    return df
+
+@pytest.mark.parametrize('scored', [0, 1, 150, 299])
+def test_new_runs_score_like_the_whole_history(scored):
+    runs = drift_runs(statistics())
+    expected, expected_baselines = score_runs(runs)
+
+    if scored:
+        first_scores, baselines = score_runs(runs.iloc[:scored])
+    else:
+        first_scores, baselines = pd.DataFrame(columns=expected.columns), {}
+    new_scores = score_new_runs(runs.iloc[scored:], baselines)
+    scores = pd.concat([first_scores, new_scores], ignore_index=True)
+
+    key = ['Project Name', 'Metric']
+    expected = expected.sort_values(key).reset_index(drop=True)
+    scores = scores.sort_values(key).reset_index(drop=True)
+    assert scores[key].values.tolist() == expected[key].values.tolist()
+    for column in ['Value', 'Baseline', 'Z Score', 'EWMA Z']:
+        np.testing.assert_allclose(scores[column].astype(float), expected[column].astype(float), rtol=1e-9, atol=1e-9, err_msg=column)
+
+    assert baselines.keys() == expected_baselines.keys()
+    for baseline_key, expected_baseline in expected_baselines.items():
+        np.testing.assert_allclose(baselines[baseline_key]['window'], expected_baseline['window'])
+        if expected_baseline['ewma'] is None:
+            assert baselines[baseline_key]['ewma'] is None
+        else:
+            assert baselines[baseline_key]['ewma'] == pytest.approx(expected_baseline['ewma'])
+
+def test_runs_without_a_date_are_not_scored():
+    df = statistics(runs=20)
+    df.iloc[3, df.columns.get_loc('Date')] = pd.NaT
+    runs = drift_runs(df)
+    assert df.index[3] not in runs.index
+    assert runs['Date'].is_monotonic_increasing
+    assert list(runs.columns) == ['Date', 'Sequencer'] + list(QC_DRIFT_METRICS)
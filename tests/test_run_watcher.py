@@ -0,0 +1,48 @@
+import os
+
+import parsers.fastq_parser as fastq_parser
+import parsers.sciebo_parser as sciebo_parser
+import utils.run_folder as run_folder_module
+import utils.run_watcher as run_watcher
+from utils.run_watcher import snapshot_run_folder, snapshot_sciebo_workbooks, watch_runs
+
+class StopWatching(Exception):
+    pass
+
+def test_snapshot_includes_the_interop_files(tmp_path, monkeypatch):
+    for module in (fastq_parser, run_folder_module):
+        monkeypatch.setattr(module, 'FASTQ_FOLDER_PATH', str(tmp_path))
+    run_folder = tmp_path / '240101_NB501289_0001_AHXXXXBGXY'
+    (run_folder / 'Stats').mkdir(parents=True)
+    (run_folder / 'Stats/Stats.json').write_text('{}')
+    before = snapshot_run_folder(run_folder.name)
+
+    (run_folder / 'InterOp').mkdir()
+    (run_folder / 'InterOp/QMetricsOut.bin').write_bytes(b'\x06')
+    assert snapshot_run_folder(run_folder.name) != before
+
+def test_late_sciebo_workbook_triggers_a_build(tmp_path, monkeypatch):
+    monkeypatch.setattr(sciebo_parser, 'SCIEBO_FOLDER_PATH', str(tmp_path))
+    monkeypatch.setattr(run_watcher, 'snapshot_run_outputs', lambda: {})
+    (tmp_path / '240101_A_RNAseq.xlsx').write_bytes(b'')
+    os.utime(tmp_path / '240101_A_RNAseq.xlsx', (1e9, 1e9))
+    before = snapshot_sciebo_workbooks()
+
+    builds = []
+    def build(deferred):
+        builds.append(deferred)
+        # A workbook synced in late keeps its older mtime
+        (tmp_path / '231201_B_WGS.xls').write_bytes(b'')
+        os.utime(tmp_path / '231201_B_WGS.xls', (1e8, 1e8))
+
+    polls = iter(range(2))
+    def sleep(seconds):
+        if next(polls, None) is None:
+            raise StopWatching
+    monkeypatch.setattr(run_watcher.time, 'sleep', sleep)
+    try:
+        watch_runs(build, settle_seconds=60)
+    except StopWatching:
+        pass
+    assert len(builds) == 2
+    assert snapshot_sciebo_workbooks()[0] == before[0]
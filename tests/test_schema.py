@@ -0,0 +1,30 @@
+import pytest
+
+from utils.schema import normalize_report_fields, parse_number, parse_percentage
+
+@pytest.mark.parametrize('value, number', [
+    ('112 K/mm²', 112.0),
+    ('1,100 K/mm²', 1100.0),
+    ('1,234,567 reads', 1234567.0),
+    ('1,100.5', 1100.5),
+    ('23,9', 23.9),
+    ('0,950', 0.95),
+    ('1,1000', 1.1),
+    ('95.2 %', 95.2),
+    (42, 42.0),
+    ('n/a', None),
+    (None, None),
+])
+def test_parse_number(value, number):
+    assert parse_number(value) == number
+
+def test_parse_percentage():
+    assert parse_percentage('0,93') == pytest.approx(93.0)
+    assert parse_percentage('1') == 1.0
+
+def test_xls_and_xlsx_q30_are_the_same():
+    # The .xls extractor passes the fraction times 100 as number, the .xlsx extractor as its string
+    xls = normalize_report_fields({'Q 30': 0.952 * 100, 'Clusters PF': 0.8765})
+    xlsx = normalize_report_fields({'Q 30': str(0.952 * 100), 'Clusters PF': '87,65 %'})
+    assert xls['Q 30'] == xlsx['Q 30'] == 95.2
+    assert xls['Clusters PF'] == xlsx['Clusters PF'] == 87.65
@@ -0,0 +1,19 @@
+import utils.sciebo_cache as sciebo_cache
+from utils.sciebo_cache import get_cached_match, set_cached_match
+
+def test_cached_miss_depends_on_the_candidates(monkeypatch):
+    monkeypatch.setattr(sciebo_cache, '_cache', {})
+    monkeypatch.setattr(sciebo_cache, '_pending', {})
+    candidates = {'/sciebo/240101_A_RNAseq.xlsx': 100.0, '/sciebo/240101_B_ChIPseq.xlsx': 200.0}
+    set_cached_match('240101_NB501289_0001_AHXXXXBGXY', '', candidate_mtimes=candidates)
+
+    assert get_cached_match('240101_NB501289_0001_AHXXXXBGXY', dict(candidates))['path'] == ''
+    # A protocol copied in late keeps its older mtime, it still invalidates the miss
+    added = {**candidates, '/sciebo/240101_C_WGS.xlsx': 1.0}
+    assert get_cached_match('240101_NB501289_0001_AHXXXXBGXY', added) is None
+    modified = {**candidates, '/sciebo/240101_A_RNAseq.xlsx': 300.0}
+    assert get_cached_match('240101_NB501289_0001_AHXXXXBGXY', modified) is None
+
+def test_miss_of_an_older_cache_is_stale(monkeypatch):
+    monkeypatch.setattr(sciebo_cache, '_cache', {'240101_NB501289_0001_AHXXXXBGXY': sciebo_cache.upgrade_entry('')})
+    assert get_cached_match('240101_NB501289_0001_AHXXXXBGXY', {}) is None
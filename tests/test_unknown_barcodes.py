@@ -0,0 +1,53 @@
+import json
+import random
+
+import pytest
+
+from parsers.fastq_parser import (
+    UNKNOWN_BARCODES_TOP_K,
+    aggregate_unknown_barcodes,
+    extract_unknown_barcodes,
+    stream_unknown_barcodes,
+    top_unknown_barcodes,
+)
+
+def write_stats_json(path, lanes=4, barcodes_per_lane=300, seed=1):
+    """ A Stats.json with conversion results before and after the 'UnknownBarcodes' section, and tied counts """
+    rng = random.Random(seed)
+    barcodes = [''.join(rng.choice('ACGTN') for _ in range(8)) + '+' + ''.join(rng.choice('ACGT') for _ in range(8)) for _ in range(500)]
+    stats = {
+        'Flowcell': 'HXXXXDRX3',
+        'ConversionResults': [{'LaneNumber': lane, 'TotalClustersRaw': 1000000, 'DemuxResults': [{'SampleId': f"S{i}", 'NumberReads': i} for i in range(50)]} for lane in range(1, lanes + 1)],
+        'UnknownBarcodes': [
+            {'Lane': lane, 'Barcodes': {barcode: rng.choice([10, 20, 20, 50, 1000]) for barcode in rng.sample(barcodes, barcodes_per_lane)}}
+            for lane in range(1, lanes + 1)
+        ],
+        'ReadInfosForLanes': [{'LaneNumber': lane} for lane in range(1, lanes + 1)],
+    }
+    with open(path, 'w') as stats_file:
+        json.dump(stats, stats_file, indent=2)
+    return stats
+
+@pytest.mark.parametrize('chunk_size', [7, 64, 1000, 1 << 20])
+def test_streamed_top_k_matches_full_load(tmp_path, chunk_size):
+    path = tmp_path / 'Stats.json'
+    write_stats_json(path)
+    with open(path) as stats_file:
+        expected = extract_unknown_barcodes(json.load(stats_file))[:UNKNOWN_BARCODES_TOP_K]
+
+    counts = aggregate_unknown_barcodes(stream_unknown_barcodes(path, chunk_size=chunk_size))
+    # Ties keep their order of first appearance, as with the stable sort
+    assert top_unknown_barcodes(counts, UNKNOWN_BARCODES_TOP_K) == expected
+
+def test_stream_without_unknown_barcodes(tmp_path):
+    path = tmp_path / 'Stats.json'
+    path.write_text(json.dumps({'Flowcell': 'HXXXXDRX3', 'ConversionResults': []}))
+    assert list(stream_unknown_barcodes(path, chunk_size=8)) == []
+
+def test_stream_of_truncated_file(tmp_path):
+    path = tmp_path / 'Stats.json'
+    write_stats_json(path)
+    content = path.read_text()
+    path.write_text(content[:content.index('"ReadInfosForLanes"') - 200])
+    with pytest.raises(ValueError):
+        list(stream_unknown_barcodes(path, chunk_size=64))
@@ -0,0 +1,68 @@
+import os
+import re
+import zipfile
+
+import openpyxl
+
+from utils.workbook_reader import read_workbook_label_cells
+from parsers.sciebo_parser import extract_xlsx_report_fields
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'NGS-07_Template_Sequencing.xlsx')
+
+def fill_template(path, values_by_sheet):
+    """ Fill the cells right of the labels of the protocol template, per sheet, as a protocol is filled in """
+    workbook = openpyxl.load_workbook(TEMPLATE_PATH)
+    for sheet_name, values in values_by_sheet.items():
+        sheet = workbook[sheet_name]
+        for row in sheet.iter_rows():
+            for cell in row:
+                if cell.value in values:
+                    sheet.cell(row=cell.row, column=cell.column + 1).value = values[cell.value]
+    workbook.save(path)
+
+NEXTSEQ_VALUES = {
+    'Sequencing Kit: ': 'NextSeq 500/550 High Output Kit v2.5 (75 Cycles)',
+    'Cycles Read 1': 75,
+    'Density [K/mm²]': 210,
+    'Clusters PF [%]': 88.5,
+    '% >= Q30 [%]': 0.9,
+}
+NOVASEQ_VALUES = {
+    'Sequencing Kit: ': 'NovaSeq 6000 SP Reagent Kit v1.5 (100 cycles)',
+    'Cycles Read 1': 101,
+    'Density [K/mm²]': 310,
+    'Clusters PF [%]': 79.5,
+    '% >= Q30 [%]': 92.4,
+}
+
+def test_label_cells_are_in_scan_order(tmp_path):
+    path = str(tmp_path / '240206_Test_Lab_RNAseq.xlsx')
+    fill_template(path, {'NextSeq, MiSeq': NEXTSEQ_VALUES, 'NovaSeq': NOVASEQ_VALUES})
+
+    label_cells = read_workbook_label_cells(path)
+    cycles_read_1 = [next_value for label, next_value, _ in label_cells if label == 'Cycles Read 1']
+    assert cycles_read_1 == [75, 101]
+
+    # A field found on both sheets keeps the value of the last cell scanned
+    fields = extract_xlsx_report_fields(label_cells, path)
+    assert fields['Sequencing Kit'] == NOVASEQ_VALUES['Sequencing Kit: ']
+    assert fields['Cycles Read 1'] == 101
+    assert fields['Density'] == 310
+    assert fields['Clusters PF'] == 79.5
+    assert fields['Q 30'] == '92.4'
+
+def test_rows_beyond_the_stored_dimensions_are_read(tmp_path):
+    filled_path = str(tmp_path / 'filled.xlsx')
+    fill_template(filled_path, {'NextSeq, MiSeq': NEXTSEQ_VALUES})
+
+    # Rewrite the stored dimensions of the sheets to a single cell, as some writers do
+    path = str(tmp_path / '240206_Test_Lab_RNAseq.xlsx')
+    with zipfile.ZipFile(filled_path) as source, zipfile.ZipFile(path, 'w') as target:
+        for item in source.infolist():
+            content = source.read(item.filename)
+            if item.filename.startswith('xl/worksheets/sheet'):
+                content = re.sub(rb'<dimension ref="[^"]*" ?/>', b'<dimension ref="A1"/>', content)
+            target.writestr(item, content)
+
+    label_cells = read_workbook_label_cells(path)
+    assert ('Cycles Read 1', 75, None) in label_cells